@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import ProfiloAtleta, Attivita, TaskSettings, LogSistema, Scarpa, Allenamento, Partecipazione, CommentoAllenamento
+from .models import ProfiloAtleta, Attivita, TaskSettings, LogSistema, EventoStrava, QuotaStrava, JobSincronizzazione, StatoBackfill, AggregatoAtleta, Scarpa, ImprontaDatiStrava, Allenamento, Partecipazione, CommentoAllenamento
 from .forms import AllenamentoForm
 from allauth.socialaccount.models import SocialAccount, SocialToken
 from django.utils import timezone
@@ -86,12 +86,45 @@ class LogSistemaAdmin(admin.ModelAdmin):
     list_filter = ('livello', 'azione', 'data')
     search_fields = ('messaggio', 'utente__username', 'azione')
 
+@admin.register(EventoStrava)
+class EventoStravaAdmin(admin.ModelAdmin):
+    list_display = ('data_ricezione', 'object_type', 'aspect_type', 'object_id', 'owner_id', 'stato', 'tentativi')
+    list_filter = ('stato', 'object_type', 'aspect_type')
+    search_fields = ('object_id', 'owner_id')
+
+@admin.register(QuotaStrava)
+class QuotaStravaAdmin(admin.ModelAdmin):
+    list_display = ('finestra', 'usate', 'scadenza')
+
+@admin.register(JobSincronizzazione)
+class JobSincronizzazioneAdmin(admin.ModelAdmin):
+    list_display = ('data_creazione', 'utente', 'tipo', 'stato', 'pagina', 'attivita_importate', 'progresso', 'tentativi')
+    list_filter = ('stato', 'tipo')
+    search_fields = ('utente__username',)
+
+@admin.register(StatoBackfill)
+class StatoBackfillAdmin(admin.ModelAdmin):
+    list_display = ('atleta', 'stato', 'pagine_scaricate', 'attivita_scaricate', 'ts_piu_vecchio', 'data_aggiornamento')
+    list_filter = ('stato',)
+    search_fields = ('atleta__user__username',)
+
+@admin.register(AggregatoAtleta)
+class AggregatoAtletaAdmin(admin.ModelAdmin):
+    list_display = ('atleta', 'periodo', 'data_inizio', 'distanza', 'dislivello', 'carico', 'numero_attivita')
+    list_filter = ('periodo',)
+    search_fields = ('atleta__user__username',)
+
 @admin.register(Scarpa)
 class ScarpaAdmin(admin.ModelAdmin):
     list_display = ('nome', 'atleta', 'brand', 'modello_normalizzato', 'distanza', 'primary', 'retired')
     list_filter = ('brand', 'primary', 'retired')
     search_fields = ('nome', 'atleta__user__username')
 
+@admin.register(ImprontaDatiStrava)
+class ImprontaDatiStravaAdmin(admin.ModelAdmin):
+    list_display = ('atleta', 'etag', 'hash_scarpe', 'data_aggiornamento')
+    search_fields = ('atleta__user__username',)
+
 @admin.register(Allenamento)
 class AllenamentoAdmin(admin.ModelAdmin):
     form = AllenamentoForm  # Usa il form personalizzato con widget datetime-local
@@ -0,0 +1,184 @@
+"""
+Rollup per atleta (AggregatoAtleta): totali per giorno, settimana e anno.
+Aggiornati in modo incrementale (solo i periodi toccati) quando un'attività viene creata, modificata
+o cancellata; la dashboard li legge con una sola query invece di una catena di aggregate().
+"""
+from datetime import datetime, timedelta
+
+from django.db import transaction
+from django.db.models import Count, ExpressionWrapper, F, FloatField, Q, Sum
+from django.db.models.functions import ExtractYear, TruncDate, TruncWeek, TruncYear
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import AggregatoAtleta, Attivita
+
+# Km Sforzo: 1 km in piano + 1 km ogni 100 m di D+
+CARICO = ExpressionWrapper(F('distanza') / 1000.0 + F('dislivello') / 100.0, output_field=FloatField())
+
+
+def giorno_attivita(valore):
+    """Data locale di un'attività (accetta date, datetime naive/aware o stringhe ISO di Strava)."""
+    if isinstance(valore, str):
+        valore = parse_datetime(valore)
+    if isinstance(valore, datetime):
+        if timezone.is_aware(valore):
+            valore = timezone.localtime(valore)
+        return valore.date()
+    return valore
+
+
+def inizio_settimana(giorno):
+    return giorno - timedelta(days=giorno.weekday())
+
+
+def inizio_anno(giorno):
+    return giorno.replace(month=1, day=1)
+
+
+def _fine_periodo(periodo, inizio):
+    if periodo == 'G':
+        return inizio + timedelta(days=1)
+    if periodo == 'S':
+        return inizio + timedelta(days=7)
+    return inizio.replace(year=inizio.year + 1)
+
+
+TRONCAMENTI = {'G': TruncDate, 'S': TruncWeek, 'A': TruncYear}
+
+
+def _calcola_righe(atleta_id, periodo, inizi=None):
+    """
+    Totali del periodo per l'atleta, raggruppati nel DB. inizi=None calcola tutti i periodi (ricostruzione completa).
+    """
+    qs = Attivita.objects.filter(atleta_id=atleta_id)
+    if inizi is not None:
+        filtro = Q()
+        for inizio in inizi:
+            filtro |= Q(data__gte=inizio, data__lt=_fine_periodo(periodo, inizio))
+        qs = qs.filter(filtro)
+
+    righe = (
+        qs.annotate(bucket=TRONCAMENTI[periodo]('data'))
+        .values('bucket')
+        .annotate(
+            tot_distanza=Sum('distanza'),
+            tot_dislivello=Sum('dislivello'),
+            tot_durata=Sum('durata'),
+            tot_carico=Sum(CARICO),
+            numero=Count('id'),
+        )
+    )
+    return [
+        AggregatoAtleta(
+            atleta_id=atleta_id,
+            periodo=periodo,
+            data_inizio=giorno_attivita(r['bucket']),
+            distanza=r['tot_distanza'] or 0,
+            dislivello=r['tot_dislivello'] or 0,
+            durata=r['tot_durata'] or 0,
+            carico=r['tot_carico'] or 0,
+            numero_attivita=r['numero'],
+        )
+        for r in righe
+    ]
+
+
+def _salva_righe(righe):
+    AggregatoAtleta.objects.bulk_create(
+        righe,
+        update_conflicts=True,
+        unique_fields=['atleta', 'periodo', 'data_inizio'],
+        update_fields=['distanza', 'dislivello', 'durata', 'carico', 'numero_attivita'],
+    )
+
+
+def aggiorna_aggregati(atleta_id, date_attivita):
+    """Ricalcola solo i giorni, le settimane e gli anni che contengono le date indicate."""
+    giorni = {giorno_attivita(d) for d in date_attivita if d}
+    if not atleta_id or not giorni:
+        return
+
+    periodi = {
+        'G': giorni,
+        'S': {inizio_settimana(g) for g in giorni},
+        'A': {inizio_anno(g) for g in giorni},
+    }
+    with transaction.atomic():
+        for periodo, inizi in periodi.items():
+            righe = _calcola_righe(atleta_id, periodo, inizi)
+            _salva_righe(righe)
+            # Periodi rimasti senza attività (es. dopo una cancellazione)
+            vuoti = inizi - {r.data_inizio for r in righe}
+            if vuoti:
+                AggregatoAtleta.objects.filter(atleta_id=atleta_id, periodo=periodo, data_inizio__in=vuoti).delete()
+
+
+def ricostruisci_aggregati(atleta_id):
+    """Ricostruzione completa dei rollup di un atleta."""
+    with transaction.atomic():
+        AggregatoAtleta.objects.filter(atleta_id=atleta_id).delete()
+        for periodo in TRONCAMENTI:
+            _salva_righe(_calcola_righe(atleta_id, periodo))
+
+
+def totali_dashboard(profilo, oggi=None):
+    """
+    Totali per la dashboard con una sola query sui rollup: volume totale, anno e settimana correnti,
+    carico acuto (7 giorni) e cronico (28 giorni) per l'ACWR.
+    """
+    oggi = oggi or timezone.now().date()
+    settimana = inizio_settimana(oggi)
+    anno = inizio_anno(oggi)
+    inizio_cronico = oggi - timedelta(days=27)
+    inizio_acuto = oggi - timedelta(days=6)
+
+    righe = AggregatoAtleta.objects.filter(atleta=profilo).filter(
+        Q(periodo='A')
+        | Q(periodo='S', data_inizio=settimana)
+        | Q(periodo='G', data_inizio__gte=inizio_cronico, data_inizio__lte=oggi)
+    ).values('periodo', 'data_inizio', 'distanza', 'dislivello', 'carico')
+
+    totali = {
+        'totale_metri': 0, 'dislivello_totale': 0,
+        'annuale_metri': 0, 'dislivello_annuale': 0,
+        'dislivello_settimanale': 0,
+        'carico_acuto': 0, 'carico_cronico_totale': 0,
+    }
+    for r in righe:
+        if r['periodo'] == 'A':
+            totali['totale_metri'] += r['distanza']
+            totali['dislivello_totale'] += r['dislivello']
+            if r['data_inizio'] == anno:
+                totali['annuale_metri'] = r['distanza']
+                totali['dislivello_annuale'] = r['dislivello']
+        elif r['periodo'] == 'S':
+            totali['dislivello_settimanale'] = r['dislivello']
+        else:
+            totali['carico_cronico_totale'] += r['carico']
+            if r['data_inizio'] >= inizio_acuto:
+                totali['carico_acuto'] += r['carico']
+    return totali
+
+
+def volumi_ytd(profilo, oggi=None):
+    """
+    Volumi Year To Date degli anni passati (dal 1 gennaio allo stesso giorno di oggi), con una sola query
+    raggruppata per anno sui rollup giornalieri. Restituisce {anno: (distanza_m, dislivello_m)} dal primo
+    anno con attività all'anno scorso; gli anni senza attività valgono 0.
+    """
+    oggi = oggi or timezone.now().date()
+    # Stesso giorno dell'anno: se oggi è il 29 febbraio, negli anni non bisestili si arriva al 28
+    entro_oggi = Q(data_inizio__month__lt=oggi.month) | Q(data_inizio__month=oggi.month, data_inizio__day__lte=oggi.day)
+
+    righe = (
+        AggregatoAtleta.objects.filter(atleta=profilo, periodo='G', data_inizio__lt=inizio_anno(oggi))
+        .annotate(anno=ExtractYear('data_inizio'))
+        .values('anno')
+        # Il filtro sta nella Sum (non nel WHERE) così compaiono anche gli anni con attività solo dopo oggi
+        .annotate(distanza_ytd=Sum('distanza', filter=entro_oggi), dislivello_ytd=Sum('dislivello', filter=entro_oggi))
+    )
+    per_anno = {r['anno']: (r['distanza_ytd'] or 0, r['dislivello_ytd'] or 0) for r in righe}
+    if not per_anno:
+        return {}
+    return {anno: per_anno.get(anno, (0, 0)) for anno in range(oggi.year - 1, min(per_anno) - 1, -1)}
@@ -0,0 +1,91 @@
+"""
+Calcoli batch per la dashboard coach.
+Invece di interrogare il DB atleta per atleta (potenza, trend, ACWR, potenziale gara), carichiamo le finestre
+di attività di tutta la squadra con poche query (window function per le "ultime N") e calcoliamo in memoria.
+"""
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
+
+from .models import Attivita
+from .utils import calcola_trend_da_attivita, classifica_potenziale_gara
+
+ATTIVITA_POTENZA = 30  # Potenza media recente sulle ultime 30 attività
+ATTIVITA_TREND = 20  # Trend: ultime 5 contro le precedenti 15
+GIORNI_POTENZIALE = 45
+CAMPI_TREND = Attivita.CAMPI_SNAPSHOT  # Gli stessi campi decidono quando invalidare gli snapshot
+
+
+def _ultime_attivita(atleti_ids, limite, prima_di=None):
+    """Ultime `limite` attività di ogni atleta in una sola query, raggruppate per atleta (dalla più recente)."""
+    qs = Attivita.objects.filter(atleta_id__in=atleti_ids)
+    if prima_di:
+        qs = qs.filter(data__lt=prima_di)
+    qs = (
+        qs.only(*CAMPI_TREND)
+        .annotate(posizione=Window(RowNumber(), partition_by=[F('atleta_id')], order_by=F('data').desc()))
+        .filter(posizione__lte=limite)
+        .order_by('atleta_id', 'posizione')
+    )
+    per_atleta = defaultdict(list)
+    for act in qs:
+        per_atleta[act.atleta_id].append(act)
+    return per_atleta
+
+
+def _potenza_media(attivita):
+    p_vals = [act.potenza_media for act in attivita if act.potenza_media and act.potenza_media > 0]
+    return int(sum(p_vals) / len(p_vals)) if p_vals else 0
+
+
+def analizza_atleti_batch(atleti_ids, cutoff_date, acwr_ref_date):
+    """
+    Potenza, trend, carico ACWR e potenziale gara per tutti gli atleti indicati.
+    Restituisce {atleta_id: {'power', 'trends', 'load_acute', 'load_chronic_total', 'potenziale'}}.
+    Stessa logica di calcola_trend_atleta e stima_potenziale_gara, con 2-3 query in totale.
+    """
+    atleti_ids = list(atleti_ids)
+    now = timezone.now()
+
+    # 1. Ultime 30 attività (potenza). Se il cutoff è nel futuro le ultime 20 per i trend sono le prime 20 di queste.
+    recenti = _ultime_attivita(atleti_ids, ATTIVITA_POTENZA)
+    if cutoff_date >= now:
+        per_trend = {a_id: acts[:ATTIVITA_TREND] for a_id, acts in recenti.items()}
+    else:
+        per_trend = _ultime_attivita(atleti_ids, ATTIVITA_TREND, prima_di=cutoff_date)
+
+    # 2. Finestra di carico (ACWR 28 giorni) e volume (potenziale gara 45 giorni) con un'unica query
+    start_acute = acwr_ref_date - timedelta(days=7)
+    start_chronic = acwr_ref_date - timedelta(days=28)
+    start_potenziale = now - timedelta(days=GIORNI_POTENZIALE)
+    finestra = Attivita.objects.filter(
+        atleta_id__in=atleti_ids,
+        data__gte=min(start_chronic, start_potenziale),
+    ).values_list('atleta_id', 'data', 'distanza', 'dislivello')
+
+    risultati = {
+        a_id: {'load_acute': 0, 'load_chronic_total': 0, 'totale_45': 0, 'lungo_45': 0, 'attivita_45': 0}
+        for a_id in atleti_ids
+    }
+    for atleta_id, data, distanza, dislivello in finestra:
+        r = risultati[atleta_id]
+        if start_chronic <= data < acwr_ref_date:
+            load_val = distanza / 1000 + dislivello / 100  # Km Sforzo
+            r['load_chronic_total'] += load_val
+            if data >= start_acute:
+                r['load_acute'] += load_val
+        if data >= start_potenziale:
+            r['attivita_45'] += 1
+            r['totale_45'] += distanza
+            r['lungo_45'] = max(r['lungo_45'], distanza)
+
+    for atleta_id, r in risultati.items():
+        r['power'] = _potenza_media(recenti.get(atleta_id, []))
+        r['trends'] = calcola_trend_da_attivita(per_trend.get(atleta_id, []))
+        r['potenziale'] = (
+            classifica_potenziale_gara(r['totale_45'], r['lungo_45']) if r['attivita_45'] else "Non Classificato"
+        )
+    return risultati
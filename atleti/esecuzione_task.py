@@ -0,0 +1,94 @@
+"""
+Limiti di concorrenza dei task dello scheduler.
+Ogni esecuzione (pianificata o manuale) passa da esegui_task, che applica:
+- il numero massimo di istanze contemporanee per task (LIMITI_TASK, default 1);
+- i gruppi a mutua esclusione (GRUPPI_ESCLUSIVI): due task dello stesso gruppo non girano insieme.
+Se il task ha già tutte le sue istanze in corso l'esecuzione viene saltata. Se è occupato solo il gruppo,
+le esecuzioni pianificate aspettano che si liberi (al più SCHEDULER_ATTESA_GRUPPI secondi) invece di perdere
+il turno; i task indipendenti non aspettano mai quelli lenti. I task manuali non aspettano (l'heartbeat
+li riprova) e girano su un pool dedicato, così l'heartbeat non resta bloccato.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+# Istanze contemporanee ammesse per task (chi non è elencato: 1). Es. {'elabora_eventi_strava': 2}
+LIMITI_TASK = {}
+
+# Task che non devono girare in contemporanea
+GRUPPI_ESCLUSIVI = {
+    # Consumano quota Strava in blocco: in parallelo si toglierebbero il budget a vicenda
+    'quota_strava': {'sync_strava_periodico', 'repair_strava_settimanale', 'ricalcolo_vam_notturno'},
+    # Ricalcoli pesanti sulle stesse righe di Attivita
+    'ricalcoli_attivita': {'ricalcolo_vam_notturno', 'ricalcolo_stats_notturno'},
+}
+
+_lock = threading.Lock()
+_liberato = threading.Condition(_lock)  # Notificata a ogni fine esecuzione
+_in_corso = {}  # task_id -> istanze in esecuzione
+_gruppi_occupati = set()
+_pool_manuali = None
+
+
+def _gruppi(task_id):
+    return {nome for nome, tasks in GRUPPI_ESCLUSIVI.items() if task_id in tasks}
+
+
+def _prenota(task_id, attesa=0):
+    """Gruppi prenotati, o None se il task è al limite di istanze o il gruppo resta occupato oltre attesa secondi."""
+    gruppi = _gruppi(task_id)
+    limite = LIMITI_TASK.get(task_id, 1)
+    with _liberato:
+        # Task già in corso: un'altra esecuzione in coda duplicherebbe solo il lavoro
+        if _in_corso.get(task_id, 0) >= limite:
+            return None
+        libero = lambda: _in_corso.get(task_id, 0) < limite and not gruppi & _gruppi_occupati
+        if not _liberato.wait_for(libero, timeout=attesa):
+            return None
+        _in_corso[task_id] = _in_corso.get(task_id, 0) + 1
+        _gruppi_occupati.update(gruppi)
+        return gruppi
+
+
+def _rilascia(task_id, gruppi):
+    with _liberato:
+        _in_corso[task_id] -= 1
+        _gruppi_occupati.difference_update(gruppi)
+        _liberato.notify_all()
+
+
+def in_esecuzione(task_id):
+    with _lock:
+        return _in_corso.get(task_id, 0) > 0
+
+
+def esegui_task(task_id, func, *args, attesa=0, **kwargs):
+    """
+    Esegue func rispettando i limiti del task. Restituisce False (senza eseguire) se il task ha già
+    raggiunto le sue istanze, o se un task dello stesso gruppo è ancora in corso dopo attesa secondi.
+    Le eccezioni di func si propagano.
+    """
+    gruppi = _prenota(task_id, attesa)
+    if gruppi is None:
+        logger.warning(f"SCHEDULER: '{task_id}' saltato: già in esecuzione o gruppo esclusivo occupato (attesa {attesa}s).")
+        return False
+    try:
+        func(*args, **kwargs)
+        return True
+    finally:
+        _rilascia(task_id, gruppi)
+        close_old_connections()
+
+
+def pool_manuali():
+    """Pool dei task avviati a mano (creato al primo uso)."""
+    global _pool_manuali
+    with _lock:
+        if _pool_manuali is None:
+            _pool_manuali = ThreadPoolExecutor(max_workers=settings.SCHEDULER_WORKERS_MANUALI, thread_name_prefix='task-manuale')
+        return _pool_manuali
@@ -0,0 +1,129 @@
+"""
+Media mobile del VO2max per atleta (FinestraVO2max).
+Per ogni atleta si tengono le ultime DIMENSIONE attività con VO2max (tutte e solo strada) come lista
+ordinata dalla più recente. Quando un'attività viene aggiunta, modificata o cancellata la lista si aggiorna
+in memoria e i campi vo2max_stima_statistica / vo2max_strada del profilo vengono riscritti solo se cambiano:
+la finestra si rilegge dal DB solo quando esce un'attività da una finestra piena (serve la successiva).
+Le cancellazioni (crea=False) aggiornano solo righe esistenti: durante la cancellazione a cascata di un
+atleta la finestra non va ricreata.
+"""
+from datetime import datetime
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Attivita, FinestraVO2max, ProfiloAtleta
+
+DIMENSIONE = 60  # Ultime attività valide (stagionale)
+MINIMO = 3  # Sotto questo numero la media non è significativa
+TIPO_STRADA = 'Run'
+
+
+def _istante(valore):
+    """Data dell'attività come stringa ISO confrontabile (le date Strava arrivano come stringhe con 'Z')."""
+    if isinstance(valore, str):
+        valore = parse_datetime(valore)
+    if isinstance(valore, datetime) and timezone.is_aware(valore):
+        # Come la salva il DB (USE_TZ=False): ora locale senza fuso
+        valore = timezone.make_naive(valore)
+    return valore.isoformat(timespec='microseconds')
+
+
+def _carica(atleta_id, solo_strada):
+    qs = Attivita.objects.filter(atleta_id=atleta_id, vo2max_stimato__isnull=False)
+    if solo_strada:
+        qs = qs.filter(tipo_attivita=TIPO_STRADA)
+    righe = qs.order_by('-data', '-id').values_list('data', 'id', 'vo2max_stimato')[:DIMENSIONE]
+    return [[_istante(data), pk, vo2] for data, pk, vo2 in righe]
+
+
+def media(voci):
+    if len(voci) < MINIMO:
+        return None
+    return round(sum(v[2] for v in voci) / len(voci), 1)
+
+
+def _applica(voci, pk, istante, vo2):
+    """
+    Aggiorna la lista (ordinata dalla più recente) con il nuovo valore dell'attività pk (vo2=None: esce).
+    Restituisce False se la finestra era piena e ha perso un elemento: va ricaricata dal DB.
+    """
+    piena = len(voci) >= DIMENSIONE
+    prima = len(voci)
+    voci[:] = [v for v in voci if v[1] != pk]
+    # Un'attività uscita da una finestra piena lascia un posto che spetta alla prima attività fuori finestra
+    liberato = piena and len(voci) < prima
+
+    if vo2 is not None:
+        chiave = (istante, pk)
+        if len(voci) < DIMENSIONE or chiave > tuple(voci[-1][:2]):
+            posizione = next((i for i, v in enumerate(voci) if chiave > tuple(v[:2])), len(voci))
+            voci.insert(posizione, [istante, pk, vo2])
+            del voci[DIMENSIONE:]
+            # In coda al posto liberato potrebbe precederla un'attività rimasta fuori
+            return not (liberato and posizione == len(voci) - 1)
+    return not liberato
+
+
+def _scrivi_profilo(atleta_id, tutte, strada):
+    ProfiloAtleta.objects.filter(pk=atleta_id).update(
+        vo2max_stima_statistica=media(tutte),
+        vo2max_strada=media(strada),
+    )
+
+
+def ricostruisci_finestra_vo2max(atleta_id, crea=True):
+    """
+    Rilegge dal DB entrambe le finestre dell'atleta e aggiorna il profilo.
+    Con crea=False aggiorna solo una finestra già esistente e restituisce None.
+    """
+    tutte, strada = _carica(atleta_id, False), _carica(atleta_id, True)
+    finestra = None
+    if crea:
+        finestra, _ = FinestraVO2max.objects.update_or_create(atleta_id=atleta_id, defaults={'tutte': tutte, 'strada': strada})
+    else:
+        FinestraVO2max.objects.filter(atleta_id=atleta_id).update(tutte=tutte, strada=strada, data_aggiornamento=timezone.now())
+    _scrivi_profilo(atleta_id, tutte, strada)
+    return finestra
+
+
+def aggiorna_finestra_vo2max(atleta_id, modifiche, crea=True):
+    """
+    Applica alla finestra dell'atleta le attività modificate: iterabile di (id, data, vo2max_stimato, tipo_attivita),
+    con vo2max None per le attività cancellate o ora escluse. Restituisce la finestra aggiornata.
+    crea=False (cancellazioni): nessuna finestra nuova, e niente da fare se il profilo non esiste più.
+    """
+    modifiche = list(modifiche)
+    if not modifiche:
+        return None
+
+    with transaction.atomic():
+        if not crea and not ProfiloAtleta.objects.filter(pk=atleta_id).exists():
+            return None
+        finestra = FinestraVO2max.objects.select_for_update().filter(atleta_id=atleta_id).first()
+        # Finestra mai costruita, righe senza PK o troppe modifiche (ricalcolo completo): conviene rileggerla tutta
+        if finestra is None or len(modifiche) > DIMENSIONE or any(m[0] is None for m in modifiche):
+            return ricostruisci_finestra_vo2max(atleta_id, crea=crea)
+
+        medie = (media(finestra.tutte), media(finestra.strada))
+        complete = {'tutte': True, 'strada': True}
+        for pk, data, vo2, tipo in modifiche:
+            istante = _istante(data)
+            complete['tutte'] &= _applica(finestra.tutte, pk, istante, vo2)
+            complete['strada'] &= _applica(finestra.strada, pk, istante, vo2 if tipo == TIPO_STRADA else None)
+
+        if not complete['tutte']:
+            finestra.tutte = _carica(atleta_id, False)
+        if not complete['strada']:
+            finestra.strada = _carica(atleta_id, True)
+        finestra.save(update_fields=['tutte', 'strada', 'data_aggiornamento'])
+
+        if (media(finestra.tutte), media(finestra.strada)) != medie:
+            _scrivi_profilo(atleta_id, finestra.tutte, finestra.strada)
+    return finestra
+
+
+def finestra_atleta(atleta_id):
+    """Finestra corrente dell'atleta (costruita al primo accesso)."""
+    return FinestraVO2max.objects.filter(atleta_id=atleta_id).first() or ricostruisci_finestra_vo2max(atleta_id)
@@ -0,0 +1,87 @@
+"""
+Sincronizzazione condizionale di profilo atleta e scarpe da /athlete.
+Per ogni atleta ImprontaDatiStrava conserva l'ETag dell'ultimo /athlete elaborato per intero (If-None-Match:
+se Strava risponde 304 non c'è nulla da fare) e l'hash delle scarpe ricevute: se la lista non cambia non si
+tocca il DB, altrimenti si scrivono con un solo bulk upsert solo le scarpe nuove o modificate.
+"""
+import hashlib
+import json
+
+from . import rate_limit, strava_client
+from .models import ImprontaDatiStrava, Scarpa
+from .utils import normalizza_scarpa
+
+CAMPI_SCARPA = ['atleta', 'nome', 'distanza', 'primary', 'brand', 'modello_normalizzato', 'retired']
+
+
+def _hash(valore):
+    return hashlib.sha256(json.dumps(valore, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def _impronta(profilo):
+    impronta, _ = ImprontaDatiStrava.objects.get_or_create(atleta=profilo)
+    return impronta
+
+
+def scarica_atleta(profilo, access_token, condizionale=True, timeout=10, priorita=rate_limit.INTERATTIVA):
+    """
+    GET /athlete. Con condizionale=True invia l'ETag dell'ultimo /athlete elaborato per intero:
+    una risposta 304 significa che profilo e scarpe non sono cambiati.
+    Di default interattiva: la chiamano le viste su richiesta dell'utente.
+    """
+    impronta = ImprontaDatiStrava.objects.filter(atleta=profilo).only('etag').first()
+    headers = {'If-None-Match': impronta.etag} if condizionale and impronta and impronta.etag else None
+    return strava_client.get("athlete", access_token=access_token, timeout=timeout, headers=headers, priorita=priorita)
+
+
+def registra_etag(profilo, response):
+    """Da chiamare solo dopo aver elaborato tutta la risposta (profilo e scarpe)."""
+    etag = response.headers.get('ETag', '')
+    ImprontaDatiStrava.objects.update_or_create(atleta=profilo, defaults={'etag': etag})
+
+
+def applica_modifiche(oggetto, **valori):
+    """Assegna i valori diversi da quelli attuali. Restituisce i campi cambiati (per save(update_fields=...))."""
+    cambiati = [campo for campo, valore in valori.items() if getattr(oggetto, campo) != valore]
+    for campo in cambiati:
+        setattr(oggetto, campo, valori[campo])
+    return cambiati
+
+
+def sincronizza_scarpe(profilo, shoes, forza=False):
+    """
+    Allinea le scarpe dell'atleta alla lista di /athlete: quelle assenti diventano dismesse.
+    Restituisce il numero di scarpe scritte (0 se la lista è identica all'ultima elaborata).
+    """
+    impronta = _impronta(profilo)
+    firma = _hash([[s['id'], s['name'], s['distance'], s['primary']] for s in shoes])
+    if firma == impronta.hash_scarpe and not forza:
+        return 0
+
+    # Anche scarpe oggi associate ad altri atleti (strava_id è univoco): come faceva update_or_create
+    esistenti = Scarpa.objects.filter(strava_id__in=[s['id'] for s in shoes]).in_bulk(field_name='strava_id')
+    da_scrivere = []
+    for s in shoes:
+        brand, model = normalizza_scarpa(s['name'])
+        scarpa = esistenti.get(s['id']) or Scarpa(strava_id=s['id'], atleta=profilo)
+        # Se è nella lista, è attiva
+        cambiati = applica_modifiche(
+            scarpa, atleta_id=profilo.id, nome=s['name'], distanza=s['distance'], primary=s['primary'],
+            brand=brand, modello_normalizzato=model, retired=False,
+        )
+        if scarpa.pk is None or cambiati:
+            da_scrivere.append(scarpa)
+
+    if da_scrivere:
+        Scarpa.objects.bulk_create(
+            da_scrivere,
+            update_conflicts=True,
+            unique_fields=['strava_id'],
+            update_fields=CAMPI_SCARPA,
+        )
+    # Le scarpe che abbiamo nel DB ma non sono più nella lista di Strava sono considerate "Dismesse"
+    Scarpa.objects.filter(atleta=profilo, retired=False).exclude(strava_id__in=[s['id'] for s in shoes]).update(retired=True)
+
+    impronta.hash_scarpe = firma
+    impronta.save(update_fields=['hash_scarpe', 'data_aggiornamento'])
+    return len(da_scrivere)
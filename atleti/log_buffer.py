@@ -0,0 +1,110 @@
+"""
+Scrittura asincrona dei LogSistema.
+registra_log mette il record in una coda in memoria e torna subito; un thread in background
+lo salva con bulk_create a blocchi (al più LOG_BUFFER_BATCH righe o ogni LOG_BUFFER_INTERVALLO secondi).
+Alla chiusura del processo (atexit, e SIGTERM nello scheduler) il thread viene fermato e la coda
+svuotata; i log registrati dopo vengono scritti in linea. Con LOG_BUFFER_ASINCRONO=False
+i log vengono scritti subito, come prima (utile in test e nei comandi di debug).
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .models import LogSistema
+
+logger = logging.getLogger(__name__)
+
+_coda = queue.Queue(maxsize=settings.LOG_BUFFER_MAX)
+_stop = threading.Event()
+_lock = threading.Lock()
+_thread = None
+_pid = None
+
+
+def _scrivi(records):
+    try:
+        LogSistema.objects.bulk_create(records, batch_size=settings.LOG_BUFFER_BATCH)
+    except Exception as e:
+        # Il log non deve mai far fallire l'applicazione
+        logger.error(f"LOG BUFFER: Scrittura di {len(records)} log fallita: {e}")
+
+
+def _preleva(timeout):
+    """Attende il primo record fino a timeout, poi prende senza attesa fino a riempire un blocco."""
+    records = []
+    try:
+        records.append(_coda.get(timeout=timeout))
+        while len(records) < settings.LOG_BUFFER_BATCH:
+            records.append(_coda.get_nowait())
+    except queue.Empty:
+        pass
+    return records
+
+
+def _worker():
+    while not _stop.is_set():
+        records = _preleva(settings.LOG_BUFFER_INTERVALLO)
+        if records:
+            _scrivi(records)
+        close_old_connections()
+
+
+def _avvia_thread():
+    """Avvio pigro del thread (una volta per processo: dopo un fork il thread del padre non esiste)."""
+    global _thread, _pid
+    if _thread is not None and _pid == os.getpid() and _thread.is_alive():
+        return
+    with _lock:
+        if _thread is not None and _pid == os.getpid() and _thread.is_alive():
+            return
+        _pid = os.getpid()
+        _thread = threading.Thread(target=_worker, name='log-buffer', daemon=True)
+        _thread.start()
+
+
+def registra_log(livello='INFO', azione='', messaggio='', utente=None):
+    """Sostituto non bloccante di LogSistema.objects.create(...), stessi campi."""
+    record = LogSistema(
+        data=timezone.now(),  # Ora dell'evento, non del flush
+        livello=livello,
+        azione=azione,
+        messaggio=messaggio,
+        utente_id=getattr(utente, 'pk', None),  # Solo l'ID: niente oggetti utente trattenuti in coda
+    )
+    if not settings.LOG_BUFFER_ASINCRONO or _stop.is_set():
+        _scrivi([record])
+        return
+
+    _avvia_thread()
+    try:
+        _coda.put_nowait(record)
+    except queue.Full:
+        # Coda piena (DB lento o fermo): scriviamo in linea invece di perdere il log
+        _scrivi([record])
+
+
+def svuota_log():
+    """Scrive subito tutti i log in coda (chiamata anche all'uscita del processo)."""
+    while True:
+        records = _preleva(0)
+        if not records:
+            return
+        _scrivi(records)
+
+
+@atexit.register
+def chiudi_log_buffer(timeout=None):
+    """Ferma il thread attendendo il blocco in scrittura (al più timeout secondi) e scrive i log rimasti."""
+    _stop.set()
+    thread = _thread
+    if thread is not None and thread.is_alive() and thread is not threading.current_thread():
+        thread.join(settings.LOG_BUFFER_INTERVALLO + 10 if timeout is None else timeout)
+        if thread.is_alive():
+            logger.warning("LOG BUFFER: Il thread di scrittura non si è fermato entro il timeout.")
+    svuota_log()
@@ -0,0 +1,147 @@
+"""
+Rollup giornalieri dei LogSistema per la pagina statistiche_log (StatisticaLogGiornaliera).
+Un job notturno aggrega i giorni chiusi (pagine, utenti, azioni, totale e utenti unici per giorno)
+e applica la retention sui log grezzi, che vengono cancellati solo se il loro giorno è già aggregato.
+"""
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Min, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import LogSistema, StatisticaLogGiornaliera
+from .partizioni_log import elimina_partizioni, tabella_partizionata
+
+logger = logging.getLogger(__name__)
+
+# Task tecnici/automatici esclusi dalle statistiche di utilizzo
+AZIONI_TECNICHE = ['Token Refresh', 'Import Attività', 'Calcolo VAM', 'Download Stream', 'System']
+
+
+def log_utente():
+    """Log generati dagli utenti (esclusi i task tecnici)."""
+    return LogSistema.objects.exclude(azione__in=AZIONI_TECNICHE)
+
+
+def nome_pagina(messaggio):
+    """Nome della pagina dal messaggio "Visita [NomePagina]"."""
+    return messaggio.replace('Visita ', '')[:200]
+
+
+def _righe_giorno(giorno):
+    """Conteggi di un giorno calcolati nel DB (poche query raggruppate)."""
+    qs = log_utente().filter(data__date=giorno)
+    righe = []
+
+    pagine = defaultdict(int)
+    for r in qs.filter(azione='Page View').values('messaggio').annotate(n=Count('id')):
+        pagine[nome_pagina(r['messaggio'])] += r['n']
+    righe += [StatisticaLogGiornaliera(giorno=giorno, tipo='pagina', chiave=p, conteggio=n) for p, n in pagine.items()]
+
+    for r in qs.exclude(utente__isnull=True).values('utente_id').annotate(n=Count('id')):
+        righe.append(StatisticaLogGiornaliera(giorno=giorno, tipo='utente', chiave=str(r['utente_id']), utente_id=r['utente_id'], conteggio=r['n']))
+
+    for r in qs.exclude(azione='Page View').values('azione').annotate(n=Count('id')):
+        righe.append(StatisticaLogGiornaliera(giorno=giorno, tipo='azione', chiave=r['azione'], conteggio=r['n']))
+
+    totali = qs.aggregate(totale=Count('id'), univoci=Count('utente', distinct=True))
+    righe.append(StatisticaLogGiornaliera(giorno=giorno, tipo='totale', chiave='', conteggio=totali['totale']))
+    righe.append(StatisticaLogGiornaliera(giorno=giorno, tipo='univoci', chiave='', conteggio=totali['univoci']))
+    return righe
+
+
+def aggrega_giorno(giorno):
+    """(Ri)calcola i rollup di un giorno. Idempotente: sostituisce le righe esistenti."""
+    with transaction.atomic():
+        StatisticaLogGiornaliera.objects.filter(giorno=giorno).delete()
+        StatisticaLogGiornaliera.objects.bulk_create(_righe_giorno(giorno))
+
+
+def ultimo_giorno_aggregato():
+    return StatisticaLogGiornaliera.objects.aggregate(Max('giorno'))['giorno__max']
+
+
+def aggiorna_rollup_log():
+    """Aggrega i giorni chiusi non ancora presenti nei rollup. Restituisce il numero di giorni elaborati."""
+    ieri = timezone.now().date() - timedelta(days=1)
+    ultimo = ultimo_giorno_aggregato()
+    if ultimo:
+        inizio = ultimo + timedelta(days=1)
+    else:
+        primo = LogSistema.objects.aggregate(Min('data'))['data__min']
+        if not primo:
+            return 0
+        inizio = primo.date()
+
+    giorni = 0
+    giorno = inizio
+    while giorno <= ieri:
+        aggrega_giorno(giorno)
+        giorno += timedelta(days=1)
+        giorni += 1
+    return giorni
+
+
+def pulisci_log_grezzi(giorni_retention=None):
+    """
+    Cancella i log grezzi più vecchi della retention, solo per giorni già aggregati.
+    Restituisce le righe cancellate, o le partizioni rimosse se la tabella è partizionata.
+    """
+    giorni_retention = settings.LOG_RETENTION_GIORNI if giorni_retention is None else giorni_retention
+    ultimo = ultimo_giorno_aggregato()
+    if not ultimo or giorni_retention <= 0:
+        return 0
+    limite = min(timezone.now().date() - timedelta(days=giorni_retention), ultimo + timedelta(days=1))
+    if tabella_partizionata():
+        # Si staccano solo i mesi interi precedenti al limite (DROP/archivio in O(1), niente DELETE riga per riga)
+        return len(elimina_partizioni(limite, archivia=settings.LOG_ARCHIVIA_PARTIZIONI))
+    cancellati, _ = LogSistema.objects.filter(data__date__lt=limite).delete()
+    return cancellati
+
+
+def statistiche_aggregate(giorni_grafico=14):
+    """
+    Dati della pagina statistiche: storico dai rollup più il giorno corrente dai log grezzi
+    (e gli eventuali giorni chiusi non ancora aggregati).
+    """
+    oggi = timezone.now().date()
+    ultimo = ultimo_giorno_aggregato()
+    inizio_grezzi = ultimo + timedelta(days=1) if ultimo else None
+    grezzi = log_utente() if inizio_grezzi is None else log_utente().filter(data__date__gte=inizio_grezzi)
+    inizio_grafico = oggi - timedelta(days=giorni_grafico)
+
+    # 1. Pagine, utenti e azioni: somme per chiave nel DB
+    rollup = StatisticaLogGiornaliera.objects.filter(tipo__in=['pagina', 'utente', 'azione'])
+    pagine, utenti, azioni = defaultdict(int), defaultdict(int), defaultdict(int)
+    per_tipo = {'pagina': pagine, 'utente': utenti, 'azione': azioni}
+    for r in rollup.values('tipo', 'chiave').annotate(n=Sum('conteggio')):
+        per_tipo[r['tipo']][r['chiave']] += r['n']
+
+    for r in grezzi.filter(azione='Page View').values('messaggio').annotate(n=Count('id')):
+        pagine[nome_pagina(r['messaggio'])] += r['n']
+    for r in grezzi.exclude(utente__isnull=True).values('utente_id').annotate(n=Count('id')):
+        utenti[str(r['utente_id'])] += r['n']
+    for r in grezzi.exclude(azione='Page View').values('azione').annotate(n=Count('id')):
+        azioni[r['azione']] += r['n']
+
+    # 2. Andamento giornaliero (totale e utenti unici)
+    totali, univoci = {}, {}
+    for r in StatisticaLogGiornaliera.objects.filter(tipo__in=['totale', 'univoci'], giorno__gte=inizio_grafico).values('giorno', 'tipo', 'conteggio'):
+        (totali if r['tipo'] == 'totale' else univoci)[r['giorno']] = r['conteggio']
+
+    recenti = grezzi.filter(data__date__gte=inizio_grafico).annotate(day=TruncDate('data')).values('day')
+    for r in recenti.annotate(count=Count('id'), unique_count=Count('utente', distinct=True)):
+        totali[r['day']] = r['count']
+        univoci[r['day']] = r['unique_count']
+
+    return {
+        'pagine': dict(pagine),
+        'utenti': dict(utenti),
+        'azioni': dict(azioni),
+        'totali_giornalieri': totali,
+        'univoci_giornalieri': univoci,
+    }
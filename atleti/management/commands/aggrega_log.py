@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from atleti.log_rollup import aggiorna_rollup_log, aggrega_giorno, pulisci_log_grezzi
+from datetime import date
+
+
+class Command(BaseCommand):
+    help = "Aggrega i LogSistema dei giorni chiusi nei rollup giornalieri e applica la retention sui log grezzi"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--giorno', help="Ricalcola un giorno specifico (YYYY-MM-DD)")
+        parser.add_argument('--retention', type=int, help="Giorni di log grezzi da mantenere (default: LOG_RETENTION_GIORNI)")
+
+    def handle(self, *args, **options):
+        if options['giorno']:
+            aggrega_giorno(date.fromisoformat(options['giorno']))
+            self.stdout.write(self.style.SUCCESS(f"Rollup del {options['giorno']} ricalcolato."))
+            return
+
+        giorni = aggiorna_rollup_log()
+        self.stdout.write(f"Aggregati {giorni} giorni di log.")
+
+        cancellati = pulisci_log_grezzi(options['retention'])
+        self.stdout.write(self.style.SUCCESS(f"Retention applicata: {cancellati} log grezzi (o partizioni mensili) eliminati."))
@@ -8,7 +8,7 @@ class Command(BaseCommand):
         self.stdout.write("Inizio pulizia attività lente...")
         
         # Filtriamo solo le attività che hanno un VO2max calcolato
-        activities = Attivita.objects.filter(vo2max_stimato__isnull=False)
+        activities = Attivita.objects.riepilogo().filter(vo2max_stimato__isnull=False)
         count = 0
         
         for act in activities:
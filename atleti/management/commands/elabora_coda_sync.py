@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from atleti.sync import elabora_prossimo_job
+import time
+
+
+class Command(BaseCommand):
+    help = 'Elabora la coda delle sincronizzazioni Strava (worker dedicato, alternativo allo scheduler)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--continuo',
+            action='store_true',
+            help='Resta in ascolto della coda invece di terminare quando è vuota',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.WARNING("Avvio worker coda sincronizzazioni..."))
+        count = 0
+        while True:
+            close_old_connections()
+            if elabora_prossimo_job():
+                count += 1
+                continue
+            if not options['continuo']:
+                break
+            # Coda vuota: attesa breve prima del prossimo controllo
+            time.sleep(2)
+
+        self.stdout.write(self.style.SUCCESS(f"Coda vuota. Job elaborati: {count}."))
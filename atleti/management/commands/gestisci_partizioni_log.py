@@ -0,0 +1,30 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from atleti.partizioni_log import crea_partizioni, elimina_partizioni, tabella_partizionata
+
+
+class Command(BaseCommand):
+    help = "Crea le partizioni mensili future della tabella log e, se richiesto, elimina o archivia quelle vecchie"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mesi-avanti', type=int, default=settings.LOG_PARTIZIONI_AVANTI, help="Mesi futuri da preparare")
+        parser.add_argument('--elimina-prima-di', type=int, metavar='GIORNI', help="Rimuove le partizioni interamente più vecchie di GIORNI giorni")
+        parser.add_argument('--archivia', action='store_true', help="Invece del DROP stacca la partizione e la rinomina *_archivio")
+
+    def handle(self, *args, **options):
+        if not tabella_partizionata():
+            self.stdout.write(self.style.WARNING("Tabella log non partizionata (serve PostgreSQL e la migrazione 0051): nulla da fare."))
+            return
+
+        create = crea_partizioni(options['mesi_avanti'])
+        self.stdout.write(f"Partizioni create: {', '.join(create) if create else 'nessuna'}")
+
+        # Di norma la retention la applica aggrega_log (solo su giorni già aggregati): questa è l'opzione manuale
+        if options['elimina_prima_di']:
+            limite = timezone.now().date() - timedelta(days=options['elimina_prima_di'])
+            rimosse = elimina_partizioni(limite, archivia=options['archivia'])
+            self.stdout.write(f"Partizioni rimosse: {', '.join(rimosse) if rimosse else 'nessuna'}")
+
+        self.stdout.write(self.style.SUCCESS("Gestione partizioni completata."))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from atleti.models import ProfiloAtleta
+from atleti.aggregati import ricostruisci_aggregati
+
+
+class Command(BaseCommand):
+    help = 'Ricostruisce da zero i rollup (giorno/settimana/anno) di tutti gli atleti'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--atleta', type=int, help="ID del profilo da ricostruire (default: tutti)")
+
+    def handle(self, *args, **options):
+        profili = ProfiloAtleta.objects.all()
+        if options['atleta']:
+            profili = profili.filter(id=options['atleta'])
+
+        count = 0
+        for profilo_id in profili.values_list('id', flat=True):
+            ricostruisci_aggregati(profilo_id)
+            count += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Rollup ricostruiti per {count} atleti."))
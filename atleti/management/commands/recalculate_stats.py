@@ -1,7 +1,7 @@
 import logging
 from django.core.management.base import BaseCommand
-from atleti.models import ProfiloAtleta, Attivita
-from atleti.utils import stima_vo2max_atleta, calcola_metrica_vo2max
+from atleti.models import ProfiloAtleta
+from atleti.utils import stima_vo2max_atleta, ricalcola_vo2max_atleta
 from django.utils import timezone
 
 logger = logging.getLogger(__name__)
@@ -21,18 +21,9 @@ class Command(BaseCommand):
             # 1. Ricalcola VO2max per ogni singola attività (se necessario)
             # Utile se abbiamo cambiato la formula in utils.py
             # Ricalcoliamo tutto lo storico per coerenza nei grafici dopo cambio algoritmo
-            attivita = Attivita.objects.filter(atleta=profilo).order_by('-data')
-            
-            updated_activities = 0
-            for act in attivita:
-                if act.distanza > 0 and act.durata > 0:
-                    # Ricalcoliamo sempre per essere sicuri di avere il dato aggiornato con l'ultima formula
-                    nuovo_vo2 = calcola_metrica_vo2max(act, profilo)
-                    # Aggiorniamo anche se è None (es. attività ora esclusa per passo lento)
-                    if act.vo2max_stimato != nuovo_vo2:
-                        act.vo2max_stimato = nuovo_vo2
-                        act.save()
-                        updated_activities += 1
+            # Calcolo vettoriale su tutte le attività dell'atleta e bulk_update delle sole righe cambiate
+            # (anche se il nuovo valore è None, es. attività ora esclusa per passo lento)
+            updated_activities, _ = ricalcola_vo2max_atleta(profilo)
 
             # 2. Aggiorna i campi aggregati del profilo (incluso vo2max_strada)
             profilo.data_ultimo_ricalcolo_statistiche = timezone.now()
@@ -1,14 +1,15 @@
 from django.core.management.base import BaseCommand
 from atleti.models import ProfiloAtleta, Attivita
 from atleti.utils import calcola_vam_selettiva
-from allauth.socialaccount.models import SocialToken
-import time
+from atleti import rate_limit
+from atleti.streams import stream_disponibile
+from atleti.token_cache import token_valido
 import logging
 
 logger = logging.getLogger(__name__)
 
 class Command(BaseCommand):
-    help = 'Ricalcola la VAM Selettiva per le attività TrailRun esistenti scaricando gli streams da Strava'
+    help = 'Ricalcola la VAM Selettiva per le attività TrailRun esistenti (streams dall\'archivio locale, scaricati da Strava solo se mancanti)'
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -26,15 +27,15 @@ class Command(BaseCommand):
         for profilo in atleti:
             logger.info(f"--- Elaborazione atleta: {profilo.user.username} ---")
             
-            # Recupera il token Strava
-            token_obj = SocialToken.objects.filter(account__user=profilo.user, account__provider='strava').first()
+            # Token Strava valido (rinnovato se in scadenza): prima si usava il token salvato anche se scaduto
+            access_token = token_valido(profilo.user_id)
             
-            if not token_obj:
-                logger.warning(f"⚠️ Token Strava non trovato per {profilo.user.username}. Salto.")
-                continue
+            if not access_token:
+                # Senza token possiamo comunque ricalcolare dalle streams in archivio locale
+                logger.warning(f"⚠️ Token Strava non trovato per {profilo.user.username}. Uso solo streams locali.")
             
             # Filtra solo TrailRun con dislivello > 150m
-            qs = Attivita.objects.filter(
+            qs = Attivita.objects.riepilogo().filter(
                 atleta=profilo, 
                 tipo_attivita='TrailRun', 
                 dislivello__gt=150
@@ -49,18 +50,21 @@ class Command(BaseCommand):
                     count_skip += 1
                     continue
 
-                logger.info(f"Scaricamento streams per attività {act.strava_activity_id} ({act.data.date()})...")
+                # Niente pause fisse: ci fermiamo quando il rate limiter esaurisce la quota di background.
+                # Gli stream già in archivio locale non costano chiamate API.
+                if not stream_disponibile(act.strava_activity_id) and not rate_limit.quota_disponibile(rate_limit.BACKGROUND):
+                    logger.warning(f"Quota Strava esaurita ({rate_limit.stato_quota()}). Riprendo al prossimo avvio.")
+                    return
+
+                logger.info(f"Calcolo VAM da streams per attività {act.strava_activity_id} ({act.data.date()})...")
                 
-                vam = calcola_vam_selettiva(act.strava_activity_id, token_obj.token)
+                vam = calcola_vam_selettiva(act.strava_activity_id, access_token)
                 
                 if vam is not None:
                     act.vam_selettiva = vam
                     act.save()
                     logger.info(f" OK -> VAM: {vam} m/h")
                     count_ok += 1
-                    # Rate Limit Friendly: Strava permette 100 richieste ogni 15 min.
-                    # 1.5s di pausa = max 40 richieste al minuto, sicuro.
-                    time.sleep(1.5) 
                 else:
                     logger.error(" ERRORE o Rate Limit")
             
@@ -1,13 +1,22 @@
 import logging
+import signal
 from django.conf import settings
 from apscheduler.schedulers.blocking import BlockingScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from apscheduler.executors.pool import ThreadPoolExecutor as APSThreadPoolExecutor
+from apscheduler.jobstores.base import JobLookupError
+from datetime import datetime
+from zoneinfo import ZoneInfo
 from django.core.management.base import BaseCommand
 from django_apscheduler.jobstores import DjangoJobStore, register_events
 from django_apscheduler.models import DjangoJobExecution
 from django_apscheduler import util
-from atleti.tasks import task_ricalcolo_vam, task_ricalcolo_statistiche, task_scrape_itra_utmb, task_heartbeat, task_sync_strava, task_repair_strava, task_aggiorna_podio_ai, task_calcola_feedback
+from atleti.tasks import task_ricalcolo_vam, task_ricalcolo_statistiche, task_scrape_itra_utmb, task_heartbeat, task_sync_strava, task_repair_strava, task_aggiorna_podio_ai, task_calcola_feedback, task_elabora_eventi_strava, task_elabora_coda_sync, task_aggrega_log, task_partizioni_log
 from atleti.models import TaskSettings
+from atleti.scheduler_trigger import avvia_listener
+from atleti.esecuzione_task import esegui_task, LIMITI_TASK
+from atleti.log_buffer import chiudi_log_buffer
 
 logger = logging.getLogger(__name__)
 
@@ -38,7 +47,7 @@ class Command(BaseCommand):
         class HeartbeatFilter(logging.Filter):
             def filter(self, record):
                 msg = record.getMessage()
-                if "task_heartbeat" in msg:
+                if "task_heartbeat" in msg or "task_elabora_coda_sync" in msg:
                     # Nascondiamo solo i log di routine (INFO), ma mostriamo gli ERRORI
                     if "Running job" in msg or "executed successfully" in msg:
                         return False
@@ -51,7 +60,11 @@ class Command(BaseCommand):
         root_logger.addHandler(file_handler)
         logger.info("--- SISTEMA LOG ATTIVO: Scheduler Avviato ---")
         
-        scheduler = BlockingScheduler(timezone=settings.TIME_ZONE)
+        # Pool di esecuzione: i job indipendenti girano in parallelo (limiti per task e gruppi in esecuzione_task.py)
+        scheduler = BlockingScheduler(
+            timezone=settings.TIME_ZONE,
+            executors={'default': APSThreadPoolExecutor(max_workers=settings.SCHEDULER_WORKERS)},
+        )
         scheduler.add_jobstore(DjangoJobStore(), "default")
         
         # REGISTRAZIONE EVENTI: Fondamentale per salvare i log nel DB e vederli nel sito!
@@ -72,19 +85,31 @@ class Command(BaseCommand):
                 )
                 
                 # --- AUTO-FIX PER STRAVA ---
-                # Se esiste già una config vecchia (es. ore 02:30) per il sync Strava, la aggiorniamo forzatamente
-                if not created and task_id == 'sync_strava_periodico' and cfg.hour == '2':
-                    logger.info(f"Aggiorno configurazione obsoleta per {task_id} -> Passo a ogni 3 ore")
-                    cfg.hour = '*/3'
+                # Se esiste già una config vecchia (es. ore 02:30) per il sync Strava, la aggiorniamo forzatamente.
+                # Con il webhook attivo il polling ogni 3 ore è superfluo: passiamo alla riconciliazione ogni 12 ore.
+                obsolete = ['2', '*/3'] if settings.STRAVA_WEBHOOK_SUBSCRIPTION_ID else ['2']
+                if not created and task_id == 'sync_strava_periodico' and cfg.hour in obsolete and cfg.hour != str(default_hour):
+                    logger.info(f"Aggiorno configurazione obsoleta per {task_id} -> Ore {default_hour}")
+                    cfg.hour = str(default_hour)
                     cfg.minute = '0'
                     cfg.save()
 
+                # Il ricalcolo VAM alle 03:00 coincideva con il sync Strava ogni 3 ore (stesso gruppo quota_strava)
+                if not created and task_id == 'ricalcolo_vam_notturno' and (cfg.hour, cfg.minute) == ('3', '0'):
+                    logger.info(f"Aggiorno configurazione obsoleta per {task_id} -> {default_hour}:{default_minute}")
+                    cfg.hour = str(default_hour)
+                    cfg.minute = str(default_minute)
+                    cfg.save()
+
                 if cfg.active:
                     scheduler.add_job(
-                        task_func,
+                        esegui_task,
+                        args=[task_id, task_func],
+                        kwargs={'attesa': settings.SCHEDULER_ATTESA_GRUPPI},  # Gruppo occupato: aspetta invece di saltare il turno
+                        name=task_func.__name__,
                         trigger=CronTrigger(hour=cfg.hour, minute=cfg.minute, day_of_week=cfg.day_of_week),
                         id=task_id,
-                        max_instances=1,
+                        max_instances=LIMITI_TASK.get(task_id, 1),
                         replace_existing=True,
                         misfire_grace_time=None,  # Esegui anche se in ritardo (fondamentale per task manuali)
                         coalesce=True,            # Se si accumulano più esecuzioni, fanne una sola
@@ -97,21 +122,24 @@ class Command(BaseCommand):
                 logger.error(f"Errore caricamento config per {task_id}: {e}")
                 # Fallback sui default se il DB non è raggiungibile o migrato
                 scheduler.add_job(
-                    task_func,
+                    esegui_task,
+                    args=[task_id, task_func],
+                    kwargs={'attesa': settings.SCHEDULER_ATTESA_GRUPPI},
+                    name=task_func.__name__,
                     trigger=CronTrigger(hour=default_hour, minute=default_minute, day_of_week=default_day),
                     id=task_id,
-                    max_instances=1,
+                    max_instances=LIMITI_TASK.get(task_id, 1),
                     replace_existing=True,
                     misfire_grace_time=None,
                     coalesce=True,
                 )
                 logger.warning(f"Usata configurazione di default per '{task_id}'")
 
-        # 1. Ricalcolo VAM Selettiva (Ogni notte alle 03:00)
+        # 1. Ricalcolo VAM Selettiva (Ogni notte alle 02:30, fuori dagli orari del sync Strava)
         schedule_task(
             task_ricalcolo_vam,
             "ricalcolo_vam_notturno",
-            default_hour=3, default_minute=0
+            default_hour=2, default_minute=30
         )
 
         # 2. Ricalcolo Statistiche Generali (Ogni notte alle 04:00)
@@ -136,10 +164,11 @@ class Command(BaseCommand):
         )
         
         # 5. Sync Strava Automatico (Ogni 3 ore per mantenere i token vivi)
+        # Se il webhook Strava è attivo le novità arrivano in push: il polling resta solo come riconciliazione
         schedule_task(
             task_sync_strava,
             "sync_strava_periodico",
-            default_hour='*/3', default_minute=0
+            default_hour='*/12' if settings.STRAVA_WEBHOOK_SUBSCRIPTION_ID else '*/3', default_minute=0
         )
         
         # 6. Riparazione Strava (Ogni Lunedì alle 01:00)
@@ -163,11 +192,43 @@ class Command(BaseCommand):
             default_hour=2, default_minute=0
         )
         
-        # 5. SYSTEM HEARTBEAT (Ogni 10 secondi)
-        # Serve a svegliare lo scheduler per fargli leggere i task manuali dal DB
+        # 9. Elaborazione Eventi Webhook Strava (Ogni minuto)
+        schedule_task(
+            task_elabora_eventi_strava,
+            "elabora_eventi_strava",
+            default_hour='*', default_minute='*'
+        )
+        
+        # 10. Rollup Statistiche Log e Retention (Ogni notte alle 00:30)
+        schedule_task(
+            task_aggrega_log,
+            "aggrega_log_notturno",
+            default_hour=0, default_minute=30
+        )
+        
+        # 11. Partizioni Mensili Log (Ogni notte alle 00:20, idempotente: crea solo quelle mancanti)
+        schedule_task(
+            task_partizioni_log,
+            "partizioni_log_giornaliero",
+            default_hour=0, default_minute=20
+        )
+        
+        # 5. SYSTEM HEARTBEAT
+        # Esegue i task manuali. Con PostgreSQL viene anticipato dalle notifiche (LISTEN/NOTIFY) e il suo
+        # intervallo è solo un fallback lento; senza listener torna al polling ogni 10 secondi.
+        def sveglia_heartbeat(task_id):
+            logger.info(f"SCHEDULER: Notifica task manuale '{task_id}', avvio immediato.")
+            try:
+                scheduler.modify_job('system_heartbeat', next_run_time=datetime.now(ZoneInfo(settings.TIME_ZONE)))
+            except JobLookupError:
+                pass  # Scheduler non ancora avviato: il task partirà al primo heartbeat
+
+        listener = avvia_listener(sveglia_heartbeat)
+        intervallo_heartbeat = settings.SCHEDULER_POLL_FALLBACK if listener else 10
+
         scheduler.add_job(
             task_heartbeat,
-            trigger=CronTrigger(second='*/10'), # Ogni 10 secondi
+            trigger=IntervalTrigger(seconds=intervallo_heartbeat),
             id="system_heartbeat", # ID univoco diverso dal nome funzione per evitare filtri
             max_instances=1,
             replace_existing=True,
@@ -175,10 +236,31 @@ class Command(BaseCommand):
             coalesce=True,
         )
 
+        # WORKER CODA SYNC (Ogni 5 secondi)
+        # Esegue le sincronizzazioni accodate dalla web app; più istanze in parallelo prendono job diversi
+        scheduler.add_job(
+            task_elabora_coda_sync,
+            trigger=CronTrigger(second='*/5'),
+            id="sync_queue_worker",
+            max_instances=settings.SYNC_QUEUE_WORKERS,
+            replace_existing=True,
+            misfire_grace_time=None,
+            coalesce=True,
+        )
+
+        def arresta(*_):
+            # SIGTERM (systemd, docker stop) non esegue gli atexit: svuotiamo il buffer dei log prima di fermare lo scheduler
+            logger.info("Arresto schedulatore in corso...")
+            chiudi_log_buffer()
+            if listener:
+                listener.set()
+            scheduler.shutdown(wait=False)
+            logger.info("Schedulatore arrestato con successo.")
+
+        signal.signal(signal.SIGTERM, arresta)
+
         try:
             logger.info("Avvio dello schedulatore...")
             scheduler.start()
         except KeyboardInterrupt:
-            logger.info("Arresto schedulatore in corso...")
-            scheduler.shutdown()
-            logger.info("Schedulatore arrestato con successo.")
\ No newline at end of file
+            arresta()
\ No newline at end of file
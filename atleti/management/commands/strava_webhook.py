@@ -0,0 +1,51 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from allauth.socialaccount.models import SocialApp
+from atleti import strava_client
+
+PUSH_URL = "https://www.strava.com/api/v3/push_subscriptions"
+
+
+class Command(BaseCommand):
+    help = 'Gestisce la Push Subscription (webhook) Strava: elenco, creazione ed eliminazione'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--crea', metavar='CALLBACK_URL', help="Crea la sottoscrizione (es. https://dominio/api/strava/webhook/)")
+        parser.add_argument('--elimina', metavar='ID', type=int, help="Elimina la sottoscrizione con l'ID indicato")
+
+    def handle(self, *args, **options):
+        app = SocialApp.objects.filter(provider='strava').first()
+        if not app:
+            raise CommandError("App Strava non configurata.")
+        credenziali = {'client_id': app.client_id, 'client_secret': app.secret}
+
+        if options['crea']:
+            if not settings.STRAVA_WEBHOOK_VERIFY_TOKEN:
+                raise CommandError("Impostare STRAVA_WEBHOOK_VERIFY_TOKEN prima di creare la sottoscrizione.")
+            # Strava chiama subito il callback (GET hub.challenge): il sito deve essere raggiungibile
+            res = strava_client.post(PUSH_URL, data={
+                **credenziali,
+                'callback_url': options['crea'],
+                'verify_token': settings.STRAVA_WEBHOOK_VERIFY_TOKEN,
+            }, timeout=30)
+            if res.status_code not in (200, 201):
+                raise CommandError(f"Errore creazione sottoscrizione: {res.status_code} {res.text}")
+            sub_id = res.json().get('id')
+            self.stdout.write(self.style.SUCCESS(f"Sottoscrizione creata: ID {sub_id}. Impostare STRAVA_WEBHOOK_SUBSCRIPTION_ID={sub_id}"))
+            return
+
+        if options['elimina']:
+            res = strava_client.delete(f"{PUSH_URL}/{options['elimina']}", params=credenziali, timeout=15)
+            if res.status_code != 204:
+                raise CommandError(f"Errore eliminazione: {res.status_code} {res.text}")
+            self.stdout.write(self.style.SUCCESS("Sottoscrizione eliminata."))
+            return
+
+        res = strava_client.get(PUSH_URL, params=credenziali, timeout=15)
+        if res.status_code != 200:
+            raise CommandError(f"Errore API Strava: {res.status_code} {res.text}")
+        sottoscrizioni = res.json()
+        if not sottoscrizioni:
+            self.stdout.write(self.style.WARNING("Nessuna sottoscrizione attiva."))
+        for sub in sottoscrizioni:
+            self.stdout.write(f"ID {sub.get('id')} -> {sub.get('callback_url')}")
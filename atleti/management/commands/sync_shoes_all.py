@@ -1,55 +1,53 @@
 from django.core.management.base import BaseCommand
 from allauth.socialaccount.models import SocialToken
-from atleti.models import ProfiloAtleta, Scarpa
-from atleti.utils import refresh_strava_token, normalizza_scarpa
-import requests
+from atleti.models import ProfiloAtleta
+from atleti.token_cache import token_valido
+from atleti.impronte_strava import scarica_atleta, sincronizza_scarpe
+from atleti import rate_limit
 
 class Command(BaseCommand):
     help = 'Scarica e aggiorna le scarpe per tutti gli utenti Strava collegati'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--forza', action='store_true', help="Riscrive le scarpe anche se non risultano cambiate (ignora ETag e hash)")
+
     def handle(self, *args, **options):
+        forza = options['forza']
         self.stdout.write(self.style.WARNING("Avvio aggiornamento massivo scarpe..."))
         
-        tokens = SocialToken.objects.filter(account__provider='strava')
+        tokens = SocialToken.objects.filter(account__provider='strava').select_related('account__user')
         count_users = 0
         
         for token_obj in tokens:
             user = token_obj.account.user
             self.stdout.write(f"Elaborazione utente: {user.username}...")
             
-            token = refresh_strava_token(token_obj)
+            token = token_valido(user.id)
             if not token:
                 self.stdout.write(self.style.ERROR(f"  -> Token scaduto o non valido."))
                 continue
                 
+            if not rate_limit.acquisisci_permesso(rate_limit.BACKGROUND):
+                self.stdout.write(self.style.WARNING("Quota Strava esaurita. Interrompo: gli utenti rimanenti verranno aggiornati al prossimo avvio."))
+                break
+
             try:
-                headers = {'Authorization': f'Bearer {token}'}
-                res = requests.get("https://www.strava.com/api/v3/athlete", headers=headers, timeout=10)
+                profilo, _ = ProfiloAtleta.objects.get_or_create(user=user)
+                # L'ETag resta quello della sync completa (qui il profilo non viene elaborato): un 304 vale comunque
+                res = scarica_atleta(profilo, token, condizionale=not forza)
+                rate_limit.registra_risposta(res)
                 
-                if res.status_code == 200:
-                    data = res.json()
-                    profilo, _ = ProfiloAtleta.objects.get_or_create(user=user)
-                    
-                    shoes = data.get('shoes', [])
-                    ids = []
-                    for s in shoes:
-                        ids.append(s['id'])
-                        brand, model = normalizza_scarpa(s['name'])
-                        Scarpa.objects.update_or_create(
-                            strava_id=s['id'],
-                            defaults={
-                                'atleta': profilo, 'nome': s['name'], 'distanza': s['distance'],
-                                'primary': s['primary'], 'brand': brand, 'modello_normalizzato': model,
-                                'retired': False
-                            }
-                        )
-                    # Segna come dismesse quelle non più presenti
-                    Scarpa.objects.filter(atleta=profilo).exclude(strava_id__in=ids).update(retired=True)
-                    self.stdout.write(self.style.SUCCESS(f"  -> Aggiornate {len(shoes)} scarpe."))
+                if res.status_code == 304:
+                    self.stdout.write("  -> Nessuna modifica su Strava.")
+                    count_users += 1
+                elif res.status_code == 200:
+                    shoes = res.json().get('shoes', [])
+                    scritte = sincronizza_scarpe(profilo, shoes, forza=forza)
+                    self.stdout.write(self.style.SUCCESS(f"  -> {len(shoes)} scarpe, {scritte} aggiornate."))
                     count_users += 1
                 else:
                     self.stdout.write(self.style.ERROR(f"  -> Errore API Strava: {res.status_code}"))
             except Exception as e:
                 self.stdout.write(self.style.ERROR(f"  -> Eccezione: {e}"))
         
-        self.stdout.write(self.style.SUCCESS(f"Operazione completata su {count_users} utenti."))
\ No newline at end of file
+        self.stdout.write(self.style.SUCCESS(f"Operazione completata su {count_users} utenti."))
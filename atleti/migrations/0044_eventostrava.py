@@ -0,0 +1,41 @@
+# Generated by Django 6.0.2 on 2026-10-18 17:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atleti', '0043_attivita_parziali'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='tasksettings',
+            name='task_id',
+            field=models.CharField(choices=[('ricalcolo_vam_notturno', 'Ricalcolo VAM'), ('ricalcolo_stats_notturno', 'Ricalcolo Statistiche'), ('scrape_itra_utmb_settimanale', 'Scraping ITRA/UTMB'), ('pulizia_log_settimanale', 'Pulizia Log'), ('sync_strava_periodico', 'Sync Strava Automatico'), ('repair_strava_settimanale', 'Riparazione Strava (Self-Healing)'), ('aggiorna_podio_ai_4h', 'Aggiornamento Podio AI'), ('calcola_feedback_allenamenti', 'Calcolo Feedback Presenze'), ('elabora_eventi_strava', 'Elaborazione Eventi Webhook Strava')], max_length=50, unique=True, verbose_name='Task'),
+        ),
+        migrations.CreateModel(
+            name='EventoStrava',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_type', models.CharField(max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('aspect_type', models.CharField(max_length=20)),
+                ('owner_id', models.BigIntegerField(db_index=True)),
+                ('event_time', models.BigIntegerField()),
+                ('updates', models.JSONField(blank=True, default=dict)),
+                ('stato', models.CharField(choices=[('In Coda', 'In Coda'), ('Elaborato', 'Elaborato'), ('Ignorato', 'Ignorato'), ('Errore', 'Errore')], db_index=True, default='In Coda', max_length=20)),
+                ('tentativi', models.IntegerField(default=0)),
+                ('errore', models.TextField(blank=True, null=True)),
+                ('data_ricezione', models.DateTimeField(auto_now_add=True)),
+                ('data_elaborazione', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Evento Strava',
+                'verbose_name_plural': 'Eventi Strava',
+                'ordering': ['event_time'],
+                'constraints': [models.UniqueConstraint(fields=('object_type', 'object_id', 'aspect_type', 'event_time'), name='evento_strava_unico')],
+            },
+        ),
+    ]
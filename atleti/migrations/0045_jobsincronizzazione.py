@@ -0,0 +1,42 @@
+# Generated by Django 6.0.2 on 2026-10-18 17:08
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atleti', '0044_eventostrava'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobSincronizzazione',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('incrementale', 'Incrementale'), ('completo', 'Storico Completo')], default='incrementale', max_length=20)),
+                ('stato', models.CharField(choices=[('In Coda', 'In Coda'), ('In Corso', 'In Corso'), ('Completato', 'Completato'), ('Errore', 'Errore')], db_index=True, default='In Coda', max_length=20)),
+                ('pagina', models.IntegerField(default=1)),
+                ('after_timestamp', models.BigIntegerField(blank=True, null=True)),
+                ('attivita_importate', models.IntegerField(default=0)),
+                ('progresso', models.IntegerField(default=0)),
+                ('messaggio_stato', models.CharField(default='In coda...', max_length=200)),
+                ('errore', models.TextField(blank=True, null=True)),
+                ('tentativi', models.IntegerField(default=0)),
+                ('riprova_dopo', models.DateTimeField(blank=True, null=True)),
+                ('heartbeat', models.DateTimeField(blank=True, null=True)),
+                ('data_creazione', models.DateTimeField(auto_now_add=True)),
+                ('data_inizio', models.DateTimeField(blank=True, null=True)),
+                ('data_fine', models.DateTimeField(blank=True, null=True)),
+                ('utente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='job_sincronizzazione', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Job Sincronizzazione',
+                'verbose_name_plural': 'Job Sincronizzazione',
+                'ordering': ['-data_creazione'],
+            },
+        ),
+    ]
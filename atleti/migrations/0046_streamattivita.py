@@ -0,0 +1,29 @@
+# Generated by Django 6.0.2 on 2026-10-18 17:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atleti', '0045_jobsincronizzazione'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StreamAttivita',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('strava_activity_id', models.BigIntegerField(unique=True)),
+                ('percorso', models.CharField(max_length=255)),
+                ('chiavi', models.JSONField(default=list)),
+                ('campioni', models.IntegerField(default=0)),
+                ('dimensione_byte', models.IntegerField(default=0)),
+                ('data_download', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Stream Attività',
+                'verbose_name_plural': 'Stream Attività',
+            },
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 6.0.2 on 2026-10-18 17:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, ExpressionWrapper, F, FloatField, Sum
+from django.db.models.functions import TruncDate, TruncWeek, TruncYear
+
+
+def popola_aggregati(apps, schema_editor):
+    """Calcola i rollup per le attività già presenti (una query raggruppata per periodo)."""
+    Attivita = apps.get_model('atleti', 'Attivita')
+    AggregatoAtleta = apps.get_model('atleti', 'AggregatoAtleta')
+    carico = ExpressionWrapper(F('distanza') / 1000.0 + F('dislivello') / 100.0, output_field=FloatField())
+
+    for periodo, tronca in (('G', TruncDate), ('S', TruncWeek), ('A', TruncYear)):
+        righe = (
+            Attivita.objects.annotate(bucket=tronca('data'))
+            .values('atleta_id', 'bucket')
+            .annotate(
+                tot_distanza=Sum('distanza'),
+                tot_dislivello=Sum('dislivello'),
+                tot_durata=Sum('durata'),
+                tot_carico=Sum(carico),
+                numero=Count('id'),
+            )
+        )
+        AggregatoAtleta.objects.bulk_create([
+            AggregatoAtleta(
+                atleta_id=r['atleta_id'],
+                periodo=periodo,
+                data_inizio=r['bucket'].date() if hasattr(r['bucket'], 'date') else r['bucket'],
+                distanza=r['tot_distanza'] or 0,
+                dislivello=r['tot_dislivello'] or 0,
+                durata=r['tot_durata'] or 0,
+                carico=r['tot_carico'] or 0,
+                numero_attivita=r['numero'],
+            )
+            for r in righe.iterator()
+        ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atleti', '0046_streamattivita'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AggregatoAtleta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('periodo', models.CharField(choices=[('G', 'Giorno'), ('S', 'Settimana'), ('A', 'Anno')], max_length=1)),
+                ('data_inizio', models.DateField()),
+                ('distanza', models.FloatField(default=0.0)),
+                ('dislivello', models.FloatField(default=0.0)),
+                ('durata', models.IntegerField(default=0)),
+                ('carico', models.FloatField(default=0.0)),
+                ('numero_attivita', models.IntegerField(default=0)),
+                ('atleta', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='aggregati', to='atleti.profiloatleta')),
+            ],
+            options={
+                'verbose_name': 'Aggregato Atleta',
+                'verbose_name_plural': 'Aggregati Atleta',
+                'constraints': [models.UniqueConstraint(fields=('atleta', 'periodo', 'data_inizio'), name='aggregato_atleta_unico')],
+            },
+        ),
+        migrations.RunPython(popola_aggregati, migrations.RunPython.noop),
+    ]
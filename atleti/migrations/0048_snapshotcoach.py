@@ -0,0 +1,29 @@
+# Generated by Django 6.0.2 on 2026-10-18 17:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atleti', '0047_aggregatoatleta'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SnapshotCoach',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('settimana_inizio', models.DateField()),
+                ('dati', models.JSONField()),
+                ('data_creazione', models.DateTimeField(auto_now=True)),
+                ('team', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='snapshot_coach', to='atleti.team')),
+            ],
+            options={
+                'verbose_name': 'Snapshot Coach',
+                'verbose_name_plural': 'Snapshot Coach',
+                'constraints': [models.UniqueConstraint(fields=('team', 'settimana_inizio'), name='snapshot_coach_unico', nulls_distinct=False)],
+            },
+        ),
+    ]
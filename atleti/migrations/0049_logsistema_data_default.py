@@ -0,0 +1,19 @@
+# Generated by Django 6.0.2 on 2026-10-18 17:18
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atleti', '0048_snapshotcoach'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='logsistema',
+            name='data',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 6.0.2 on 2026-10-18 17:19
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atleti', '0049_logsistema_data_default'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='tasksettings',
+            name='task_id',
+            field=models.CharField(choices=[('ricalcolo_vam_notturno', 'Ricalcolo VAM'), ('ricalcolo_stats_notturno', 'Ricalcolo Statistiche'), ('scrape_itra_utmb_settimanale', 'Scraping ITRA/UTMB'), ('pulizia_log_settimanale', 'Pulizia Log'), ('sync_strava_periodico', 'Sync Strava Automatico'), ('repair_strava_settimanale', 'Riparazione Strava (Self-Healing)'), ('aggiorna_podio_ai_4h', 'Aggiornamento Podio AI'), ('calcola_feedback_allenamenti', 'Calcolo Feedback Presenze'), ('elabora_eventi_strava', 'Elaborazione Eventi Webhook Strava'), ('aggrega_log_notturno', 'Statistiche Log (Rollup e Retention)')], max_length=50, unique=True, verbose_name='Task'),
+        ),
+        migrations.CreateModel(
+            name='StatisticaLogGiornaliera',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('giorno', models.DateField()),
+                ('tipo', models.CharField(choices=[('pagina', 'Pagina visitata'), ('utente', 'Utente'), ('azione', 'Azione'), ('totale', 'Totale log'), ('univoci', 'Utenti unici')], max_length=10)),
+                ('chiave', models.CharField(blank=True, max_length=200)),
+                ('conteggio', models.IntegerField(default=0)),
+                ('utente', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Statistica Log Giornaliera',
+                'verbose_name_plural': 'Statistiche Log Giornaliere',
+                'indexes': [models.Index(fields=['tipo', 'giorno'], name='atleti_stat_tipo_4e639a_idx')],
+                'constraints': [models.UniqueConstraint(fields=('giorno', 'tipo', 'chiave'), name='statistica_log_unica')],
+            },
+        ),
+    ]
@@ -0,0 +1,80 @@
+# Migrazione scritta a mano: partizionamento mensile di atleti_logsistema, solo PostgreSQL (sugli altri DB non fa nulla).
+
+from datetime import date
+
+from django.db import migrations, models
+
+TABELLA = 'atleti_logsistema'
+
+
+def _mese_successivo(mese):
+    return date(mese.year + mese.month // 12, mese.month % 12 + 1, 1)
+
+
+def partiziona_logsistema(apps, schema_editor):
+    """
+    Converte la tabella dei log in tabella partizionata per mese (RANGE su data), solo su PostgreSQL.
+    La chiave primaria diventa (id, data) perché PostgreSQL richiede la colonna di partizione nella PK;
+    per Django id resta la chiave primaria. Le righe esistenti vengono copiate nelle partizioni mensili.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    execute = schema_editor.execute
+    # Gli indici della vecchia tabella mantengono il loro nome: nella nuova usiamo nomi distinti
+    execute(f'ALTER TABLE "{TABELLA}" RENAME TO "{TABELLA}_old"')
+    execute(f'CREATE SEQUENCE "{TABELLA}_part_id_seq"')
+    execute(f"""SELECT setval('"{TABELLA}_part_id_seq"', COALESCE((SELECT MAX(id) FROM "{TABELLA}_old"), 0) + 1, false)""")
+    execute(f"""
+        CREATE TABLE "{TABELLA}" (
+            "id" bigint NOT NULL DEFAULT nextval('"{TABELLA}_part_id_seq"'),
+            "data" timestamp with time zone NOT NULL,
+            "livello" varchar(10) NOT NULL,
+            "azione" varchar(50) NOT NULL,
+            "messaggio" text NOT NULL,
+            "utente_id" integer NULL REFERENCES "auth_user" ("id") DEFERRABLE INITIALLY DEFERRED,
+            CONSTRAINT "{TABELLA}_part_pkey" PRIMARY KEY ("id", "data")
+        ) PARTITION BY RANGE ("data")
+    """)
+    execute(f'ALTER SEQUENCE "{TABELLA}_part_id_seq" OWNED BY "{TABELLA}"."id"')
+    execute(f'CREATE INDEX "{TABELLA}_data_idx" ON "{TABELLA}" ("data")')
+    execute(f'CREATE INDEX "{TABELLA}_utente_id_idx" ON "{TABELLA}" ("utente_id")')
+    # Rete di sicurezza per righe fuori dalle partizioni create (es. job mensile fermo)
+    execute(f'CREATE TABLE "{TABELLA}_default" PARTITION OF "{TABELLA}" DEFAULT')
+
+    # Partizioni dal mese del log più vecchio fino a 3 mesi avanti
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f'SELECT MIN(data) FROM "{TABELLA}_old"')
+        primo = cursor.fetchone()[0]
+    oggi = date.today().replace(day=1)
+    mese = min(primo.date().replace(day=1), oggi) if primo else oggi
+    ultimo = oggi
+    for _ in range(3):
+        ultimo = _mese_successivo(ultimo)
+    while mese <= ultimo:
+        fine = _mese_successivo(mese)
+        execute(
+            f'CREATE TABLE "{TABELLA}_p{mese:%Y%m}" PARTITION OF "{TABELLA}" '
+            f"FOR VALUES FROM ('{mese.isoformat()}') TO ('{fine.isoformat()}')"
+        )
+        mese = fine
+
+    execute(f'INSERT INTO "{TABELLA}" (id, data, livello, azione, messaggio, utente_id) SELECT id, data, livello, azione, messaggio, utente_id FROM "{TABELLA}_old"')
+    execute(f'DROP TABLE "{TABELLA}_old"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atleti', '0050_statisticaloggiornaliera'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='tasksettings',
+            name='task_id',
+            field=models.CharField(choices=[('ricalcolo_vam_notturno', 'Ricalcolo VAM'), ('ricalcolo_stats_notturno', 'Ricalcolo Statistiche'), ('scrape_itra_utmb_settimanale', 'Scraping ITRA/UTMB'), ('pulizia_log_settimanale', 'Pulizia Log'), ('sync_strava_periodico', 'Sync Strava Automatico'), ('repair_strava_settimanale', 'Riparazione Strava (Self-Healing)'), ('aggiorna_podio_ai_4h', 'Aggiornamento Podio AI'), ('calcola_feedback_allenamenti', 'Calcolo Feedback Presenze'), ('elabora_eventi_strava', 'Elaborazione Eventi Webhook Strava'), ('aggrega_log_notturno', 'Statistiche Log (Rollup e Retention)'), ('partizioni_log_giornaliero', 'Partizioni Mensili Log')], max_length=50, unique=True, verbose_name='Task'),
+        ),
+        # Il ritorno indietro lascia la tabella partizionata (funziona comunque con il modello)
+        migrations.RunPython(partiziona_logsistema, migrations.RunPython.noop),
+    ]
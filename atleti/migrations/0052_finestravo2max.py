@@ -0,0 +1,28 @@
+# Generated by Django 6.0.2 on 2026-10-18 17:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atleti', '0051_partiziona_logsistema'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FinestraVO2max',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tutte', models.JSONField(default=list)),
+                ('strada', models.JSONField(default=list)),
+                ('data_aggiornamento', models.DateTimeField(auto_now=True)),
+                ('atleta', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='finestra_vo2max', to='atleti.profiloatleta')),
+            ],
+            options={
+                'verbose_name': 'Finestra VO2max',
+                'verbose_name_plural': 'Finestre VO2max',
+            },
+        ),
+    ]
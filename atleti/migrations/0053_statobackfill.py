@@ -0,0 +1,34 @@
+# Generated by Django 6.0.2 on 2026-10-18 17:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atleti', '0052_finestravo2max'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatoBackfill',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stato', models.CharField(choices=[('In Corso', 'In Corso'), ('Completato', 'Completato')], default='In Corso', max_length=20)),
+                ('pagine_scaricate', models.IntegerField(default=0)),
+                ('attivita_scaricate', models.IntegerField(default=0)),
+                ('ts_piu_vecchio', models.BigIntegerField(blank=True, null=True)),
+                ('ts_piu_recente', models.BigIntegerField(blank=True, null=True)),
+                ('dettagli_in_sospeso', models.JSONField(blank=True, default=list)),
+                ('data_inizio', models.DateTimeField(auto_now_add=True)),
+                ('data_aggiornamento', models.DateTimeField(auto_now=True)),
+                ('data_completamento', models.DateTimeField(blank=True, null=True)),
+                ('atleta', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stato_backfill', to='atleti.profiloatleta')),
+            ],
+            options={
+                'verbose_name': 'Stato Backfill',
+                'verbose_name_plural': 'Stati Backfill',
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 6.0.2 on 2026-10-18 17:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atleti', '0053_statobackfill'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImprontaDatiStrava',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('etag', models.CharField(blank=True, default='', max_length=200)),
+                ('hash_scarpe', models.CharField(blank=True, default='', max_length=64)),
+                ('data_aggiornamento', models.DateTimeField(auto_now=True)),
+                ('atleta', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='impronta_strava', to='atleti.profiloatleta')),
+            ],
+            options={
+                'verbose_name': 'Impronta Dati Strava',
+                'verbose_name_plural': 'Impronte Dati Strava',
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 6.0.2 on 2026-10-18 17:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atleti', '0054_improntadatistrava'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuotaStrava',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('finestra', models.CharField(max_length=30, unique=True)),
+                ('usate', models.IntegerField(default=0)),
+                ('scadenza', models.BigIntegerField()),
+            ],
+            options={
+                'verbose_name': 'Quota Strava',
+                'verbose_name_plural': 'Quote Strava',
+            },
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Migrazione scritta a mano: crea la tabella della cache condivisa (DatabaseCache, vedi CACHES in settings).
+
+from django.core.management import call_command
+from django.db import migrations
+
+
+def crea_tabella_cache(apps, schema_editor):
+    """Equivalente di 'manage.py createcachetable' eseguito con migrate (idempotente; con Redis non fa nulla)."""
+    call_command('createcachetable', database=schema_editor.connection.alias, verbosity=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('atleti', '0055_quotastrava'),
+    ]
+
+    operations = [
+        migrations.RunPython(crea_tabella_cache, migrations.RunPython.noop),
+    ]
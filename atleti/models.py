@@ -1,7 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User, Permission
 from django.contrib.contenttypes.models import ContentType
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.dispatch import receiver
 from django.utils import timezone
 from zoneinfo import ZoneInfo
@@ -86,6 +86,14 @@ class RichiestaAdesioneTeam(models.Model):
         unique_together = ('team', 'utente')
 
 
+class AttivitaQuerySet(models.QuerySet):
+    # Colonne voluminose lette solo dal dettaglio/confronto di una singola attività
+    CAMPI_PESANTI = ('parziali', 'zone_cardiache', 'analisi_tecnica_ai')
+
+    def riepilogo(self):
+        """Liste e cicli sulle metriche: esclude dalla SELECT i JSON dei parziali/zone e il testo AI"""
+        return self.defer(*self.CAMPI_PESANTI)
+
 class Attivita(models.Model):
     atleta = models.ForeignKey(ProfiloAtleta, on_delete=models.CASCADE, related_name='sessioni')
     strava_activity_id = models.BigIntegerField(unique=True)
@@ -115,13 +123,42 @@ class Attivita(models.Model):
     battito_riposo = models.IntegerField(null=True, blank=True)
     piazzamento = models.IntegerField(null=True, blank=True, verbose_name="Posizione in classifica")
     dispositivo = models.CharField(max_length=100, null=True, blank=True, verbose_name="Dispositivo GPS")
-    
+
+    objects = AttivitaQuerySet.as_manager()
 
     class Meta:
         verbose_name_plural = "Attività"
 
     def __str__(self):
         return f"Corsa {self.data.date()} - {self.atleta.user.username}"
+
+    # Campi che alimentano i rollup di AggregatoAtleta
+    CAMPI_AGGREGATI = ('atleta_id', 'data', 'distanza', 'dislivello', 'durata')
+
+    # Campi che alimentano la finestra mobile del VO2max (FinestraVO2max)
+    CAMPI_VO2MAX = ('atleta_id', 'data', 'vo2max_stimato', 'tipo_attivita')
+
+    # Campi letti dalla dashboard coach: solo le loro modifiche invalidano gli snapshot (SnapshotCoach)
+    CAMPI_SNAPSHOT = ('atleta_id', 'data', 'tipo_attivita', 'distanza', 'durata', 'dislivello', 'vo2max_stimato', 'vam_selettiva', 'potenza_media', 'fc_media')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Fotografia dei valori caricati: il post_save aggiorna rollup, finestra VO2max e snapshot solo se cambiano
+        instance._valori_aggregati = instance.valori_aggregati()
+        instance._valori_vo2max = instance.valori_vo2max()
+        instance._valori_snapshot = instance.valori_snapshot()
+        return instance
+
+    def valori_vo2max(self):
+        return tuple(self.__dict__.get(campo) for campo in self.CAMPI_VO2MAX)
+
+    def valori_snapshot(self):
+        return tuple(self.__dict__.get(campo) for campo in self.CAMPI_SNAPSHOT)
+
+    def valori_aggregati(self):
+        # __dict__ e non getattr: su istanze con campi differiti non vogliamo query extra
+        return tuple(self.__dict__.get(campo) for campo in self.CAMPI_AGGREGATI)
     
     @property
     def vam(self):
@@ -233,6 +270,9 @@ class TaskSettings(models.Model):
         ('repair_strava_settimanale', 'Riparazione Strava (Self-Healing)'),
         ('aggiorna_podio_ai_4h', 'Aggiornamento Podio AI'),
         ('calcola_feedback_allenamenti', 'Calcolo Feedback Presenze'),
+        ('elabora_eventi_strava', 'Elaborazione Eventi Webhook Strava'),
+        ('aggrega_log_notturno', 'Statistiche Log (Rollup e Retention)'),
+        ('partizioni_log_giornaliero', 'Partizioni Mensili Log'),
     ]
     task_id = models.CharField(max_length=50, choices=TASK_CHOICES, unique=True, verbose_name="Task")
     active = models.BooleanField(default=True, verbose_name="Attivo")
@@ -255,7 +295,7 @@ class LogSistema(models.Model):
         ('WARNING', 'Warning'),
         ('ERROR', 'Errore'),
     ]
-    data = models.DateTimeField(auto_now_add=True)
+    data = models.DateTimeField(default=timezone.now)  # Valorizzata alla registrazione (scrittura differita, vedi log_buffer.py)
     livello = models.CharField(max_length=10, choices=LIVELLI, default='INFO')
     azione = models.CharField(max_length=50) # Es. "Sync Strava", "Calcolo VAM"
     messaggio = models.TextField()
@@ -269,6 +309,292 @@ class LogSistema(models.Model):
     def __str__(self):
         return f"{self.data.strftime('%d/%m %H:%M')} - {self.azione}"
 
+class StatisticaLogGiornaliera(models.Model):
+    """Rollup giornaliero dei LogSistema per la pagina statistiche (vedi atleti/log_rollup.py)"""
+    TIPI = [
+        ('pagina', 'Pagina visitata'),
+        ('utente', 'Utente'),
+        ('azione', 'Azione'),
+        ('totale', 'Totale log'),
+        ('univoci', 'Utenti unici'),
+    ]
+    giorno = models.DateField()
+    tipo = models.CharField(max_length=10, choices=TIPI)
+    chiave = models.CharField(max_length=200, blank=True)  # Nome pagina, ID utente o azione ('' per totale/univoci)
+    utente = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    conteggio = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Statistica Log Giornaliera"
+        verbose_name_plural = "Statistiche Log Giornaliere"
+        constraints = [
+            models.UniqueConstraint(fields=['giorno', 'tipo', 'chiave'], name='statistica_log_unica'),
+        ]
+        indexes = [models.Index(fields=['tipo', 'giorno'])]
+
+    def __str__(self):
+        return f"{self.giorno} {self.tipo} {self.chiave}: {self.conteggio}"
+
+class EventoStrava(models.Model):
+    """Eventi ricevuti dal webhook Strava, in coda per l'elaborazione asincrona"""
+    STATI = [
+        ('In Coda', 'In Coda'),
+        ('Elaborato', 'Elaborato'),
+        ('Ignorato', 'Ignorato'),
+        ('Errore', 'Errore'),
+    ]
+    object_type = models.CharField(max_length=20)  # activity / athlete
+    object_id = models.BigIntegerField()
+    aspect_type = models.CharField(max_length=20)  # create / update / delete
+    owner_id = models.BigIntegerField(db_index=True)  # ID atleta Strava
+    event_time = models.BigIntegerField()  # Timestamp Unix dell'evento
+    updates = models.JSONField(default=dict, blank=True)
+    stato = models.CharField(max_length=20, choices=STATI, default='In Coda', db_index=True)
+    tentativi = models.IntegerField(default=0)
+    errore = models.TextField(blank=True, null=True)
+    data_ricezione = models.DateTimeField(auto_now_add=True)
+    data_elaborazione = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Evento Strava"
+        verbose_name_plural = "Eventi Strava"
+        ordering = ['event_time']
+        constraints = [
+            # Strava può ritentare la consegna: lo stesso evento viene salvato una volta sola
+            models.UniqueConstraint(fields=['object_type', 'object_id', 'aspect_type', 'event_time'], name='evento_strava_unico'),
+        ]
+
+    def __str__(self):
+        return f"{self.object_type} {self.object_id} {self.aspect_type} ({self.stato})"
+
+class QuotaStrava(models.Model):
+    """Richieste Strava consumate per finestra (15 minuti o giorno), condivise tra web e scheduler: vedi atleti/rate_limit.py"""
+    finestra = models.CharField(max_length=30, unique=True)  # Es. '15m:1760000000', 'giorno:1759968000'
+    usate = models.IntegerField(default=0)
+    scadenza = models.BigIntegerField()  # Timestamp Unix di fine finestra: dopo si può cancellare
+
+    class Meta:
+        verbose_name = "Quota Strava"
+        verbose_name_plural = "Quote Strava"
+
+    def __str__(self):
+        return f"{self.finestra}: {self.usate}"
+
+class JobSincronizzazione(models.Model):
+    """Coda persistente delle sincronizzazioni Strava, elaborate fuori dalla richiesta web"""
+    TIPI = [
+        ('incrementale', 'Incrementale'),
+        ('completo', 'Storico Completo'),
+    ]
+    STATI = [
+        ('In Coda', 'In Coda'),
+        ('In Corso', 'In Corso'),
+        ('Completato', 'Completato'),
+        ('Errore', 'Errore'),
+    ]
+    utente = models.ForeignKey(User, on_delete=models.CASCADE, related_name='job_sincronizzazione')
+    tipo = models.CharField(max_length=20, choices=TIPI, default='incrementale')
+    stato = models.CharField(max_length=20, choices=STATI, default='In Coda', db_index=True)
+    # Checkpoint: prossima pagina da scaricare e filtro 'after' fissato all'accodamento
+    pagina = models.IntegerField(default=1)
+    after_timestamp = models.BigIntegerField(null=True, blank=True)
+    attivita_importate = models.IntegerField(default=0)
+    progresso = models.IntegerField(default=0)
+    messaggio_stato = models.CharField(max_length=200, default='In coda...')
+    errore = models.TextField(blank=True, null=True)
+    tentativi = models.IntegerField(default=0)
+    riprova_dopo = models.DateTimeField(null=True, blank=True)  # Pausa per rate limit Strava
+    heartbeat = models.DateTimeField(null=True, blank=True)  # Ultimo segno di vita del worker
+    data_creazione = models.DateTimeField(auto_now_add=True)
+    data_inizio = models.DateTimeField(null=True, blank=True)
+    data_fine = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Job Sincronizzazione"
+        verbose_name_plural = "Job Sincronizzazione"
+        ordering = ['-data_creazione']
+
+    def __str__(self):
+        return f"Sync {self.get_tipo_display()} {self.utente} ({self.stato})"
+
+class StatoBackfill(models.Model):
+    """Avanzamento del download dello storico completo di un atleta: permette di riprendere da dove si era fermato"""
+    STATI = [
+        ('In Corso', 'In Corso'),
+        ('Completato', 'Completato'),
+    ]
+    atleta = models.OneToOneField(ProfiloAtleta, on_delete=models.CASCADE, related_name='stato_backfill')
+    stato = models.CharField(max_length=20, choices=STATI, default='In Corso')
+    pagine_scaricate = models.IntegerField(default=0)
+    attivita_scaricate = models.IntegerField(default=0)
+    # Timestamp Unix (start_date) dell'attività più vecchia e più recente già scaricate: la prossima pagina parte da 'before'
+    ts_piu_vecchio = models.BigIntegerField(null=True, blank=True)
+    ts_piu_recente = models.BigIntegerField(null=True, blank=True)
+    # ID Strava delle attività salvate senza dettaglio (quota esaurita): recuperati a fine storico
+    dettagli_in_sospeso = models.JSONField(default=list, blank=True)
+    data_inizio = models.DateTimeField(auto_now_add=True)
+    data_aggiornamento = models.DateTimeField(auto_now=True)
+    data_completamento = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Stato Backfill"
+        verbose_name_plural = "Stati Backfill"
+
+    def __str__(self):
+        return f"Backfill {self.atleta} ({self.stato}, {self.attivita_scaricate} attività)"
+
+class StreamAttivita(models.Model):
+    """Indice degli stream Strava salvati su disco (file .npz compresso per attività, vedi atleti/streams.py)"""
+    strava_activity_id = models.BigIntegerField(unique=True)
+    percorso = models.CharField(max_length=255)  # Relativo a STREAMS_ROOT
+    chiavi = models.JSONField(default=list)  # Stream presenti (time, altitude, grade_smooth, ...)
+    campioni = models.IntegerField(default=0)
+    dimensione_byte = models.IntegerField(default=0)
+    data_download = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Stream Attività"
+        verbose_name_plural = "Stream Attività"
+
+    def __str__(self):
+        return f"Stream {self.strava_activity_id} ({self.campioni} punti)"
+
+@receiver(post_delete, sender=StreamAttivita)
+def elimina_file_stream(sender, instance, **kwargs):
+    """Rimuove il file .npz quando si cancella la riga di indice"""
+    from .streams import elimina_stream
+    elimina_stream(instance.percorso)
+
+@receiver(post_delete, sender=Attivita)
+def elimina_stream_attivita(sender, instance, **kwargs):
+    """Attività cancellata (es. evento delete del webhook): via anche lo stream locale"""
+    StreamAttivita.objects.filter(strava_activity_id=instance.strava_activity_id).delete()
+
+class AggregatoAtleta(models.Model):
+    """Totali precalcolati per atleta e periodo (giorno/settimana/anno), aggiornati a ogni modifica delle attività"""
+    PERIODI = [
+        ('G', 'Giorno'),
+        ('S', 'Settimana'),
+        ('A', 'Anno'),
+    ]
+    atleta = models.ForeignKey(ProfiloAtleta, on_delete=models.CASCADE, related_name='aggregati')
+    periodo = models.CharField(max_length=1, choices=PERIODI)
+    data_inizio = models.DateField()  # Giorno, lunedì della settimana o 1 gennaio
+    distanza = models.FloatField(default=0.0)  # metri
+    dislivello = models.FloatField(default=0.0)
+    durata = models.IntegerField(default=0)  # secondi
+    carico = models.FloatField(default=0.0)  # Km Sforzo (1km + 100m D+)
+    numero_attivita = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Aggregato Atleta"
+        verbose_name_plural = "Aggregati Atleta"
+        constraints = [
+            models.UniqueConstraint(fields=['atleta', 'periodo', 'data_inizio'], name='aggregato_atleta_unico'),
+        ]
+
+    def __str__(self):
+        return f"{self.atleta} {self.get_periodo_display()} {self.data_inizio}"
+
+@receiver(post_save, sender=Attivita)
+def aggiorna_aggregati_attivita(sender, instance, **kwargs):
+    """Ricalcola i rollup toccati quando cambiano data, distanza, dislivello o durata di un'attività"""
+    originali = getattr(instance, '_valori_aggregati', None)
+    attuali = instance.valori_aggregati()
+    if originali == attuali:
+        return
+    from .aggregati import aggiorna_aggregati
+    if originali and originali[0] != attuali[0]:
+        # Attività spostata su un altro atleta: aggiorniamo anche i suoi totali
+        aggiorna_aggregati(originali[0], [originali[1]])
+        originali = None
+    aggiorna_aggregati(instance.atleta_id, [instance.data, originali[1] if originali else None])
+    instance._valori_aggregati = attuali
+
+@receiver(post_delete, sender=Attivita)
+def aggiorna_aggregati_cancellazione(sender, instance, **kwargs):
+    from .aggregati import aggiorna_aggregati
+    aggiorna_aggregati(instance.atleta_id, [instance.data])
+
+class SnapshotCoach(models.Model):
+    """Contesto della dashboard coach di una settimana chiusa, per team (None = tutti), vedi atleti/snapshot.py"""
+    team = models.ForeignKey(Team, on_delete=models.CASCADE, null=True, blank=True, related_name='snapshot_coach')
+    settimana_inizio = models.DateField()
+    dati = models.JSONField()  # Contesto serializzato (gli atleti sono salvati come ID)
+    data_creazione = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Snapshot Coach"
+        verbose_name_plural = "Snapshot Coach"
+        constraints = [
+            models.UniqueConstraint(fields=['team', 'settimana_inizio'], name='snapshot_coach_unico', nulls_distinct=False),
+        ]
+
+    def __str__(self):
+        return f"Snapshot {self.team or 'Tutti'} {self.settimana_inizio}"
+
+@receiver(post_save, sender=Attivita)
+def invalida_snapshot_attivita(sender, instance, **kwargs):
+    """Un'attività modificata invalida gli snapshot delle settimane chiuse che la includono (vecchia e nuova data)"""
+    originali = getattr(instance, '_valori_snapshot', None)
+    attuali = instance.valori_snapshot()
+    if originali == attuali:
+        return
+    from .snapshot import invalida_snapshot_coach
+    invalida_snapshot_coach(instance.data, originali[1] if originali else None)
+    instance._valori_snapshot = attuali
+
+@receiver(post_delete, sender=Attivita)
+def invalida_snapshot_cancellazione(sender, instance, **kwargs):
+    from .snapshot import invalida_snapshot_coach
+    invalida_snapshot_coach(instance.data)
+
+@receiver(m2m_changed, sender=Team.membri.through)
+def invalida_snapshot_team(sender, instance, **kwargs):
+    """Cambio membri: gli snapshot del team non sono più validi"""
+    if kwargs.get('action') not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if isinstance(instance, Team):
+        SnapshotCoach.objects.filter(team=instance).delete()
+    else:
+        # Modifica dal lato utente (user.teams_appartenenza.add/remove/clear)
+        pk_set = kwargs.get('pk_set')
+        snapshot = SnapshotCoach.objects.filter(team__isnull=False)
+        (snapshot.filter(team_id__in=pk_set) if pk_set is not None else snapshot).delete()
+
+class FinestraVO2max(models.Model):
+    """Ultime attività con VO2max dell'atleta (tutte e solo strada), base della media mobile, vedi atleti/finestra_vo2max.py"""
+    atleta = models.OneToOneField(ProfiloAtleta, on_delete=models.CASCADE, related_name='finestra_vo2max')
+    tutte = models.JSONField(default=list)  # [[data ISO, id attività, vo2max], ...] dalla più recente
+    strada = models.JSONField(default=list)  # Idem, solo 'Run'
+    data_aggiornamento = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Finestra VO2max"
+        verbose_name_plural = "Finestre VO2max"
+
+    def __str__(self):
+        return f"Finestra VO2max {self.atleta}"
+
+@receiver(post_save, sender=Attivita)
+def aggiorna_finestra_vo2max_attivita(sender, instance, **kwargs):
+    """Aggiorna la media mobile solo se cambiano VO2max, data, tipo o atleta dell'attività"""
+    originali = getattr(instance, '_valori_vo2max', None)
+    attuali = instance.valori_vo2max()
+    if originali == attuali:
+        return
+    from .finestra_vo2max import aggiorna_finestra_vo2max, ricostruisci_finestra_vo2max
+    if originali and originali[0] != attuali[0]:
+        ricostruisci_finestra_vo2max(originali[0])
+    aggiorna_finestra_vo2max(instance.atleta_id, [(instance.pk, instance.data, instance.vo2max_stimato, instance.tipo_attivita)])
+    instance._valori_vo2max = attuali
+
+@receiver(post_delete, sender=Attivita)
+def aggiorna_finestra_vo2max_cancellazione(sender, instance, **kwargs):
+    # crea=False: nella cancellazione a cascata dell'atleta la finestra non va ricreata
+    from .finestra_vo2max import aggiorna_finestra_vo2max
+    aggiorna_finestra_vo2max(instance.atleta_id, [(instance.pk, instance.data, None, instance.tipo_attivita)], crea=False)
+
 class Scarpa(models.Model):
     atleta = models.ForeignKey(ProfiloAtleta, on_delete=models.CASCADE, related_name='scarpe')
     strava_id = models.CharField(max_length=50, unique=True)
@@ -290,6 +616,20 @@ class Scarpa(models.Model):
     def distanza_km(self):
         return round(self.distanza / 1000, 1)
 
+class ImprontaDatiStrava(models.Model):
+    """Impronte dell'ultimo /athlete elaborato (ETag e hash delle scarpe), vedi atleti/impronte_strava.py"""
+    atleta = models.OneToOneField(ProfiloAtleta, on_delete=models.CASCADE, related_name='impronta_strava')
+    etag = models.CharField(max_length=200, blank=True, default='')
+    hash_scarpe = models.CharField(max_length=64, blank=True, default='')
+    data_aggiornamento = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Impronta Dati Strava"
+        verbose_name_plural = "Impronte Dati Strava"
+
+    def __str__(self):
+        return f"Impronta Strava {self.atleta}"
+
 class Allenamento(models.Model):
     TIPO_CHOICES = [('Trail', 'Trail Running'), ('Strada', 'Corsa su Strada')]
     VISIBILITA_CHOICES = [
@@ -0,0 +1,117 @@
+"""
+Partizionamento mensile (PostgreSQL, RANGE su data) della tabella dei LogSistema.
+La migrazione 0051 converte la tabella; qui si creano le partizioni dei mesi futuri e si applica la retention
+staccando le partizioni vecchie (DROP o archiviazione come tabella a sé) invece di cancellare riga per riga.
+Su database diversi da PostgreSQL, o se la tabella non è partizionata, le funzioni non fanno nulla.
+"""
+import logging
+import re
+from datetime import date
+
+from django.db import connection, transaction
+
+from .models import LogSistema
+
+logger = logging.getLogger(__name__)
+
+TABELLA = LogSistema._meta.db_table
+DEFAULT = f"{TABELLA}_default"
+FORMATO_NOME = re.compile(rf"^{TABELLA}_p(\d{{4}})(\d{{2}})$")
+
+
+def _mese_successivo(mese):
+    return date(mese.year + mese.month // 12, mese.month % 12 + 1, 1)
+
+
+def nome_partizione(mese):
+    return f"{TABELLA}_p{mese:%Y%m}"
+
+
+def tabella_partizionata():
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid "
+            "WHERE c.relname = %s AND pg_catalog.pg_table_is_visible(c.oid)",
+            [TABELLA],
+        )
+        return cursor.fetchone() is not None
+
+
+def partizioni_esistenti():
+    """Partizioni mensili attaccate alla tabella: {primo giorno del mese: nome}."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = %s",
+            [TABELLA],
+        )
+        nomi = [r[0] for r in cursor.fetchall()]
+    partizioni = {}
+    for nome in nomi:
+        m = FORMATO_NOME.match(nome)
+        if m:
+            partizioni[date(int(m.group(1)), int(m.group(2)), 1)] = nome
+    return partizioni
+
+
+def crea_partizione(cursor, mese):
+    """
+    Crea la partizione del mese. Le righe del mese finite nella partizione DEFAULT (mese non ancora creato)
+    vengono spostate prima dell'ATTACH, altrimenti PostgreSQL rifiuterebbe la nuova partizione.
+    """
+    nome = nome_partizione(mese)
+    inizio, fine = mese.isoformat(), _mese_successivo(mese).isoformat()
+    cursor.execute(f'CREATE TABLE "{nome}" (LIKE "{TABELLA}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+    cursor.execute(
+        f'WITH spostate AS (DELETE FROM "{DEFAULT}" WHERE data >= %s AND data < %s RETURNING *) '
+        f'INSERT INTO "{nome}" SELECT * FROM spostate',
+        [inizio, fine],
+    )
+    cursor.execute(f'ALTER TABLE "{TABELLA}" ATTACH PARTITION "{nome}" FOR VALUES FROM (%s) TO (%s)', [inizio, fine])
+
+
+def crea_partizioni(mesi_avanti=3, oggi=None):
+    """Crea (se mancano) le partizioni dal mese corrente ai prossimi mesi_avanti. Restituisce i nomi creati."""
+    if not tabella_partizionata():
+        return []
+    oggi = oggi or date.today()
+    esistenti = partizioni_esistenti()
+    create = []
+    mese = oggi.replace(day=1)
+    for _ in range(mesi_avanti + 1):
+        if mese not in esistenti:
+            with transaction.atomic(), connection.cursor() as cursor:
+                crea_partizione(cursor, mese)
+            create.append(nome_partizione(mese))
+            logger.info(f"Partizione log creata: {nome_partizione(mese)}")
+        mese = _mese_successivo(mese)
+    return create
+
+
+def elimina_partizioni(prima_di, archivia=False):
+    """
+    Stacca le partizioni interamente precedenti a `prima_di` (data): DROP, oppure rinomina in *_archivio
+    se archivia=True. Le eventuali righe vecchie nella partizione DEFAULT si cancellano normalmente.
+    Restituisce i nomi delle partizioni rimosse.
+    """
+    if not tabella_partizionata():
+        return []
+    rimosse = []
+    for mese, nome in sorted(partizioni_esistenti().items()):
+        if _mese_successivo(mese) > prima_di:
+            continue
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'ALTER TABLE "{TABELLA}" DETACH PARTITION "{nome}"')
+            if archivia:
+                cursor.execute(f'ALTER TABLE "{nome}" RENAME TO "{nome}_archivio"')
+            else:
+                cursor.execute(f'DROP TABLE "{nome}"')
+        rimosse.append(nome)
+        logger.info(f"Partizione log {'archiviata' if archivia else 'eliminata'}: {nome}")
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM "{DEFAULT}" WHERE data < %s', [prima_di.isoformat()])
+    return rimosse
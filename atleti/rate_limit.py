@@ -0,0 +1,172 @@
+"""
+Rate limiter condiviso per le API Strava.
+
+Strava applica due quote per applicazione: una sulla finestra di 15 minuti (allineata a :00, :15, :30, :45)
+e una giornaliera (azzerata a mezzanotte UTC). I contatori sono righe QuotaStrava nel DB, incrementate con
+UPDATE condizionati (atomici anche tra processi): web, scheduler e comandi attingono dallo stesso budget.
+I limiti letti dagli header e il blocco dopo un 429 stanno nella cache condivisa (CACHES in settings).
+
+Le richieste interattive (l'utente sta aspettando) possono usare tutta la quota, quelle in background
+si fermano prima, lasciando una riserva. Nessuna attesa: se il permesso è negato il chiamante si ferma
+e riprende al giro successivo.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+
+from .models import QuotaStrava
+
+logger = logging.getLogger(__name__)
+
+INTERATTIVA = 'interattiva'
+BACKGROUND = 'background'
+
+FINESTRA_BREVE = 15 * 60
+FINESTRA_GIORNO = 24 * 60 * 60
+
+CHIAVE_LIMITI = 'strava_rl:limiti'
+CHIAVE_BLOCCO = 'strava_rl:blocco'
+
+
+def _finestre(ora):
+    """(chiave, scadenza) dei contatori per la finestra di 15 minuti e per il giorno correnti."""
+    inizio_breve = int(ora // FINESTRA_BREVE) * FINESTRA_BREVE
+    inizio_giorno = int(ora // FINESTRA_GIORNO) * FINESTRA_GIORNO
+    return (f"15m:{inizio_breve}", inizio_breve + FINESTRA_BREVE), (f"giorno:{inizio_giorno}", inizio_giorno + FINESTRA_GIORNO)
+
+
+def _usate(ora):
+    """Richieste già consumate (15 minuti, giorno)."""
+    (breve, _), (giorno, _) = _finestre(ora)
+    usate = dict(QuotaStrava.objects.filter(finestra__in=[breve, giorno]).values_list('finestra', 'usate'))
+    return usate.get(breve, 0), usate.get(giorno, 0)
+
+
+def _limiti():
+    """Limiti (15 minuti, giornaliero): quelli letti dagli header Strava, altrimenti da settings."""
+    return cache.get(CHIAVE_LIMITI) or (settings.STRAVA_LIMITE_15MIN, settings.STRAVA_LIMITE_GIORNALIERO)
+
+
+def _soglia(limite, priorita):
+    if priorita == INTERATTIVA:
+        return limite
+    return int(limite * (1 - settings.STRAVA_RISERVA_INTERATTIVA))
+
+
+def _crea_finestra(chiave, scadenza, usate=0):
+    """Riga del contatore (se manca). All'apertura di una finestra si cancellano quelle scadute."""
+    riga, creata = QuotaStrava.objects.get_or_create(finestra=chiave, defaults={'scadenza': scadenza, 'usate': usate})
+    if creata:
+        QuotaStrava.objects.filter(scadenza__lt=time.time()).delete()
+    return riga, creata
+
+
+def _prenota(chiave, scadenza, n, soglia):
+    """Incremento atomico condizionato: True se, con le n richieste, il contatore resta entro la soglia."""
+    for _ in range(2):
+        if QuotaStrava.objects.filter(finestra=chiave, usate__lte=soglia - n).update(usate=F('usate') + n):
+            return True
+        _, creata = _crea_finestra(chiave, scadenza)
+        if not creata:
+            # La riga c'era già: quota esaurita
+            return False
+    return False
+
+
+def secondi_al_reset(ora=None):
+    """Secondi mancanti all'apertura della prossima finestra di 15 minuti."""
+    ora = ora or time.time()
+    return int(FINESTRA_BREVE - (ora % FINESTRA_BREVE)) + 1
+
+
+def quota_disponibile(priorita=BACKGROUND, n=1):
+    """Controlla (senza consumare) se ci sono almeno n richieste disponibili per la priorità data."""
+    ora = time.time()
+    if cache.get(CHIAVE_BLOCCO, 0) > ora:
+        return False
+    limite_breve, limite_giorno = _limiti()
+    usate_breve, usate_giorno = _usate(ora)
+    return (
+        usate_breve + n <= _soglia(limite_breve, priorita)
+        and usate_giorno + n <= _soglia(limite_giorno, priorita)
+    )
+
+
+def acquisisci_permesso(priorita=BACKGROUND, n=1):
+    """
+    Prenota n richieste Strava. Restituisce True se il chiamante può procedere,
+    False se la quota (o la parte riservata alla sua priorità) è esaurita.
+    """
+    ora = time.time()
+    if cache.get(CHIAVE_BLOCCO, 0) > ora:
+        return False
+
+    limite_breve, limite_giorno = _limiti()
+    (chiave_breve, scadenza_breve), (chiave_giorno, scadenza_giorno) = _finestre(ora)
+    if _prenota(chiave_breve, scadenza_breve, n, _soglia(limite_breve, priorita)):
+        if _prenota(chiave_giorno, scadenza_giorno, n, _soglia(limite_giorno, priorita)):
+            return True
+        # Restituiamo la prenotazione della finestra breve: non verrà usata
+        QuotaStrava.objects.filter(finestra=chiave_breve).update(usate=F('usate') - n)
+
+    usate_breve, usate_giorno = _usate(ora)
+    logger.warning(f"Rate limit Strava: permesso negato ({priorita}). Uso {usate_breve}/{limite_breve} (15 min), {usate_giorno}/{limite_giorno} (giorno).")
+    return False
+
+
+def _leggi_coppia(response, nome):
+    valore = response.headers.get(nome)
+    if not valore:
+        return None
+    try:
+        breve, giorno = (int(v) for v in valore.split(','))
+        return breve, giorno
+    except ValueError:
+        return None
+
+
+def registra_risposta(response):
+    """
+    Allinea i contatori locali agli header X-RateLimit di Strava (che contano anche le richieste
+    fatte da altri processi) e, in caso di 429, blocca i permessi fino alla finestra successiva.
+    """
+    # Le nostre chiamate sono tutte in lettura: se Strava espone i limiti di lettura, sono quelli stringenti
+    limiti = _leggi_coppia(response, 'X-ReadRateLimit-Limit') or _leggi_coppia(response, 'X-RateLimit-Limit')
+    uso = _leggi_coppia(response, 'X-ReadRateLimit-Usage') or _leggi_coppia(response, 'X-RateLimit-Usage')
+
+    ora = time.time()
+    if limiti:
+        cache.set(CHIAVE_LIMITI, limiti, FINESTRA_GIORNO)
+    if uso:
+        for (chiave, scadenza), usate in zip(_finestre(ora), uso):
+            _, creata = _crea_finestra(chiave, scadenza, usate)
+            if not creata:
+                # Solo verso l'alto: le nostre prenotazioni in volo non ancora viste da Strava restano contate
+                QuotaStrava.objects.filter(finestra=chiave, usate__lt=usate).update(usate=usate)
+
+    if response.status_code == 429:
+        limite_giorno = (limiti or _limiti())[1]
+        if uso and uso[1] >= limite_giorno:
+            # Quota giornaliera finita: blocco fino a mezzanotte UTC
+            fine = (int(ora // FINESTRA_GIORNO) + 1) * FINESTRA_GIORNO
+        else:
+            fine = ora + secondi_al_reset(ora)
+        cache.set(CHIAVE_BLOCCO, fine, int(fine - ora) + 1)
+        logger.warning(f"Rate limit Strava (429): richieste sospese per {int(fine - ora)}s.")
+
+
+def stato_quota():
+    """Fotografia dei contatori correnti (per log e pannelli admin)."""
+    ora = time.time()
+    limite_breve, limite_giorno = _limiti()
+    usate_breve, usate_giorno = _usate(ora)
+    return {
+        'usate_15min': usate_breve,
+        'limite_15min': limite_breve,
+        'usate_giorno': usate_giorno,
+        'limite_giorno': limite_giorno,
+        'bloccato': cache.get(CHIAVE_BLOCCO, 0) > ora,
+    }
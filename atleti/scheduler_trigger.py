@@ -0,0 +1,79 @@
+"""
+Avvio immediato dei task manuali tramite PostgreSQL LISTEN/NOTIFY.
+La vista run_task_manually imposta il flag manual_trigger e pubblica un NOTIFY sul canale CANALE;
+run_scheduler tiene un thread in LISTEN su una connessione dedicata e, alla notifica, anticipa
+subito l'heartbeat. Il polling dell'heartbeat resta solo come fallback lento.
+"""
+import logging
+import select
+import threading
+
+from django.db import connection, connections, transaction
+
+logger = logging.getLogger(__name__)
+
+CANALE = 'atleti_task_manuale'
+
+
+def notifica_task_manuale(task_id):
+    """Pubblica la richiesta dopo il commit (il listener deve già vedere manual_trigger=True)."""
+    if connection.vendor != 'postgresql':
+        return
+
+    def _notifica():
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT pg_notify(%s, %s)", [CANALE, task_id])
+        except Exception as e:
+            # Non bloccante: il polling di fallback eseguirà comunque il task
+            logger.warning(f"NOTIFY task manuale fallita ({task_id}): {e}")
+
+    transaction.on_commit(_notifica)
+
+
+def _ascolta(callback, stop, timeout):
+    """Un ciclo di ascolto su una connessione dedicata; esce con eccezione se la connessione cade."""
+    wrapper = connections.create_connection('default')
+    try:
+        wrapper.ensure_connection()
+        raw = wrapper.connection
+        raw.autocommit = True
+        with raw.cursor() as cursor:
+            cursor.execute(f"LISTEN {CANALE}")
+        logger.info(f"SCHEDULER: In ascolto sul canale '{CANALE}' per i task manuali.")
+
+        while not stop.is_set():
+            # Attesa passiva sul socket: nessuna query finché non arriva una notifica
+            if select.select([raw], [], [], timeout) == ([], [], []):
+                continue
+            raw.poll()
+            while raw.notifies:
+                notifica = raw.notifies.pop(0)
+                callback(notifica.payload)
+    finally:
+        wrapper.close()
+
+
+def avvia_listener(callback, timeout=30):
+    """
+    Avvia il thread di ascolto (solo PostgreSQL). callback(task_id) viene chiamata ad ogni notifica.
+    In caso di errore di connessione il listener si riconnette con backoff. Restituisce l'Event di stop o None.
+    """
+    if connection.vendor != 'postgresql':
+        return None
+
+    stop = threading.Event()
+
+    def _loop():
+        attesa = 1
+        while not stop.is_set():
+            try:
+                _ascolta(callback, stop, timeout)
+                attesa = 1
+            except Exception as e:
+                logger.error(f"SCHEDULER: Listener task manuali interrotto ({e}). Riconnessione tra {attesa}s.")
+                stop.wait(attesa)
+                attesa = min(attesa * 2, 60)
+
+    threading.Thread(target=_loop, name='task-listener', daemon=True).start()
+    return stop
@@ -0,0 +1,98 @@
+"""
+Snapshot della dashboard coach per le settimane chiuse (SnapshotCoach).
+Il contesto viene serializzato in JSON sostituendo i profili atleta con il loro ID; alla lettura
+gli atleti vengono ricaricati con una sola query (in_bulk). Uno snapshot viene invalidato quando
+cambia un'attività che cade prima della fine della sua settimana, o quando cambiano i membri del team.
+"""
+import copy
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db.models.query import QuerySet
+from django.utils import timezone
+
+from .aggregati import giorno_attivita, inizio_settimana
+from .models import ProfiloAtleta, SnapshotCoach
+
+CHIAVE_ATLETA = '__atleta__'
+
+
+def _serializza(valore):
+    if isinstance(valore, ProfiloAtleta):
+        dati = {CHIAVE_ATLETA: valore.pk}
+        ultima = getattr(valore, 'last_act', None)  # Annotazione della lista inattivi
+        if ultima:
+            dati['last_act'] = ultima.isoformat()
+        return dati
+    if isinstance(valore, dict):
+        return {chiave: _serializza(v) for chiave, v in valore.items()}
+    if isinstance(valore, (list, tuple, QuerySet)):
+        return [_serializza(v) for v in valore]
+    return valore
+
+
+def _raccogli_id(valore, ids):
+    if isinstance(valore, dict):
+        if CHIAVE_ATLETA in valore:
+            ids.add(valore[CHIAVE_ATLETA])
+        for v in valore.values():
+            _raccogli_id(v, ids)
+    elif isinstance(valore, list):
+        for v in valore:
+            _raccogli_id(v, ids)
+
+
+def _ripristina(valore, atleti):
+    if isinstance(valore, dict):
+        if CHIAVE_ATLETA in valore:
+            atleta = atleti.get(valore[CHIAVE_ATLETA])
+            if atleta is not None and 'last_act' in valore:
+                # Copia: l'istanza di in_bulk è condivisa con le altre sezioni del contesto
+                atleta = copy.copy(atleta)
+                atleta.last_act = datetime.fromisoformat(valore['last_act'])
+            return atleta
+        ripristinato = {chiave: _ripristina(v, atleti) for chiave, v in valore.items()}
+        # Voci di classifica/allarme di un atleta nel frattempo cancellato
+        if 'atleta' in ripristinato and ripristinato['atleta'] is None:
+            return None
+        return ripristinato
+    if isinstance(valore, list):
+        return [v for v in (_ripristina(v, atleti) for v in valore) if v is not None]
+    return valore
+
+
+def leggi_snapshot_coach(team, settimana_inizio):
+    """Contesto salvato della settimana, o None se assente o troppo vecchio."""
+    snapshot = SnapshotCoach.objects.filter(
+        team=team,
+        settimana_inizio=settimana_inizio,
+        data_creazione__gte=timezone.now() - timedelta(hours=settings.SNAPSHOT_COACH_ORE),
+    ).first()
+    if not snapshot:
+        return None
+
+    ids = set()
+    _raccogli_id(snapshot.dati, ids)
+    atleti = ProfiloAtleta.objects.select_related('user').in_bulk(ids)
+    return _ripristina(snapshot.dati, atleti)
+
+
+def salva_snapshot_coach(team, settimana_inizio, context):
+    SnapshotCoach.objects.update_or_create(
+        team=team,
+        settimana_inizio=settimana_inizio,
+        defaults={'dati': _serializza(context)},
+    )
+
+
+def invalida_snapshot_coach(*date_attivita):
+    """Cancella gli snapshot delle settimane chiuse che terminano dopo la più vecchia delle date indicate."""
+    giorni = [giorno_attivita(d) for d in date_attivita if d]
+    if not giorni:
+        return
+    piu_vecchia = min(giorni)
+
+    # Solo attività della settimana corrente: nessuna settimana chiusa coinvolta, evitiamo la query
+    if piu_vecchia >= inizio_settimana(timezone.now().date()):
+        return
+    SnapshotCoach.objects.filter(settimana_inizio__gt=piu_vecchia - timedelta(days=7)).delete()
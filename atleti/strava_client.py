@@ -0,0 +1,126 @@
+"""
+Client HTTP condiviso per le API Strava (e il geocoding Nominatim).
+Una requests.Session per processo con pool di connessioni keep-alive: le sync in blocco non pagano più
+un handshake TCP+TLS per richiesta. Gli errori di connessione (richiesta mai arrivata a Strava) vengono
+ripetuti dall'adapter; le risposte 5xx invece contano nella quota, quindi GET e DELETE le ripetono qui con
+backoff esponenziale solo dopo aver ottenuto un nuovo permesso dal rate limiter. I 429 non si ripetono mai:
+li gestisce il rate limiter (registra_risposta blocca fino alla finestra successiva). Timeout di default su ogni chiamata.
+"""
+import logging
+import os
+import threading
+import time
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from . import rate_limit
+
+logger = logging.getLogger(__name__)
+
+BASE_URL = 'https://www.strava.com/api/v3'
+URL_TOKEN = 'https://www.strava.com/oauth/token'
+URL_NOMINATIM = 'https://nominatim.openstreetmap.org/search'
+USER_AGENT = 'BarillaMonitor/1.0'
+ERRORI_TEMPORANEI = (500, 502, 503, 504)
+
+_lock = threading.Lock()
+_sessioni = {}
+_pid = None
+
+
+def _crea_sessione():
+    # Solo errori di connessione: una lettura fallita o una risposta 5xx può essere già stata contata da Strava
+    retry = Retry(
+        total=settings.STRAVA_HTTP_TENTATIVI,
+        connect=settings.STRAVA_HTTP_TENTATIVI,
+        read=0,
+        status=0,
+        backoff_factor=1,  # 1s, 2s, 4s...
+        allowed_methods=frozenset(['GET', 'DELETE']),  # Mai le POST (es. refresh token: il refresh token ruota)
+    )
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=settings.STRAVA_HTTP_POOL, max_retries=retry)
+    sessione = requests.Session()
+    sessione.mount('https://', adapter)
+    # requests chiede già gzip/deflate (Accept-Encoding) e decomprime da solo
+    sessione.headers['User-Agent'] = USER_AGENT
+    return sessione
+
+
+def sessione(nome='strava'):
+    """Session condivisa del processo (ricreata dopo un fork: i socket del padre non vanno riusati)."""
+    global _pid
+    with _lock:
+        if _pid != os.getpid():
+            _sessioni.clear()
+            _pid = os.getpid()
+        if nome not in _sessioni:
+            _sessioni[nome] = _crea_sessione()
+        return _sessioni[nome]
+
+
+def _url(percorso):
+    return percorso if percorso.startswith('https://') else f"{BASE_URL}/{percorso.lstrip('/')}"
+
+
+def _timeout(timeout):
+    return timeout or (settings.STRAVA_HTTP_TIMEOUT_CONNESSIONE, settings.STRAVA_HTTP_TIMEOUT_LETTURA)
+
+
+def _headers(access_token, extra=None):
+    headers = {'Authorization': f'Bearer {access_token}'} if access_token else {}
+    headers.update(extra or {})
+    return headers
+
+
+def _con_ripetizioni(invia, quota=True, priorita=rate_limit.BACKGROUND):
+    """
+    Esegue invia() ripetendolo sugli errori 5xx con backoff (1s, 2s, 4s...). Con quota=True (Strava) ogni
+    ripetizione prende prima un permesso dal rate limiter con la priorità del chiamante:
+    se è negato si restituisce l'ultima risposta.
+    """
+    response = invia()
+    for tentativo in range(settings.STRAVA_HTTP_TENTATIVI):
+        if response.status_code not in ERRORI_TEMPORANEI:
+            break
+        time.sleep(2 ** tentativo)
+        if quota and not rate_limit.acquisisci_permesso(priorita):
+            logger.warning(f"Strava HTTP: errore {response.status_code}, nessuna ripetizione (quota esaurita).")
+            break
+        response = invia()
+    return response
+
+
+def get(percorso, access_token=None, params=None, timeout=None, headers=None, priorita=rate_limit.BACKGROUND):
+    """
+    GET su Strava: percorso relativo all'API (es. 'athlete/activities') o URL completo. headers: extra (es. If-None-Match).
+    priorita: quella con cui il chiamante ha preso il permesso, usata anche per le ripetizioni.
+    """
+    return _con_ripetizioni(lambda: sessione().get(
+        _url(percorso), headers=_headers(access_token, headers), params=params, timeout=_timeout(timeout),
+    ), priorita=priorita)
+
+
+def post(percorso, data=None, access_token=None, timeout=None):
+    return sessione().post(_url(percorso), headers=_headers(access_token), data=data, timeout=_timeout(timeout))
+
+
+def delete(percorso, params=None, access_token=None, timeout=None, priorita=rate_limit.BACKGROUND):
+    return _con_ripetizioni(lambda: sessione().delete(
+        _url(percorso), headers=_headers(access_token), params=params, timeout=_timeout(timeout),
+    ), priorita=priorita)
+
+
+def geocodifica(query, timeout=5):
+    """Coordinate (lat, lon) del primo risultato Nominatim, o None."""
+    res = _con_ripetizioni(lambda: sessione('nominatim').get(
+        URL_NOMINATIM, params={'format': 'json', 'q': query, 'limit': 1}, timeout=timeout,
+    ), quota=False)
+    if res.status_code != 200:
+        return None
+    data = res.json()
+    if not data:
+        return None
+    return float(data[0]['lat']), float(data[0]['lon'])
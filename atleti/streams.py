@@ -0,0 +1,119 @@
+"""
+Archivio locale degli stream Strava.
+Ogni attività ha un file .npz compresso con array tipizzati (float32/int32) sotto STREAMS_ROOT,
+indicizzato dalla tabella StreamAttivita. Gli stream si scaricano una volta sola: ricalcoli di VAM
+o nuove metriche su stream non consumano quota Strava.
+"""
+import logging
+import os
+
+import numpy as np
+from django.conf import settings
+
+from . import rate_limit, strava_client
+from .log_buffer import registra_log
+from .models import StreamAttivita
+
+logger = logging.getLogger(__name__)
+
+# Scarichiamo tutti gli stream utili in una sola chiamata (il costo API è lo stesso)
+STREAM_KEYS = ['time', 'distance', 'altitude', 'grade_smooth', 'heartrate', 'velocity_smooth', 'cadence', 'watts']
+TIPI_STREAM = {'time': np.int32, 'heartrate': np.int16, 'cadence': np.int16}  # Default float32
+
+
+def _percorso_relativo(strava_activity_id):
+    # Sottocartelle per non avere decine di migliaia di file in una sola directory
+    return os.path.join(str(strava_activity_id % 1000), f"{strava_activity_id}.npz")
+
+
+def salva_stream(strava_activity_id, stream):
+    """Salva su disco un dizionario {chiave: lista valori} e aggiorna l'indice."""
+    arrays = {
+        chiave: np.asarray(valori, dtype=TIPI_STREAM.get(chiave, np.float32))
+        for chiave, valori in stream.items()
+        if valori is not None
+    }
+    relativo = _percorso_relativo(strava_activity_id)
+    assoluto = os.path.join(settings.STREAMS_ROOT, relativo)
+    os.makedirs(os.path.dirname(assoluto), exist_ok=True)
+
+    # Scrittura atomica: file temporaneo poi rename
+    temporaneo = f"{assoluto}.tmp"
+    with open(temporaneo, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(temporaneo, assoluto)
+
+    StreamAttivita.objects.update_or_create(
+        strava_activity_id=strava_activity_id,
+        defaults={
+            'percorso': relativo,
+            'chiavi': sorted(arrays),
+            'campioni': max((len(a) for a in arrays.values()), default=0),
+            'dimensione_byte': os.path.getsize(assoluto),
+        }
+    )
+    return arrays
+
+
+def carica_stream(strava_activity_id):
+    """Restituisce gli stream locali come {chiave: np.ndarray}, oppure None se non presenti."""
+    indice = StreamAttivita.objects.filter(strava_activity_id=strava_activity_id).only('percorso').first()
+    if not indice:
+        return None
+    try:
+        with np.load(os.path.join(settings.STREAMS_ROOT, indice.percorso)) as npz:
+            return {chiave: npz[chiave] for chiave in npz.files}
+    except (OSError, ValueError) as e:
+        # File mancante o corrotto: togliamo l'indice, verrà riscaricato
+        logger.warning(f"Stream locale non leggibile per {strava_activity_id}: {e}")
+        indice.delete()
+        return None
+
+
+def stream_disponibile(strava_activity_id):
+    return StreamAttivita.objects.filter(strava_activity_id=strava_activity_id).exists()
+
+
+def elimina_stream(percorso):
+    """Rimuove il file di uno stream (chiamata dal segnale di cancellazione dell'indice)."""
+    try:
+        os.remove(os.path.join(settings.STREAMS_ROOT, percorso))
+    except FileNotFoundError:
+        pass
+
+
+def ottieni_stream(strava_activity_id, access_token, priorita=rate_limit.BACKGROUND):
+    """
+    Stream dell'attività: dall'archivio locale se presenti, altrimenti scaricati da Strava e salvati.
+    Restituisce None se non disponibili (errore API, quota esaurita, attività manuale senza stream).
+    """
+    stream = carica_stream(strava_activity_id)
+    if stream is not None:
+        return stream
+
+    if not access_token or not rate_limit.acquisisci_permesso(priorita):
+        return None
+
+    url = f"https://www.strava.com/api/v3/activities/{strava_activity_id}/streams"
+    params = {
+        'keys': ','.join(STREAM_KEYS),
+        'key_by_type': 'true'
+    }
+
+    try:
+        response = strava_client.get(url, access_token=access_token, params=params, timeout=15, priorita=priorita)
+        rate_limit.registra_risposta(response)
+
+        if response.status_code == 429:
+            registra_log(livello='WARNING', azione='Download Stream', messaggio=f"Rate Limit Strava raggiunto (ID: {strava_activity_id})")
+            return None
+
+        if response.status_code != 200:
+            registra_log(livello='ERROR', azione='Download Stream', messaggio=f"Errore streams ({response.status_code}) per ID {strava_activity_id}")
+            return None
+
+        data = response.json()
+        return salva_stream(strava_activity_id, {chiave: valore.get('data') for chiave, valore in data.items()})
+    except Exception as e:
+        registra_log(livello='ERROR', azione='Download Stream', messaggio=f"Eccezione ID {strava_activity_id}: {e}")
+        return None
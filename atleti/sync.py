@@ -0,0 +1,309 @@
+"""
+Motore di sincronizzazione Strava basato su coda persistente (JobSincronizzazione).
+La vista accoda il job e risponde subito; lo scheduler (o il comando elabora_coda_sync) lo esegue,
+salvando il checkpoint di pagina così che un riavvio riprenda da dove si era interrotto.
+Il download dello storico completo tiene inoltre uno StatoBackfill per atleta: le pagine si scorrono con il
+cursore 'before' (attività più vecchia già scaricata), così anche un job nuovo, dopo errori, 401 o più finestre
+di rate limit, riprende esattamente da lì invece di ripartire dalla pagina 1.
+"""
+import logging
+from datetime import timedelta
+
+from allauth.socialaccount.models import SocialToken
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from . import rate_limit, strava_client
+from .log_buffer import registra_log
+from .models import Attivita, JobSincronizzazione, ProfiloAtleta, StatoBackfill
+from .token_cache import token_valido
+from .utils import completa_dettagli_attivita, importa_pagina_attivita, stima_vo2max_atleta
+
+logger = logging.getLogger(__name__)
+
+URL_ATTIVITA = "https://www.strava.com/api/v3/athlete/activities"
+PER_PAGE = 100  # Blocchi grandi (max supportato ~200)
+HEARTBEAT_SCADUTO = timedelta(minutes=10)  # Oltre questo tempo un job 'In Corso' è considerato orfano
+MAX_TENTATIVI = 3
+BLOCCO_DETTAGLI = 20  # Dettagli in sospeso recuperati per blocco a fine storico
+
+
+def backfill_completato(profilo):
+    """Storico completo già scaricato. Per gli atleti sincronizzati prima di StatoBackfill vale l'ultima sync riuscita."""
+    stato = StatoBackfill.objects.filter(atleta=profilo).first()
+    if stato:
+        return stato.stato == 'Completato'
+    return profilo.data_ultima_sincronizzazione is not None
+
+
+def accoda_sincronizzazione(user, completo=False):
+    """
+    Accoda una sincronizzazione per l'utente. Se ne esiste già una attiva la restituisce
+    (niente doppioni se l'utente preme più volte il bottone).
+    """
+    attivo = JobSincronizzazione.objects.filter(utente=user, stato__in=['In Coda', 'In Corso']).first()
+    if attivo:
+        return attivo, False
+
+    profilo, _ = ProfiloAtleta.objects.get_or_create(user=user)
+    after_timestamp = None
+    # Checkpoint 'after' solo se lo storico è già stato scaricato tutto e non è richiesto di nuovo.
+    # Altrimenti il job scarica lo storico, riprendendo dallo StatoBackfill se un tentativo precedente si è interrotto.
+    last_activity = Attivita.objects.filter(atleta=profilo).order_by('-data').first()
+    if last_activity and backfill_completato(profilo) and not completo:
+        # Aggiungiamo 1 secondo per non riscaricare l'ultima attività
+        after_timestamp = int(last_activity.data.timestamp()) + 1
+    else:
+        registra_log(livello='INFO', azione='Sync Manuale', utente=user, messaggio="Avvio download completo (storico/recovery).")
+
+    job = JobSincronizzazione.objects.create(
+        utente=user,
+        tipo='completo' if completo else 'incrementale',
+        after_timestamp=after_timestamp,
+        progresso=5,
+    )
+    return job, True
+
+
+def stato_sincronizzazione(user):
+    """Stato dell'ultima sincronizzazione per il polling della barra di avanzamento."""
+    job = JobSincronizzazione.objects.filter(utente=user).first()
+    if not job:
+        return {'status': 'In attesa...', 'progress': 0, 'stato': None}
+    return {'status': job.messaggio_stato, 'progress': job.progresso, 'stato': job.stato}
+
+
+def _aggiorna(job, **campi):
+    campi['heartbeat'] = timezone.now()
+    for nome, valore in campi.items():
+        setattr(job, nome, valore)
+    job.save(update_fields=list(campi.keys()))
+
+
+def _prendi_prossimo_job():
+    """Prenota il prossimo job eseguibile. skip_locked evita che due worker prendano lo stesso job."""
+    now = timezone.now()
+    with transaction.atomic():
+        job = (
+            JobSincronizzazione.objects.select_for_update(skip_locked=True)
+            .filter(
+                Q(stato='In Coda', riprova_dopo__isnull=True)
+                | Q(stato='In Coda', riprova_dopo__lte=now)
+                # Job orfani: il worker è morto (riavvio container) senza chiudere il job
+                | Q(stato='In Corso', heartbeat__lt=now - HEARTBEAT_SCADUTO)
+            )
+            .order_by('data_creazione')
+            .first()
+        )
+        if not job:
+            return None
+        job.stato = 'In Corso'
+        job.tentativi += 1
+        job.heartbeat = now
+        job.riprova_dopo = None
+        if not job.data_inizio:
+            job.data_inizio = now
+        job.save(update_fields=['stato', 'tentativi', 'heartbeat', 'riprova_dopo', 'data_inizio'])
+        return job
+
+
+def _chiudi(job, stato, messaggio, errore=None):
+    _aggiorna(job, stato=stato, messaggio_stato=messaggio, errore=errore, progresso=100, data_fine=timezone.now())
+
+
+def _metti_in_pausa(job, messaggio):
+    """Rimette il job in coda (checkpoint invariato) fino alla prossima finestra del rate limit."""
+    riprova = timezone.now() + timedelta(seconds=rate_limit.secondi_al_reset())
+    _aggiorna(
+        job,
+        stato='In Coda',
+        riprova_dopo=riprova,
+        tentativi=0,
+        messaggio_stato=f"{messaggio} Riprendo alle {riprova.strftime('%H:%M')}...",  # USE_TZ=False: già ora locale
+    )
+
+
+def _finalizza(profilo):
+    """Calcoli a fine sync: FC max stagionale e VO2max consolidato."""
+    # Modifica: cattura la fc max degli ultimi 5 mesi (approx 150 giorni)
+    five_months_ago = timezone.now() - timedelta(days=150)
+
+    # Cerchiamo l'attività con la FC più alta nel periodo per estrarre anche la data
+    best_activity = Attivita.objects.riepilogo().filter(
+        atleta=profilo,
+        data__gte=five_months_ago,
+        fc_max_sessione__gt=160  # Filtriamo valori non fisiologici/bassi
+    ).order_by('-fc_max_sessione').first()
+
+    # Aggiorniamo il profilo al "Season Best" (ultimi 5 mesi).
+    # FIX: Se l'utente ha impostato la FC manualmente, NON sovrascriviamo.
+    if best_activity and not profilo.fc_max_manuale:
+        profilo.fc_massima_teorica = best_activity.fc_max_sessione
+        profilo.fc_max = best_activity.fc_max_sessione
+        profilo.data_fc_max = best_activity.data.date()
+        profilo.save()
+
+    # Calcolo VO2max consolidato (media mobile)
+    profilo.data_ultima_sincronizzazione = timezone.now()
+    stima_vo2max_atleta(profilo)
+
+
+def esegui_job(job):
+    """
+    Esegue (o riprende) un job di sincronizzazione a partire dal checkpoint di pagina.
+    Il checkpoint viene salvato dopo ogni pagina completata.
+    """
+    user = job.utente
+    access_token = token_valido(user.id)
+    if not access_token and not SocialToken.objects.filter(account__user=user, account__provider='strava').exists():
+        _chiudi(job, 'Errore', "Token Strava mancante. Ricollega l'account.", "SocialToken non trovato")
+        return
+    if not access_token:
+        registra_log(livello='ERROR', azione='Sync Manuale', utente=user, messaggio="Refresh token fallito.")
+        _chiudi(job, 'Errore', "Token Strava scaduto. Scollega e ricollega l'account nelle Impostazioni.", "Refresh token fallito")
+        return
+
+    profilo, _ = ProfiloAtleta.objects.get_or_create(user=user)
+    force_detail_update = job.tipo == 'completo'
+    # Senza 'after' il job scarica lo storico: si pagina con il cursore dello StatoBackfill
+    backfill = None if job.after_timestamp else _prepara_backfill(profilo)
+
+    while True:
+        _aggiorna(job, messaggio_stato=f"Scaricamento attività (Pagina {job.pagina})...", progresso=min(15 + (job.pagina * 10), 80))
+
+        if not rate_limit.acquisisci_permesso(rate_limit.INTERATTIVA):
+            _metti_in_pausa(job, "Limite richieste Strava raggiunto.")
+            return
+
+        params = {'page': job.pagina, 'per_page': PER_PAGE}
+        if job.after_timestamp:
+            params['after'] = job.after_timestamp
+        elif backfill.ts_piu_vecchio:
+            # Sempre la prima pagina prima del cursore (+1s: attività con lo stesso orario non vanno perse,
+            # le eventuali già salvate vengono solo riaggiornate)
+            params = {'page': 1, 'per_page': PER_PAGE, 'before': backfill.ts_piu_vecchio + 1}
+
+        response = strava_client.get(URL_ATTIVITA, params=params, access_token=access_token, timeout=30, priorita=rate_limit.INTERATTIVA)
+        rate_limit.registra_risposta(response)
+
+        if response.status_code == 401:
+            # TENTATIVO DI RECOVERY: Il token potrebbe essere revocato o scaduto nonostante il DB dica il contrario.
+            new_token = token_valido(user.id, rifiutato=access_token)
+            if new_token:
+                access_token = new_token
+                response = strava_client.get(URL_ATTIVITA, params=params, access_token=access_token, timeout=30, priorita=rate_limit.INTERATTIVA)
+                rate_limit.registra_risposta(response)
+
+            if response.status_code == 401:
+                # Logghiamo il corpo della risposta per capire il motivo (es. Scope mancanti)
+                err_msg = f"Token rifiutato dopo refresh. Strava dice: {response.text[:150]}"
+                registra_log(livello='WARNING', azione='Sync Manuale', utente=user, messaggio=err_msg)
+                _chiudi(job, 'Errore', "Token Strava rifiutato. Ricollega l'account.", err_msg)
+                return
+
+        if response.status_code == 429:
+            registra_log(livello='WARNING', azione='Sync Manuale', utente=user, messaggio=f"Rate Limit Strava raggiunto (pagina {job.pagina}). Job rimesso in coda.")
+            _metti_in_pausa(job, "Limite richieste Strava raggiunto.")
+            return
+
+        if response.status_code != 200:
+            registra_log(livello='ERROR', azione='Sync Manuale', utente=user, messaggio=f"Errore API: {response.text}")
+            raise ValueError(f"Errore API Strava {response.status_code}")
+
+        activities = response.json()
+        # Import batch dell'intera pagina (Run, TrailRun e Hike; Hike trattato come Trail)
+        dettagli_mancanti = []
+        nuove = importa_pagina_attivita(
+            activities, profilo, access_token, force_detail_update=force_detail_update,
+            priorita=rate_limit.INTERATTIVA, dettagli_mancanti=dettagli_mancanti,
+        )
+
+        # Pagina completata: avanziamo il checkpoint
+        _aggiorna(job, pagina=job.pagina + 1, attivita_importate=job.attivita_importate + len(nuove))
+        if backfill:
+            _avanza_backfill(backfill, activities, dettagli_mancanti)
+
+        # Se la pagina è incompleta, significa che abbiamo finito
+        if len(activities) < PER_PAGE:
+            break
+
+    if backfill:
+        if not _recupera_dettagli_in_sospeso(job, backfill, access_token):
+            return
+        backfill.stato = 'Completato'
+        backfill.data_completamento = timezone.now()
+        backfill.save(update_fields=['stato', 'data_completamento', 'data_aggiornamento'])
+
+    _aggiorna(job, messaggio_stato='Analisi fisiologica e statistiche...', progresso=90)
+    _finalizza(profilo)
+
+    _chiudi(job, 'Completato', 'Completato!')
+    registra_log(livello='INFO', azione='Sync Manuale', utente=user, messaggio=f"Sincronizzazione completata con successo ({job.attivita_importate} nuove attività).")
+
+
+def _timestamp(start_date):
+    return int(parse_datetime(start_date).timestamp())
+
+
+def _prepara_backfill(profilo):
+    """Stato dello storico dell'atleta: se era completo (nuovo storico richiesto) si riparte dalle attività più recenti."""
+    backfill, _ = StatoBackfill.objects.get_or_create(atleta=profilo)
+    if backfill.stato == 'Completato':
+        backfill.stato = 'In Corso'
+        backfill.pagine_scaricate = backfill.attivita_scaricate = 0
+        backfill.ts_piu_vecchio = backfill.ts_piu_recente = None
+        backfill.dettagli_in_sospeso = []
+        backfill.data_completamento = None
+        backfill.save()
+    return backfill
+
+
+def _avanza_backfill(backfill, activities, dettagli_mancanti):
+    """Sposta il cursore dopo una pagina scaricata e salvata."""
+    timestamps = [_timestamp(a['start_date']) for a in activities if a.get('start_date')]
+    if timestamps:
+        backfill.ts_piu_vecchio = min(timestamps)
+        backfill.ts_piu_recente = max(backfill.ts_piu_recente or 0, max(timestamps))
+    backfill.pagine_scaricate += 1
+    backfill.attivita_scaricate += len(activities)
+    backfill.dettagli_in_sospeso = list(dict.fromkeys(backfill.dettagli_in_sospeso + dettagli_mancanti))
+    backfill.save()
+
+
+def _recupera_dettagli_in_sospeso(job, backfill, access_token):
+    """Dettagli saltati per quota durante lo storico. Restituisce False se il job è stato messo in pausa."""
+    while backfill.dettagli_in_sospeso:
+        blocco = backfill.dettagli_in_sospeso[:BLOCCO_DETTAGLI]
+        if not rate_limit.quota_disponibile(rate_limit.INTERATTIVA, n=len(blocco)):
+            _metti_in_pausa(job, "Limite richieste Strava raggiunto (dettagli attività).")
+            return False
+        _aggiorna(job, messaggio_stato=f"Recupero dettagli attività ({len(backfill.dettagli_in_sospeso)} rimasti)...")
+        # Togliamo solo i dettagli scaricati o non più esistenti (404): quelli saltati per quota restano
+        gestiti = set(completa_dettagli_attivita(blocco, access_token, priorita=rate_limit.INTERATTIVA))
+        backfill.dettagli_in_sospeso = [sid for sid in backfill.dettagli_in_sospeso if sid not in gestiti]
+        backfill.save(update_fields=['dettagli_in_sospeso', 'data_aggiornamento'])
+        if len(gestiti) < len(blocco):
+            _metti_in_pausa(job, "Limite richieste Strava raggiunto (dettagli attività).")
+            return False
+    return True
+
+
+def elabora_prossimo_job():
+    """Prende ed esegue un job dalla coda. Restituisce True se ha lavorato (utile per i loop dei worker)."""
+    job = _prendi_prossimo_job()
+    if not job:
+        return False
+
+    logger.info(f"SYNC QUEUE: Avvio job {job.id} ({job.tipo}) per {job.utente.username}, pagina {job.pagina}")
+    try:
+        esegui_job(job)
+    except Exception as e:
+        logger.error(f"SYNC QUEUE: Errore job {job.id}: {e}")
+        if job.tentativi >= MAX_TENTATIVI:
+            _chiudi(job, 'Errore', "Errore durante la sincronizzazione.", str(e))
+        else:
+            # Riproviamo più tardi ripartendo dal checkpoint
+            _aggiorna(job, stato='In Coda', errore=str(e), riprova_dopo=timezone.now() + timedelta(minutes=1))
+    return True
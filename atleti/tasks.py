@@ -1,5 +1,8 @@
 from django.core.management import call_command
-from django.db import close_old_connections
+from django.db import close_old_connections, connection
+from django.conf import settings
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
 import logging
 import undetected_chromedriver as uc
 import time
@@ -10,9 +13,13 @@ from selenium.webdriver.support import expected_conditions as EC
 from django.utils import timezone, dateformat
 from datetime import timedelta
 from .models import ProfiloAtleta, Attivita, Scarpa, Allenamento, Partecipazione, Notifica
+from .log_buffer import registra_log
 from allauth.socialaccount.models import SocialToken
-from .utils import refresh_strava_token, processa_attivita_strava, stima_vo2max_atleta, normalizza_scarpa, get_atleti_con_statistiche_settimanali, genera_commenti_podio_ai
-import requests
+from . import rate_limit, strava_client
+from .sync import elabora_prossimo_job
+from .esecuzione_task import esegui_task, pool_manuali
+from .token_cache import invalida_token, token_valido
+from .utils import processa_attivita_strava, importa_pagina_attivita, stima_vo2max_atleta, normalizza_scarpa, get_atleti_con_statistiche_settimanali, genera_commenti_podio_ai
 
 # Configura il logger per tracciare l'esecuzione
 logger = logging.getLogger(__name__)
@@ -26,6 +33,20 @@ def task_ricalcolo_vam():
     call_command('recalculate_vam')
     logger.info("SCHEDULER: Ricalcolo VAM completato.")
 
+def task_aggrega_log():
+    """
+    Task pianificato: rollup giornalieri dei log per la pagina statistiche e retention dei log grezzi.
+    """
+    logger.info("SCHEDULER: Avvio aggregazione log...")
+    call_command('aggrega_log')
+    logger.info("SCHEDULER: Aggregazione log completata.")
+
+def task_partizioni_log():
+    """
+    Task pianificato: crea in anticipo le partizioni mensili della tabella log (PostgreSQL).
+    """
+    call_command('gestisci_partizioni_log')
+
 def task_ricalcolo_statistiche():
     """
     Task pianificato per aggiornare le statistiche (VO2max, Trend, ecc).
@@ -193,12 +214,14 @@ def task_calcola_feedback():
     logger.info(f"SCHEDULER: Feedback calcolato per {count_processed} partecipazioni.")
 
 def task_heartbeat():
-    """Task di sistema per tenere sveglio lo scheduler (polling DB)"""
+    """
+    Task di sistema che avvia i task con trigger manuale nel pool dei manuali (esecuzione_task.py).
+    Viene anticipato dal listener LISTEN/NOTIFY (scheduler_trigger.py); il suo intervallo regolare è solo il fallback.
+    """
     # Chiudiamo le connessioni vecchie per evitare che il task si blocchi su connessioni stale
     close_old_connections()
     
     from .models import TaskSettings
-    from django_apscheduler.models import DjangoJobExecution, DjangoJob
     
     # Mappa task_id -> (tipo, target)
     # 'cmd': Management Command Django
@@ -212,16 +235,14 @@ def task_heartbeat():
         'repair_strava_settimanale': ('func', 'task_repair_strava'),
         'aggiorna_podio_ai_4h': ('func', 'task_aggiorna_podio_ai'),
         'calcola_feedback_allenamenti': ('func', 'task_calcola_feedback'),
+        'elabora_eventi_strava': ('func', 'task_elabora_eventi_strava'),
+        'aggrega_log_notturno': ('cmd', 'aggrega_log'),
+        'partizioni_log_giornaliero': ('cmd', 'gestisci_partizioni_log'),
     }
 
     # Cerca task con trigger manuale attivo
     try:
-        # DEBUG: Leggiamo tutti i settings per capire cosa vede lo scheduler
-        all_settings = list(TaskSettings.objects.all())
-        configs = [t for t in all_settings if t.manual_trigger]
-        
-        # Logghiamo lo stato del DB ad ogni heartbeat (ogni 10s) per debug
-        # print(f"SCHEDULER HEARTBEAT: Scan DB. Totale Settings: {len(all_settings)}. Trigger attivi: {len(configs)}", flush=True)
+        configs = list(TaskSettings.objects.filter(manual_trigger=True))
         
         if configs:
             logger.info(f"SCHEDULER: Trovati task manuali da eseguire: {[c.task_id for c in configs]}")
@@ -231,135 +252,409 @@ def task_heartbeat():
         return
     
     for cfg in configs:
-        logger.info(f"SCHEDULER: Elaborazione trigger per {cfg.task_id}")
-        
         task_info = task_map.get(cfg.task_id)
-        if task_info:
-            type_, target_name = task_info
-            start_time = timezone.now()
-            status = "Executed"
-            exception = ""
-            
-            try:
-                if type_ == 'cmd':
-                    logger.info(f"SCHEDULER: Esecuzione comando '{target_name}'...")
-                    call_command(target_name)
-                elif type_ == 'func':
-                    # Recupera la funzione dinamicamente dal modulo corrente
-                    func = globals().get(target_name)
-                    if func:
-                        logger.info(f"SCHEDULER: Esecuzione funzione '{target_name}'...")
-                        func()
-                    else:
-                        raise ValueError(f"Funzione {target_name} non trovata.")
-
-                logger.info(f"SCHEDULER: Esecuzione manuale di {cfg.task_id} completata.")
-            except Exception as e:
-                logger.error(f"SCHEDULER: Errore esecuzione manuale {cfg.task_id}: {e}")
-                status = "Error"
-                exception = str(e)
-            finally:
-                # CRUCIALE: Resettiamo il flag SEMPRE, anche in caso di errore
-                # Questo sblocca il bottone nell'interfaccia web
-                cfg.manual_trigger = False
-                cfg.save()
-                logger.info(f"SCHEDULER: Reset flag manuale per {cfg.task_id}")
-
-            # Registra l'esecuzione manuale nello storico
-            try: 
-                duration = (timezone.now() - start_time).total_seconds()
-                job = DjangoJob.objects.filter(id=cfg.task_id).first()
-                if job:
-                    DjangoJobExecution.objects.create(
-                        job=job,
-                        status=status,
-                        run_time=start_time,
-                        duration=duration,
-                        finished=timezone.now().timestamp(),
-                        exception=exception
-                    )
-            except Exception as e_db:
-                logger.error(f"SCHEDULER: Errore salvataggio log DB: {e_db}")
-        else:
+        if not task_info:
             logger.error(f"SCHEDULER: ERRORE - Task ID '{cfg.task_id}' non riconosciuto nella mappa. Resetto flag.")
             cfg.manual_trigger = False
             cfg.save()
+            continue
 
-def task_sync_strava():
+        # Già avviato da un heartbeat precedente: il flag si resetta a fine esecuzione
+        with _lock_manuali:
+            if cfg.task_id in _manuali_inviati:
+                continue
+            _manuali_inviati.add(cfg.task_id)
+
+        # Il task gira nel pool dei manuali: l'heartbeat torna subito libero
+        logger.info(f"SCHEDULER: Elaborazione trigger per {cfg.task_id}")
+        pool_manuali().submit(_esegui_task_manuale, cfg.task_id, *task_info)
+
+# Task manuali inviati al pool e non ancora conclusi: letto dall'heartbeat, aggiornato dai worker del pool
+_manuali_inviati = set()
+_lock_manuali = threading.Lock()
+
+def _manuale_concluso(task_id):
+    with _lock_manuali:
+        _manuali_inviati.discard(task_id)
+
+def _esegui_task_manuale(task_id, type_, target_name):
+    """Esecuzione di un task manuale nel pool, con i limiti di concorrenza di esecuzione_task."""
+    from .models import TaskSettings
+    from django_apscheduler.models import DjangoJobExecution, DjangoJob
+
+    start_time = timezone.now()
+    status = "Executed"
+    exception = ""
+    eseguito = True
+
+    try:
+        if type_ == 'cmd':
+            logger.info(f"SCHEDULER: Esecuzione comando '{target_name}'...")
+            eseguito = esegui_task(task_id, call_command, target_name)
+        elif type_ == 'func':
+            # Recupera la funzione dinamicamente dal modulo corrente
+            func = globals().get(target_name)
+            if func:
+                logger.info(f"SCHEDULER: Esecuzione funzione '{target_name}'...")
+                eseguito = esegui_task(task_id, func)
+            else:
+                raise ValueError(f"Funzione {target_name} non trovata.")
+
+        if eseguito:
+            logger.info(f"SCHEDULER: Esecuzione manuale di {task_id} completata.")
+    except Exception as e:
+        logger.error(f"SCHEDULER: Errore esecuzione manuale {task_id}: {e}")
+        status = "Error"
+        exception = str(e)
+
+    if not eseguito:
+        # Task (o gruppo) occupato: il flag resta attivo e il prossimo heartbeat riprova
+        _manuale_concluso(task_id)
+        close_old_connections()
+        return
+
+    # CRUCIALE: Resettiamo il flag SEMPRE, anche in caso di errore
+    # Questo sblocca il bottone nell'interfaccia web
+    try:
+        TaskSettings.objects.filter(task_id=task_id).update(manual_trigger=False)
+        logger.info(f"SCHEDULER: Reset flag manuale per {task_id}")
+    finally:
+        _manuale_concluso(task_id)
+
+    # Registra l'esecuzione manuale nello storico
+    try: 
+        duration = (timezone.now() - start_time).total_seconds()
+        job = DjangoJob.objects.filter(id=task_id).first()
+        if job:
+            DjangoJobExecution.objects.create(
+                job=job,
+                status=status,
+                run_time=start_time,
+                duration=duration,
+                finished=timezone.now().timestamp(),
+                exception=exception
+            )
+    except Exception as e_db:
+        logger.error(f"SCHEDULER: Errore salvataggio log DB: {e_db}")
+    finally:
+        close_old_connections()
+
+class _BudgetStrava:
     """
-    Task periodico per sincronizzare le attività da Strava per tutti gli utenti.
-    Gestisce automaticamente il refresh del token.
+    Stato condiviso tra i thread di un ciclo di sync: conta le richieste e ferma tutti
+    gli atleti rimanenti appena il rate limiter nega un permesso o Strava risponde 429.
+    """
+    def __init__(self):
+        self.usate = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def consuma(self, n=1):
+        """Prenota n richieste sul rate limiter globale. Restituisce False se la quota è esaurita."""
+        if self._stop.is_set():
+            return False
+        if not rate_limit.acquisisci_permesso(rate_limit.BACKGROUND, n):
+            self._stop.set()
+            return False
+        with self._lock:
+            self.usate += n
+        return True
+
+    def segnala_rate_limit(self):
+        self._stop.set()
+
+    @property
+    def esaurito(self):
+        return self._stop.is_set()
+
+
+def _sync_strava_atleta(token_id, budget):
+    """
+    Sincronizza le nuove attività di un singolo atleta.
+    Eseguita nei thread del pool di task_sync_strava: restituisce un dizionario con esito e durata.
     """
-    # Chiudiamo le connessioni vecchie prima di iniziare operazioni lunghe col DB
     close_old_connections()
-    
-    logger.info("SCHEDULER: Avvio sincronizzazione Strava automatica...")
-    
-    tokens = SocialToken.objects.filter(account__provider='strava')
-    
-    for token_obj in tokens:
-        close_old_connections() # Rinnova connessione DB per ogni utente (fondamentale per task lunghi)
+    inizio = time.monotonic()
+    esito = {'username': None, 'nuove': 0, 'stato': 'OK'}
+
+    try:
+        token_obj = SocialToken.objects.select_related('account__user').get(pk=token_id)
         user = token_obj.account.user
-        logger.info(f"--- Sync Strava per: {user.username} ---")
-        
+        esito['username'] = user.username
+
+        if budget.esaurito:
+            esito['stato'] = 'Saltato (Rate Limit)'
+            return esito
+
         # 1. Refresh Token (se necessario)
         # Usiamo un buffer ampio (4 ore) per mantenere il token vivo tra un'esecuzione e l'altra
-        access_token = refresh_strava_token(token_obj, buffer_minutes=240)
+        access_token = token_valido(user.id, buffer_minutes=240)
         if not access_token:
             logger.error(f"Impossibile rinnovare token per {user.username}. Salto.")
-            continue
-            
-        headers = {'Authorization': f'Bearer {access_token}'}
+            esito['stato'] = 'Token non valido'
+            return esito
+
+        if not budget.consuma():
+            esito['stato'] = 'Saltato (Budget esaurito)'
+            return esito
 
         # 2. Scarica Attività (Ottimizzato con 'after')
         # Usiamo il timestamp dell'ultima attività per chiedere a Strava solo le novità.
-        # Questo riduce il payload e evita elaborazioni ridondanti.
-        last_act = Attivita.objects.filter(atleta__user=user).order_by('-data').first()
-        params = {'page': 1, 'per_page': 10} 
-        
+        last_act = Attivita.objects.riepilogo().filter(atleta__user=user).order_by('-data').first()
+        params = {'page': 1, 'per_page': 10}
         if last_act:
             # Aggiungiamo 1 secondo per non riscaricare l'ultima attività nota
             params['after'] = int(last_act.data.timestamp()) + 1
-        
-        try:
-            response = requests.get("https://www.strava.com/api/v3/athlete/activities", headers=headers, params=params, timeout=15)
-            
-            if response.status_code == 200:
-                activities = response.json()
-                
-                # Se la lista è vuota, non c'è nulla da fare (1 sola chiamata API spesa)
-                if not activities:
-                    logger.info(f"Nessuna nuova attività per {user.username}.")
-                else:
-                    profilo, _ = ProfiloAtleta.objects.get_or_create(user=user)
-                
-                    count_new = 0
-                    for act in activities:
-                        if act['type'] not in ['Run', 'TrailRun', 'Hike']:
-                            continue
-                        
-                        # Usiamo la utility centralizzata
-                        _, created = processa_attivita_strava(act, profilo, access_token, force_detail_update=True)
-                        if created:
-                            count_new += 1
-                    
-                    if count_new > 0:
-                        stima_vo2max_atleta(profilo)
-                        logger.info(f"Importate {count_new} nuove attività per {user.username}.")
-                    
-                    # Aggiorniamo timestamp sync
-                    profilo.data_ultima_sincronizzazione = timezone.now()
-                    profilo.save()
-                    
-            elif response.status_code == 429:
-                logger.warning("SCHEDULER: Rate Limit Strava (429) raggiunto. Stop task globale per recupero quota.")
-                break 
+
+        response = strava_client.get("athlete/activities", access_token=access_token, params=params, timeout=15)
+        rate_limit.registra_risposta(response)
+
+        if response.status_code == 429:
+            logger.warning("SCHEDULER: Rate Limit Strava (429) raggiunto. Stop sync per tutti gli atleti rimanenti.")
+            budget.segnala_rate_limit()
+            esito['stato'] = 'Rate Limit'
+            return esito
+
+        if response.status_code != 200:
+            logger.error(f"Errore API Strava per {user.username}: {response.status_code}")
+            esito['stato'] = f"Errore API {response.status_code}"
+            return esito
+
+        activities = response.json()
+        profilo, _ = ProfiloAtleta.objects.get_or_create(user=user)
+
+        # Dettaglio e stream prenotano i propri permessi: se la quota finisce le attività vengono
+        # salvate comunque dal summary e i dettagli vengono recuperati ai giri successivi
+        esito['nuove'] = len(importa_pagina_attivita(activities, profilo, access_token, force_detail_update=True))
+
+        if esito['nuove'] > 0:
+            stima_vo2max_atleta(profilo)
+
+        # Aggiorniamo timestamp sync
+        profilo.data_ultima_sincronizzazione = timezone.now()
+        profilo.save()
+
+    except Exception as e:
+        logger.error(f"Errore durante sync per {esito['username'] or token_id}: {e}")
+        esito['stato'] = f"Errore: {e}"
+    finally:
+        esito['durata'] = round(time.monotonic() - inizio, 2)
+        # Ogni thread ha la sua connessione DB: la chiudiamo per non lasciarla appesa nel pool
+        connection.close()
+
+    return esito
+
+
+def task_sync_strava():
+    """
+    Task periodico per sincronizzare le attività da Strava per tutti gli utenti.
+    Gli atleti vengono elaborati in parallelo (STRAVA_SYNC_WORKERS thread) attingendo al rate limiter
+    condiviso: il throughput è limitato dalla quota Strava, non da pause fisse.
+    """
+    # Chiudiamo le connessioni vecchie prima di iniziare operazioni lunghe col DB
+    close_old_connections()
+
+    logger.info("SCHEDULER: Avvio sincronizzazione Strava automatica...")
+    inizio = time.monotonic()
+
+    token_ids = list(SocialToken.objects.filter(account__provider='strava').values_list('id', flat=True))
+    budget = _BudgetStrava()
+
+    esiti = []
+    with ThreadPoolExecutor(max_workers=settings.STRAVA_SYNC_WORKERS, thread_name_prefix='strava-sync') as pool:
+        futures = [pool.submit(_sync_strava_atleta, token_id, budget) for token_id in token_ids]
+        for future in as_completed(futures):
+            esito = future.result()
+            esiti.append(esito)
+            logger.info(f"--- Sync Strava {esito['username']}: {esito['stato']}, {esito['nuove']} nuove attività in {esito['durata']}s ---")
+
+    durata = round(time.monotonic() - inizio, 2)
+    nuove = sum(e['nuove'] for e in esiti)
+    piu_lenti = sorted(esiti, key=lambda e: e['durata'], reverse=True)[:3]
+    logger.info(
+        f"SCHEDULER: Sincronizzazione Strava completata in {durata}s: {len(esiti)} atleti, {nuove} nuove attività, "
+        f"{budget.usate} richieste elenco. Quota: {rate_limit.stato_quota()}. Più lenti: {[(e['username'], e['durata']) for e in piu_lenti]}"
+    )
+    return esiti
+
+
+class _QuotaEsaurita(Exception):
+    """Quota Strava esaurita durante l'elaborazione degli eventi webhook"""
+
+
+def _elabora_evento_attivita(evento, profilo, access_token):
+    """
+    Applica un singolo evento 'activity' del webhook. Restituisce (stato, nuova_attivita_creata).
+    Solleva _QuotaEsaurita se non ci sono permessi Strava: l'evento resta in coda.
+    """
+    # Anche per i delete scarichiamo il dettaglio: il payload del webhook non è firmato, quindi
+    # cancelliamo solo se Strava risponde 404; create/update ottengono anche parziali e dispositivo
+    if not rate_limit.acquisisci_permesso(rate_limit.BACKGROUND):
+        raise _QuotaEsaurita()
+
+    response = strava_client.get(f"activities/{evento.object_id}", access_token=access_token, timeout=15)
+    rate_limit.registra_risposta(response)
+
+    if response.status_code == 429:
+        raise _QuotaEsaurita()
+    if response.status_code == 404:
+        # Attività già cancellata (o diventata non visibile al nostro scope)
+        Attivita.objects.filter(strava_activity_id=evento.object_id, atleta=profilo).delete()
+        return 'Elaborato', False
+    if response.status_code != 200:
+        raise ValueError(f"Errore API Strava {response.status_code}")
+
+    act = response.json()
+    if act.get('type') not in ['Run', 'TrailRun', 'Hike']:
+        # Un update può cambiare il tipo (es. Run -> Ride): l'attività non è più di nostra competenza
+        Attivita.objects.filter(strava_activity_id=evento.object_id, atleta=profilo).delete()
+        return 'Ignorato', False
+
+    obj, created = processa_attivita_strava(act, profilo, access_token)
+    if obj is None:
+        # Scartata dal filtro privacy (es. resa privata con update)
+        Attivita.objects.filter(strava_activity_id=evento.object_id, atleta=profilo).delete()
+        return 'Ignorato', False
+    return 'Elaborato', created
+
+
+def _revoca_confermata(user_id):
+    """
+    Verifica con Strava un evento di revoca (updates authorized=false): è reale solo se /athlete
+    respinge con 401 un token appena rinnovato. Senza token salvato non c'è nulla da revocare.
+    Solleva _QuotaEsaurita senza permessi e ValueError se la verifica non è possibile (si riprova al giro dopo).
+    """
+    if not SocialToken.objects.filter(account__user_id=user_id, account__provider='strava').exists():
+        return True
+
+    access_token = token_valido(user_id)
+    if not access_token:
+        raise ValueError("Rinnovo del token fallito: revoca non verificabile")
+    if not rate_limit.acquisisci_permesso(rate_limit.BACKGROUND):
+        raise _QuotaEsaurita()
+
+    response = strava_client.get("athlete", access_token=access_token, timeout=15)
+    rate_limit.registra_risposta(response)
+    if response.status_code == 429:
+        raise _QuotaEsaurita()
+    if response.status_code == 401:
+        return True
+    if response.status_code == 200:
+        return False
+    raise ValueError(f"Errore API Strava {response.status_code}")
+
+
+def task_elabora_eventi_strava():
+    """
+    Elabora la coda degli eventi ricevuti dal webhook Strava (create/update/delete attività e
+    revoca autorizzazione atleta). Gli eventi rimasti in coda per quota esaurita vengono ripresi al giro successivo.
+    """
+    from allauth.socialaccount.models import SocialAccount
+    from .models import EventoStrava
+
+    close_old_connections()
+
+    eventi = list(EventoStrava.objects.filter(stato='In Coda').order_by('event_time')[:200])
+    if not eventi:
+        return
+
+    logger.info(f"SCHEDULER: Elaborazione {len(eventi)} eventi webhook Strava...")
+    per_atleta = {}
+    for evento in eventi:
+        per_atleta.setdefault(evento.owner_id, []).append(evento)
+
+    conteggio = {'Elaborato': 0, 'Ignorato': 0, 'Errore': 0}
+    quota_esaurita = False
+
+    for owner_id, eventi_atleta in per_atleta.items():
+        if quota_esaurita:
+            break
+
+        account = SocialAccount.objects.filter(provider='strava', uid=str(owner_id)).select_related('user').first()
+        if not account:
+            # Atleta non registrato su PerformanceAtlete
+            EventoStrava.objects.filter(id__in=[e.id for e in eventi_atleta]).update(stato='Ignorato', data_elaborazione=timezone.now())
+            conteggio['Ignorato'] += len(eventi_atleta)
+            continue
+
+        # Revoca autorizzazione: l'atleta ha scollegato l'app da Strava
+        revoca = next((e for e in eventi_atleta if e.object_type == 'athlete' and e.updates.get('authorized') == 'false'), None)
+        if revoca:
+            try:
+                confermata = _revoca_confermata(account.user_id)
+            except _QuotaEsaurita:
+                quota_esaurita = True
+                break
+            except Exception as e:
+                # Gli altri eventi dell'atleta restano in coda dietro alla revoca
+                revoca.tentativi += 1
+                revoca.errore = str(e)
+                revoca.stato = 'Errore' if revoca.tentativi >= 5 else 'In Coda'
+                revoca.data_elaborazione = timezone.now()
+                revoca.save(update_fields=['stato', 'tentativi', 'errore', 'data_elaborazione'])
+                conteggio[revoca.stato] = conteggio.get(revoca.stato, 0) + 1
+                continue
+
+            if confermata:
+                SocialToken.objects.filter(account=account).delete()
+                invalida_token(account.user_id)
+                registra_log(livello='WARNING', azione='Webhook Strava', utente=account.user, messaggio="Autorizzazione Strava revocata dall'atleta. Token rimosso.")
+                EventoStrava.objects.filter(id__in=[e.id for e in eventi_atleta]).update(stato='Elaborato', data_elaborazione=timezone.now())
+                conteggio['Elaborato'] += len(eventi_atleta)
+                continue
+            # Strava accetta ancora il token: l'evento non corrisponde a una revoca reale
+            registra_log(livello='WARNING', azione='Webhook Strava', utente=account.user, messaggio="Revoca ricevuta dal webhook ma non confermata da Strava. Ignorata.")
+
+        profilo, _ = ProfiloAtleta.objects.get_or_create(user=account.user)
+        access_token = token_valido(account.user_id, buffer_minutes=240)
+
+        nuove = 0
+        for evento in eventi_atleta:
+            if evento.object_type != 'activity':
+                # Altri update dell'atleta (es. nome) non ci interessano
+                stato = 'Ignorato'
+            elif not access_token:
+                stato = 'Errore'
+                evento.errore = "Token Strava non disponibile"
             else:
-                logger.error(f"Errore API Strava: {response.status_code}")
-                
-        except Exception as e:
-            logger.error(f"Errore durante sync per {user.username}: {e}")
-            
-        time.sleep(2) # Pausa ridotta a 2s. Con 17 utenti = 34s totali. Con 600 req/15min siamo ampiamente dentro.
-        
-    logger.info("SCHEDULER: Sincronizzazione Strava completata.")
\ No newline at end of file
+                try:
+                    stato, created = _elabora_evento_attivita(evento, profilo, access_token)
+                    nuove += int(created)
+                except _QuotaEsaurita:
+                    quota_esaurita = True
+                    break
+                except Exception as e:
+                    evento.tentativi += 1
+                    evento.errore = str(e)
+                    # Ritentiamo al giro successivo, fino a 5 volte
+                    stato = 'Errore' if evento.tentativi >= 5 else 'In Coda'
+
+            evento.stato = stato
+            evento.data_elaborazione = timezone.now()
+            evento.save(update_fields=['stato', 'tentativi', 'errore', 'data_elaborazione'])
+            conteggio[stato] = conteggio.get(stato, 0) + 1
+
+        if nuove:
+            stima_vo2max_atleta(profilo)
+            profilo.data_ultima_sincronizzazione = timezone.now()
+            profilo.save()
+
+    if quota_esaurita:
+        logger.warning("SCHEDULER: Quota Strava esaurita. Eventi rimanenti rimandati al prossimo giro.")
+
+    # Pulizia eventi elaborati da più di 30 giorni
+    EventoStrava.objects.exclude(stato='In Coda').filter(data_ricezione__lt=timezone.now() - timedelta(days=30)).delete()
+    logger.info(f"SCHEDULER: Eventi webhook Strava elaborati: {conteggio}")
+
+
+def task_elabora_coda_sync():
+    """
+    Worker della coda di sincronizzazione (JobSincronizzazione): elabora i job finché ce ne sono.
+    Più istanze possono girare in parallelo (SYNC_QUEUE_WORKERS), ognuna prende un job diverso.
+    """
+    close_old_connections()
+    try:
+        while elabora_prossimo_job():
+            close_old_connections()
+    except Exception as e:
+        logger.error(f"SYNC QUEUE: Errore worker: {e}")
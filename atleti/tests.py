@@ -1,3 +1,1352 @@
-from django.test import TestCase
+import contextlib
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from allauth.socialaccount.models import SocialAccount, SocialApp, SocialToken
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.http import StreamingHttpResponse
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import aggregati, coach, finestra_vo2max, impronte_strava, log_buffer, log_rollup, rate_limit, snapshot, strava_client, streams, sync, token_cache
+from .esecuzione_task import esegui_task
+from .models import (
+    AggregatoAtleta, Attivita, EventoStrava, FinestraVO2max, ImprontaDatiStrava, JobSincronizzazione, LogSistema, ProfiloAtleta,
+    QuotaStrava, Scarpa, SnapshotCoach, StatisticaLogGiornaliera, StatoBackfill, StreamAttivita,
+)
+from .tasks import task_elabora_eventi_strava, task_sync_strava
+from .views import _comprimi_gzip, _get_coach_context_cached, _get_coach_dashboard_context
+from .utils import (
+    _prefetch_pagina_strava, calcola_metrica_vo2max, calcola_trend_atleta, calcola_vam_da_stream, calcola_vam_selettiva,
+    importa_pagina_attivita, stima_potenziale_gara,
+)
+from .vectorized import calcola_vam_vettoriale, calcola_vo2max_vettoriale, segmenti_salita
+
+
+class _RispostaFinta:
+    """Risposta HTTP minima (come requests.Response) per simulare Strava"""
+
+    def __init__(self, status_code=200, dati=None, headers=None):
+        self.status_code = status_code
+        self._dati = dati
+        self.headers = headers or {}
+        self.text = json.dumps(dati)
+
+    def json(self):
+        return self._dati
+
+
+def _crea_atleta(username, uid, token='tok', scadenza=timedelta(hours=6)):
+    """Utente con profilo (creato dal segnale) e account/token Strava collegati."""
+    user = User.objects.create(username=username)
+    account = SocialAccount.objects.create(user=user, provider='strava', uid=str(uid))
+    SocialToken.objects.create(account=account, token=token, token_secret='refresh', expires_at=timezone.now() + scadenza)
+    return ProfiloAtleta.objects.get(user=user)
+
+
+def _summary_strava(strava_id, start_date, distanza=10000.0, durata=3000, tipo='Run', **extra):
+    """Summary di /athlete/activities. Date senza fuso: con USE_TZ=False SQLite non accetta datetime aware."""
+    return {
+        'id': strava_id, 'type': tipo, 'sport_type': tipo, 'name': f"Corsa {strava_id}", 'start_date': start_date,
+        'distance': distanza, 'moving_time': durata, 'total_elevation_gain': 50.0, 'average_speed': distanza / durata,
+        'average_heartrate': 150.0, 'max_heartrate': 175.0, **extra,
+    }
+
+
+def _stream_sintetico(seed, n=20000):
+    """Stream realistico: alternanza di salite, piani e discese con rumore e qualche pausa (dt = 0)."""
+    rng = np.random.default_rng(seed)
+    grades = np.repeat(rng.choice([-12.0, 2.0, 7.0, 9.0, 15.0], size=n // 200), 200)[:n] + rng.normal(0, 1.5, n)
+    times = np.cumsum(rng.choice([0, 1, 1, 1, 2], size=n))
+    altitudes = 500 + np.cumsum(grades / 100 * 2.5 + rng.normal(0, 0.1, n))
+    return grades.round(1), altitudes.round(1), times
+
+
+class VamVettorialeParityTest(SimpleTestCase):
+    """La versione NumPy deve restituire la stessa VAM della versione scalare"""
+
+    def assertParita(self, grades, altitudes, times):
+        attesa = calcola_vam_da_stream(list(grades), list(altitudes), list(times))
+        vam, _ = calcola_vam_vettoriale(grades, altitudes, times)
+        self.assertAlmostEqual(vam, attesa, delta=0.1)
+
+    def test_stream_sintetici(self):
+        for seed in range(20):
+            with self.subTest(seed=seed):
+                self.assertParita(*_stream_sintetico(seed))
+
+    def test_salita_finale_e_strappi_brevi(self):
+        # Strappo di 5 minuti (scartato) seguito da una salita di 15 minuti che chiude l'attività
+        grades = [0.0] + [10.0] * 300 + [3.0] * 100 + [10.0] * 900
+        altitudes = list(np.cumsum([0.0] + [0.3] * 300 + [0.0] * 100 + [0.25] * 900))
+        times = list(range(len(grades)))
+        self.assertParita(grades, altitudes, times)
+
+        vam, segmenti = calcola_vam_vettoriale(grades, altitudes, times)
+        self.assertEqual(len(segmenti), 1)
+        self.assertEqual(segmenti[0]['inizio_idx'], 400)
+        self.assertEqual(segmenti[0]['durata'], 900)
+        self.assertAlmostEqual(vam, 900.0, delta=0.1)
+
+    def test_stream_vuoti_o_piatti(self):
+        self.assertEqual(calcola_vam_vettoriale([], [], [])[0], 0)
+        self.assertEqual(segmenti_salita([5.0], [100.0], [0]), [])
+        self.assertParita([1.0] * 1000, list(range(1000)), list(range(1000)))
+
+
+def _attivita_sintetiche(seed, n=400):
+    """Attività varie: strada/trail, con e senza GAP, passi lenti, FC mancanti, durate brevi, ripetute."""
+    rng = np.random.default_rng(seed)
+    attivita = []
+    for _ in range(n):
+        durata = int(rng.choice([0, 600, 1199, 1200, 2400, 3600, 7200, 14400]))
+        distanza = float(rng.choice([0.0, 1000.0, 5000.0, 10000.0, 21097.0, 42195.0])) + float(rng.uniform(0, 500))
+        attivita.append(SimpleNamespace(
+            distanza=distanza,
+            durata=durata,
+            fc_media=int(rng.choice([0, 120, 135, 150, 165, 178])) or None,
+            dislivello=float(rng.choice([0.0, 150.0, 800.0, 2500.0])),
+            tipo_attivita=str(rng.choice(['Run', 'TrailRun'])),
+            workout_type=int(rng.choice([0, 1, 3])),
+            gap_passo=float(rng.choice([0.0, 2.8, 3.5, 4.2])) or None,
+            fc_max_sessione=int(rng.choice([0, 160, 185, 198])) or None,
+            strava_activity_id=0,
+        ))
+    return attivita
+
+
+@override_settings(LOG_BUFFER_ASINCRONO=False)
+@mock.patch('atleti.rate_limit.acquisisci_permesso', return_value=True)
+class ArchivioStreamTest(TestCase):
+    """Archivio stream: il primo calcolo scarica e salva l'.npz, i successivi non chiamano Strava"""
+
+    def setUp(self):
+        cartella = tempfile.TemporaryDirectory()
+        self.addCleanup(cartella.cleanup)
+        impostazioni = override_settings(STREAMS_ROOT=cartella.name)
+        impostazioni.enable()
+        self.addCleanup(impostazioni.disable)
+
+        grades, altitudes, times = _stream_sintetico(3, n=5000)
+        self.risposta = _RispostaFinta(200, {
+            'grade_smooth': {'data': grades.tolist()},
+            'altitude': {'data': altitudes.tolist()},
+            'time': {'data': times.tolist()},
+        })
+
+    def test_download_una_sola_volta(self, _):
+        with mock.patch('atleti.strava_client.get', return_value=self.risposta) as get:
+            stream = streams.ottieni_stream(4242, 'tok')
+        get.assert_called_once()
+        indice = StreamAttivita.objects.get(strava_activity_id=4242)
+        self.assertEqual((indice.chiavi, indice.campioni), (['altitude', 'grade_smooth', 'time'], 5000))
+        self.assertTrue(os.path.exists(os.path.join(settings.STREAMS_ROOT, indice.percorso)))
+        self.assertEqual(stream['time'].dtype, np.int32)
+
+        with mock.patch('atleti.strava_client.get') as get:
+            vam = calcola_vam_selettiva(4242, 'tok')
+        get.assert_not_called()
+        attesa, _ = calcola_vam_vettoriale(stream['grade_smooth'], stream['altitude'], stream['time'])
+        self.assertAlmostEqual(vam, attesa, delta=0.1)
+
+
+class Vo2maxVettorialeParityTest(SimpleTestCase):
+    """Il ricalcolo VO2max in blocco deve dare esattamente gli stessi valori di calcola_metrica_vo2max"""
+
+    PROFILI = [
+        SimpleNamespace(fc_massima_teorica=190, fc_riposo=50, peso=70.0, indice_itra=0, vo2max_stima_statistica=None),
+        SimpleNamespace(fc_massima_teorica=185, fc_riposo=45, peso=None, indice_itra=480, vo2max_stima_statistica=55.0),
+        SimpleNamespace(fc_massima_teorica=200, fc_riposo=40, peso=62.0, indice_itra=580, vo2max_stima_statistica=62.0),
+        SimpleNamespace(fc_massima_teorica=195, fc_riposo=60, peso=80.0, indice_itra=700, vo2max_stima_statistica=48.0),
+        SimpleNamespace(fc_massima_teorica=180, fc_riposo=None, peso=70.0, indice_itra=0, vo2max_stima_statistica=50.0),
+    ]
+
+    def _vettoriale(self, attivita, profilo):
+        return calcola_vo2max_vettoriale(
+            [a.distanza for a in attivita], [a.durata for a in attivita], [a.fc_media for a in attivita],
+            [a.dislivello for a in attivita], [a.tipo_attivita == 'TrailRun' for a in attivita],
+            [a.gap_passo for a in attivita], [a.fc_max_sessione for a in attivita],
+            hr_max=profilo.fc_massima_teorica, hr_rest=profilo.fc_riposo,
+            indice_itra=profilo.indice_itra, vo2max_statistico=profilo.vo2max_stima_statistica,
+        )
+
+    def test_parita_esatta(self):
+        for i, profilo in enumerate(self.PROFILI):
+            attivita = _attivita_sintetiche(seed=i)
+            with contextlib.redirect_stdout(io.StringIO()):  # La versione scalare stampa il debug per riga
+                attesi = [calcola_metrica_vo2max(a, profilo) for a in attivita]
+            with self.subTest(profilo=i):
+                self.assertEqual(self._vettoriale(attivita, profilo), attesi)
+                if profilo.fc_riposo:
+                    self.assertTrue(any(v is not None for v in attesi))
+
+    def test_lista_vuota(self):
+        self.assertEqual(self._vettoriale([], self.PROFILI[0]), [])
+
+
+@override_settings(LOG_BUFFER_ASINCRONO=False, STRAVA_SYNC_WORKERS=3)
+class SyncStravaParalleloTest(TransactionTestCase):
+    """task_sync_strava: atleti in parallelo sul pool, stop comune quando la quota finisce"""
+
+    def setUp(self):
+        self.atleti = [_crea_atleta(f"atleta{i}", 1000 + i, token=f"tok{i}") for i in range(3)]
+
+    def _strava(self, percorso, access_token=None, params=None, **kwargs):
+        if percorso == 'athlete/activities':
+            # Solo il primo atleta ha un'attività nuova
+            dati = [_summary_strava(555, '2025-03-10T07:00:00')] if access_token == 'tok0' else []
+            return _RispostaFinta(200, dati)
+        return _RispostaFinta(404, {})
+
+    def test_tutti_gli_atleti_sincronizzati(self):
+        with mock.patch('atleti.tasks.token_valido', side_effect=lambda user_id, **kw: f"tok{user_id - self.atleti[0].user_id}"), \
+                mock.patch('atleti.rate_limit.acquisisci_permesso', return_value=True), \
+                mock.patch('atleti.strava_client.get', side_effect=self._strava):
+            esiti = task_sync_strava()
+
+        self.assertEqual(sorted(e['username'] for e in esiti), ['atleta0', 'atleta1', 'atleta2'])
+        self.assertTrue(all(e["stato"] == "OK" for e in esiti), esiti)
+        self.assertEqual(sum(e['nuove'] for e in esiti), 1)
+        self.assertEqual(Attivita.objects.get().atleta_id, self.atleti[0].id)
+        self.assertEqual(ProfiloAtleta.objects.filter(data_ultima_sincronizzazione__isnull=False).count(), 3)
+
+    def test_quota_esaurita_ferma_tutti(self):
+        with mock.patch('atleti.tasks.token_valido', return_value='tok'), \
+                mock.patch('atleti.rate_limit.acquisisci_permesso', return_value=False), \
+                mock.patch('atleti.strava_client.get') as get:
+            esiti = task_sync_strava()
+
+        get.assert_not_called()
+        self.assertEqual(len(esiti), 3)
+        self.assertTrue(all(e['stato'].startswith('Saltato') for e in esiti))
+        self.assertFalse(ProfiloAtleta.objects.filter(data_ultima_sincronizzazione__isnull=False).exists())
+
+
+@override_settings(STRAVA_LIMITE_15MIN=10, STRAVA_LIMITE_GIORNALIERO=100, STRAVA_RISERVA_INTERATTIVA=0.2)
+class RateLimitTest(TestCase):
+    """Contatori condivisi nel DB: riserva per le interattive, allineamento agli header, blocco dopo un 429"""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_riserva_interattiva(self):
+        # Background fino all'80% della quota breve, poi solo le interattive
+        self.assertEqual(sum(rate_limit.acquisisci_permesso(rate_limit.BACKGROUND) for _ in range(10)), 8)
+        self.assertTrue(rate_limit.acquisisci_permesso(rate_limit.INTERATTIVA, n=2))
+        self.assertFalse(rate_limit.acquisisci_permesso(rate_limit.INTERATTIVA))
+        stato = rate_limit.stato_quota()
+        self.assertEqual((stato['usate_15min'], stato['usate_giorno']), (10, 10))
+
+    def test_permesso_negato_non_consuma(self):
+        self.assertTrue(rate_limit.acquisisci_permesso(rate_limit.BACKGROUND, n=8))
+        self.assertFalse(rate_limit.acquisisci_permesso(rate_limit.BACKGROUND))
+        self.assertFalse(rate_limit.quota_disponibile(rate_limit.BACKGROUND))
+        self.assertTrue(rate_limit.quota_disponibile(rate_limit.INTERATTIVA, n=2))
+        self.assertEqual(rate_limit.stato_quota()['usate_15min'], 8)
+
+    def test_quota_giornaliera_restituisce_la_breve(self):
+        _, (chiave_giorno, scadenza) = rate_limit._finestre(time.time())
+        QuotaStrava.objects.create(finestra=chiave_giorno, usate=100, scadenza=scadenza)
+        self.assertFalse(rate_limit.acquisisci_permesso(rate_limit.INTERATTIVA))
+        self.assertEqual(rate_limit.stato_quota()['usate_15min'], 0)
+
+    def test_allineamento_agli_header(self):
+        rate_limit.acquisisci_permesso(rate_limit.BACKGROUND, n=3)
+        # Altri processi hanno consumato quota: Strava conta più di noi
+        rate_limit.registra_risposta(_RispostaFinta(200, [], {'X-RateLimit-Limit': '20,200', 'X-RateLimit-Usage': '7,50'}))
+        stato = rate_limit.stato_quota()
+        self.assertEqual((stato['usate_15min'], stato['limite_15min'], stato['usate_giorno']), (7, 20, 50))
+        # Mai verso il basso
+        rate_limit.registra_risposta(_RispostaFinta(200, [], {'X-RateLimit-Usage': '1,1'}))
+        self.assertEqual(rate_limit.stato_quota()['usate_15min'], 7)
+
+    def test_429_blocca_fino_alla_finestra_successiva(self):
+        rate_limit.registra_risposta(_RispostaFinta(429, {}, {'X-RateLimit-Usage': '10,20'}))
+        self.assertTrue(rate_limit.stato_quota()['bloccato'])
+        self.assertFalse(rate_limit.acquisisci_permesso(rate_limit.INTERATTIVA))
+
+    def test_finestre_scadute_cancellate(self):
+        QuotaStrava.objects.create(finestra='15m:0', usate=5, scadenza=900)
+        rate_limit.acquisisci_permesso(rate_limit.BACKGROUND)
+        self.assertFalse(QuotaStrava.objects.filter(finestra='15m:0').exists())
+
+
+def _attivita(profilo, strava_id, data, **campi):
+    valori = {'distanza': 10000.0, 'durata': 3000, 'dislivello': 100.0, 'passo_medio': '5:00', **campi}
+    return Attivita.objects.create(atleta=profilo, strava_activity_id=strava_id, data=data, **valori)
+
+
+@override_settings(STRAVA_WEBHOOK_VERIFY_TOKEN='segreto', STRAVA_WEBHOOK_SUBSCRIPTION_ID='77')
+class WebhookStravaTest(TestCase):
+    """Endpoint del webhook: validazione, salvataggio idempotente degli eventi, filtri"""
+
+    def _evento(self, **campi):
+        evento = {
+            'object_type': 'activity', 'object_id': 9001, 'aspect_type': 'create', 'owner_id': 1234,
+            'event_time': 1760000000, 'subscription_id': 77, 'updates': {},
+        }
+        evento.update(campi)
+        return self.client.post(reverse('strava_webhook'), json.dumps(evento), content_type='application/json')
+
+    def test_validazione_sottoscrizione(self):
+        url = reverse('strava_webhook')
+        risposta = self.client.get(url, {'hub.mode': 'subscribe', 'hub.verify_token': 'segreto', 'hub.challenge': 'abc'})
+        self.assertEqual(risposta.json(), {'hub.challenge': 'abc'})
+        risposta = self.client.get(url, {'hub.mode': 'subscribe', 'hub.verify_token': 'altro', 'hub.challenge': 'abc'})
+        self.assertEqual(risposta.status_code, 403)
+
+    def test_evento_salvato_una_volta(self):
+        self.assertEqual(self._evento().status_code, 200)
+        # Strava ritenta la consegna dello stesso evento
+        self.assertEqual(self._evento().status_code, 200)
+        evento = EventoStrava.objects.get()
+        self.assertEqual((evento.object_id, evento.owner_id, evento.stato), (9001, 1234, 'In Coda'))
+
+    def test_eventi_scartati(self):
+        self.assertEqual(self._evento(subscription_id=78).status_code, 403)
+        self.assertEqual(self._evento(object_id='x').status_code, 400)
+        self.assertEqual(self._evento(object_type='route').json(), {'status': 'ignorato'})
+        self.assertFalse(EventoStrava.objects.exists())
+
+    @override_settings(STRAVA_WEBHOOK_SUBSCRIPTION_ID='')
+    def test_sottoscrizione_non_configurata_rifiuta_gli_eventi(self):
+        self.assertEqual(self._evento().status_code, 403)
+        self.assertFalse(EventoStrava.objects.exists())
+
+
+@override_settings(LOG_BUFFER_ASINCRONO=False)
+@mock.patch('atleti.tasks.close_old_connections')  # Dentro TestCase chiuderebbe la connessione della transazione di test
+@mock.patch('atleti.rate_limit.acquisisci_permesso', return_value=True)
+class ElaborazioneEventiStravaTest(TestCase):
+    """task_elabora_eventi_strava: create/update/delete attività, revoca, atleti sconosciuti, quota"""
+
+    def setUp(self):
+        self.profilo = _crea_atleta('runner', 1234)
+
+    def _evento(self, aspect_type='create', object_type='activity', object_id=9001, owner_id=1234, **campi):
+        return EventoStrava.objects.create(
+            object_type=object_type, object_id=object_id, aspect_type=aspect_type, owner_id=owner_id,
+            event_time=1760000000 + EventoStrava.objects.count(), **campi,
+        )
+
+    def test_create_scarica_il_dettaglio(self, *_):
+        dettaglio = _summary_strava(9001, '2025-03-10T07:00:00', device_name='Garmin', splits_metric=[{'split': 1}])
+        evento = self._evento()
+        with mock.patch('atleti.tasks.token_valido', return_value='tok'), \
+                mock.patch('atleti.strava_client.get', return_value=_RispostaFinta(200, dettaglio)) as get:
+            task_elabora_eventi_strava()
+
+        get.assert_called_once()
+        attivita = Attivita.objects.get(strava_activity_id=9001)
+        self.assertEqual((attivita.dispositivo, attivita.parziali), ('Garmin', [{'split': 1}]))
+        evento.refresh_from_db()
+        self.assertEqual(evento.stato, 'Elaborato')
+
+    def test_update_a_tipo_non_gestito_cancella(self, *_):
+        _attivita(self.profilo, 9001, timezone.now())
+        self._evento(aspect_type='update', updates={'type': 'Ride'})
+        with mock.patch('atleti.tasks.token_valido', return_value='tok'), \
+                mock.patch('atleti.strava_client.get', return_value=_RispostaFinta(200, _summary_strava(9001, '2025-03-10T07:00:00', tipo='Ride'))):
+            task_elabora_eventi_strava()
+        self.assertFalse(Attivita.objects.exists())
+        self.assertEqual(EventoStrava.objects.get().stato, 'Ignorato')
+
+    def test_delete_verificato_con_strava(self, *_):
+        _attivita(self.profilo, 9001, timezone.now())
+        self._evento(aspect_type='delete')
+        with mock.patch('atleti.tasks.token_valido', return_value='tok'), \
+                mock.patch('atleti.strava_client.get', return_value=_RispostaFinta(404, {})) as get:
+            task_elabora_eventi_strava()
+        get.assert_called_once_with("activities/9001", access_token='tok', timeout=15)
+        self.assertFalse(Attivita.objects.exists())
+        self.assertEqual(EventoStrava.objects.get().stato, 'Elaborato')
+
+    def test_delete_non_confermato_non_cancella(self, *_):
+        _attivita(self.profilo, 9001, timezone.now())
+        evento = self._evento(aspect_type='delete')
+        with mock.patch('atleti.tasks.token_valido', return_value='tok'), \
+                mock.patch('atleti.strava_client.get', return_value=_RispostaFinta(200, _summary_strava(9001, '2025-03-10T07:00:00'))):
+            task_elabora_eventi_strava()
+        self.assertTrue(Attivita.objects.filter(strava_activity_id=9001).exists())
+        # Senza token non si può verificare: nessuna cancellazione
+        evento.stato = 'In Coda'
+        evento.save()
+        with mock.patch('atleti.tasks.token_valido', return_value=None), mock.patch('atleti.strava_client.get') as get:
+            task_elabora_eventi_strava()
+        get.assert_not_called()
+        evento.refresh_from_db()
+        self.assertEqual(evento.stato, 'Errore')
+        self.assertTrue(Attivita.objects.filter(strava_activity_id=9001).exists())
+
+    def test_atleta_sconosciuto_e_revoca(self, *_):
+        sconosciuto = self._evento(owner_id=999)
+        revoca = self._evento(object_type='athlete', object_id=1234, aspect_type='update', updates={'authorized': 'false'})
+        with mock.patch('atleti.tasks.token_valido', return_value='tok'), \
+                mock.patch('atleti.strava_client.get', return_value=_RispostaFinta(401, {})) as get:
+            task_elabora_eventi_strava()
+        get.assert_called_once_with("athlete", access_token='tok', timeout=15)
+        sconosciuto.refresh_from_db()
+        revoca.refresh_from_db()
+        self.assertEqual((sconosciuto.stato, revoca.stato), ('Ignorato', 'Elaborato'))
+        self.assertFalse(SocialToken.objects.filter(account__user=self.profilo.user).exists())
+
+    def test_revoca_non_confermata_mantiene_il_token(self, *_):
+        revoca = self._evento(object_type='athlete', object_id=1234, aspect_type='update', updates={'authorized': 'false'})
+        with mock.patch('atleti.tasks.token_valido', return_value='tok'), \
+                mock.patch('atleti.strava_client.get', return_value=_RispostaFinta(200, {'id': 1234})):
+            task_elabora_eventi_strava()
+        revoca.refresh_from_db()
+        self.assertEqual(revoca.stato, 'Ignorato')
+        self.assertTrue(SocialToken.objects.filter(account__user=self.profilo.user).exists())
+
+        # Rinnovo fallito: la revoca resta in coda, il token non si tocca
+        revoca.stato = 'In Coda'
+        revoca.save()
+        with mock.patch('atleti.tasks.token_valido', return_value=None), mock.patch('atleti.strava_client.get') as get:
+            task_elabora_eventi_strava()
+        get.assert_not_called()
+        revoca.refresh_from_db()
+        self.assertEqual((revoca.stato, revoca.tentativi), ('In Coda', 1))
+        self.assertTrue(SocialToken.objects.filter(account__user=self.profilo.user).exists())
+
+    def test_quota_esaurita_lascia_in_coda(self, acquisisci, _):
+        acquisisci.return_value = False
+        evento = self._evento()
+        with mock.patch('atleti.tasks.token_valido', return_value='tok'), mock.patch('atleti.strava_client.get') as get:
+            task_elabora_eventi_strava()
+        get.assert_not_called()
+        evento.refresh_from_db()
+        self.assertEqual(evento.stato, 'In Coda')
+
+
+@override_settings(LOG_BUFFER_ASINCRONO=False)
+class CodaSincronizzazioneTest(TestCase):
+    """Coda JobSincronizzazione: niente doppioni, prenotazione dei job, pause e recupero degli orfani"""
+
+    def setUp(self):
+        self.profili = [_crea_atleta(f"atleta{i}", 2000 + i) for i in range(3)]
+
+    def _job(self, indice, **campi):
+        return JobSincronizzazione.objects.create(utente=self.profili[indice].user, **campi)
+
+    def test_accodamento_senza_doppioni(self):
+        user = self.profili[0].user
+        job, creato = sync.accoda_sincronizzazione(user)
+        self.assertTrue(creato)
+        self.assertEqual(sync.accoda_sincronizzazione(user, completo=True), (job, False))
+        self.assertIsNone(job.after_timestamp)  # Storico mai scaricato
+
+    def test_prenotazione_in_ordine(self):
+        primo, secondo = self._job(0), self._job(1)
+        preso = sync._prendi_prossimo_job()
+        self.assertEqual(preso, primo)
+        self.assertEqual((preso.stato, preso.tentativi), ('In Corso', 1))
+        self.assertIsNotNone(preso.heartbeat)
+        self.assertEqual(sync._prendi_prossimo_job(), secondo)
+        self.assertIsNone(sync._prendi_prossimo_job())
+
+    def test_job_in_pausa_per_rate_limit(self):
+        self._job(0, riprova_dopo=timezone.now() + timedelta(minutes=5))
+        self.assertIsNone(sync._prendi_prossimo_job())
+        pronto = self._job(1, riprova_dopo=timezone.now() - timedelta(seconds=1))
+        preso = sync._prendi_prossimo_job()
+        self.assertEqual(preso, pronto)
+        self.assertIsNone(preso.riprova_dopo)
+
+    def test_messa_in_pausa_fino_alla_finestra_successiva(self):
+        job = self._job(0, stato='In Corso', tentativi=2, pagina=3)
+        with mock.patch('atleti.rate_limit.secondi_al_reset', return_value=600):
+            sync._metti_in_pausa(job, "Limite richieste Strava raggiunto.")
+        job.refresh_from_db()
+        self.assertEqual((job.stato, job.tentativi, job.pagina), ('In Coda', 0, 3))
+        self.assertIn(f"Riprendo alle {job.riprova_dopo.strftime('%H:%M')}", job.messaggio_stato)
+        self.assertIsNone(sync._prendi_prossimo_job())
+
+    def test_recupero_job_orfani(self):
+        vivo = self._job(0, stato='In Corso', heartbeat=timezone.now() - timedelta(minutes=2), tentativi=1)
+        orfano = self._job(1, stato='In Corso', heartbeat=timezone.now() - sync.HEARTBEAT_SCADUTO - timedelta(minutes=1), tentativi=1, pagina=4)
+        preso = sync._prendi_prossimo_job()
+        self.assertEqual(preso, orfano)
+        # Riparte dal checkpoint di pagina salvato
+        self.assertEqual((preso.tentativi, preso.pagina), (2, 4))
+        self.assertIsNone(sync._prendi_prossimo_job())
+        vivo.refresh_from_db()
+        self.assertEqual(vivo.tentativi, 1)
+
+    def test_errore_rimette_in_coda_fino_al_massimo(self):
+        job = self._job(0)
+        with mock.patch('atleti.sync.esegui_job', side_effect=ValueError("Errore API Strava 500")):
+            for tentativo in range(1, sync.MAX_TENTATIVI + 1):
+                JobSincronizzazione.objects.filter(pk=job.pk).update(riprova_dopo=None)
+                self.assertTrue(sync.elabora_prossimo_job())
+                job.refresh_from_db()
+                atteso = 'Errore' if tentativo == sync.MAX_TENTATIVI else 'In Coda'
+                self.assertEqual((job.stato, job.tentativi), (atteso, tentativo))
+        self.assertEqual(job.errore, "Errore API Strava 500")
+        self.assertFalse(sync.elabora_prossimo_job())
+
+
+@override_settings(LOG_BUFFER_ASINCRONO=False)
+class ImportPaginaAttivitaTest(TestCase):
+    """importa_pagina_attivita: upsert di una pagina intera, filtri, dettagli e query indipendenti dalle righe"""
+
+    def setUp(self):
+        self.profilo = _crea_atleta('runner', 1234)
+
+    def _importa(self, activities, dettagli=None, **kwargs):
+        with mock.patch('atleti.utils._prefetch_pagina_strava', return_value=({}, dettagli or {})) as prefetch:
+            nuove = importa_pagina_attivita(activities, self.profilo, 'tok', **kwargs)
+        return nuove, prefetch
+
+    def test_upsert_e_filtri(self):
+        esistente = _attivita(self.profilo, 1, timezone.now() - timedelta(days=3), distanza=5000.0, vam_selettiva=800.0, parziali=[{'split': 1}])
+        pagina = [
+            _summary_strava(1, '2025-03-01T07:00:00', distanza=5100.0),
+            _summary_strava(2, '2025-03-02T07:00:00'),
+            _summary_strava(3, '2025-03-03T07:00:00', tipo='Ride'),
+            _summary_strava(4, '2025-03-04T07:00:00', private=True),
+            _summary_strava(5, '2025-03-05T07:00:00', tipo='Hike'),
+        ]
+        mancanti = []
+        nuove, prefetch = self._importa(pagina, {2: {'device_name': 'Coros', 'splits_metric': [{'split': 2}]}}, dettagli_mancanti=mancanti)
+
+        self.assertEqual(sorted(nuove), [2, 5])
+        self.assertEqual(sorted(Attivita.objects.values_list('strava_activity_id', flat=True)), [1, 2, 5])
+        # Dettaglio chiesto solo per le nuove; quello non arrivato finisce tra i mancanti
+        self.assertEqual(sorted(prefetch.call_args.args[1]), [2, 5])
+        self.assertEqual(mancanti, [5])
+
+        esistente.refresh_from_db()
+        self.assertEqual(esistente.distanza, 5100.0)
+        self.assertEqual((esistente.vam_selettiva, esistente.parziali), (800.0, [{'split': 1}]))  # Conservati
+        nuova = Attivita.objects.get(strava_activity_id=2)
+        self.assertEqual((nuova.dispositivo, nuova.parziali), ('Coros', [{'split': 2}]))
+        self.assertEqual(Attivita.objects.get(strava_activity_id=5).tipo_attivita, 'TrailRun')
+
+    def test_dettaglio_forzato_per_le_esistenti_senza_parziali(self):
+        _attivita(self.profilo, 1, timezone.now() - timedelta(days=3))
+        _, prefetch = self._importa([_summary_strava(1, '2025-03-01T07:00:00')], {1: {'device_name': 'Suunto'}}, force_detail_update=True)
+        self.assertEqual(prefetch.call_args.args[1], [1])
+        self.assertEqual(Attivita.objects.get().dispositivo, 'Suunto')
+
+    def test_query_indipendenti_dalle_righe(self):
+        def conta(ids):
+            pagina = [_summary_strava(i, f"2025-03-{1 + i % 28:02d}T07:00:00") for i in ids]
+            with mock.patch('atleti.utils.registra_log'), CaptureQueriesContext(connection) as query:
+                self._importa(pagina)
+            return len(query)
+
+        conta(range(1, 3))  # La prima pagina crea finestra e aggregati
+        self.assertEqual(conta(range(100, 105)), conta(range(200, 230)))
+        self.assertEqual(Attivita.objects.count(), 37)
+
+
+class AggregatiAtletaTest(TestCase):
+    """Rollup giorno/settimana/anno aggiornati dai segnali di Attivita"""
+
+    def setUp(self):
+        self.profilo = _crea_atleta('runner', 1234)
+
+    def _righe(self):
+        return {
+            (r.periodo, r.data_inizio): (r.distanza, r.numero_attivita)
+            for r in AggregatoAtleta.objects.filter(atleta=self.profilo)
+        }
+
+    def test_creazione_modifica_spostamento_cancellazione(self):
+        mercoledi = _attivita(self.profilo, 1, datetime(2025, 3, 12, 8), distanza=10000.0)
+        _attivita(self.profilo, 2, datetime(2025, 3, 14, 8), distanza=5000.0)
+        lunedi, capodanno = date(2025, 3, 10), date(2025, 1, 1)
+        self.assertEqual(self._righe(), {
+            ('G', date(2025, 3, 12)): (10000.0, 1), ('G', date(2025, 3, 14)): (5000.0, 1),
+            ('S', lunedi): (15000.0, 2), ('A', capodanno): (15000.0, 2),
+        })
+
+        mercoledi.distanza = 12000.0
+        mercoledi.save()
+        self.assertEqual(self._righe()[('S', lunedi)], (17000.0, 2))
+
+        # Spostata all'anno prima: i periodi vecchi vengono ricalcolati, quelli nuovi creati
+        mercoledi.data = datetime(2024, 12, 30, 8)
+        mercoledi.save()
+        righe = self._righe()
+        self.assertNotIn(('G', date(2025, 3, 12)), righe)
+        self.assertEqual(righe[('S', lunedi)], (5000.0, 1))
+        self.assertEqual(righe[('S', date(2024, 12, 30))], (12000.0, 1))
+        self.assertEqual(righe[('A', date(2024, 1, 1))], (12000.0, 1))
+        self.assertEqual(righe[('A', capodanno)], (5000.0, 1))
+
+        mercoledi.delete()
+        self.assertEqual(set(self._righe()), {('G', date(2025, 3, 14)), ('S', lunedi), ('A', capodanno)})
+
+    def test_salvataggio_senza_modifiche_non_ricalcola(self):
+        attivita = _attivita(self.profilo, 1, datetime(2025, 3, 12, 8))
+        attivita = Attivita.objects.get(pk=attivita.pk)
+        attivita.nome = "Nuovo nome"
+        with mock.patch('atleti.aggregati.aggiorna_aggregati') as aggiorna:
+            attivita.save()
+        aggiorna.assert_not_called()
+
+    def test_ricostruzione_coincide_con_incrementale(self):
+        for i, giorno in enumerate([datetime(2024, 6, 1, 7), datetime(2025, 2, 3, 7), datetime(2025, 2, 4, 18)]):
+            _attivita(self.profilo, i + 1, giorno, distanza=1000.0 * (i + 1))
+        incrementali = self._righe()
+        aggregati.ricostruisci_aggregati(self.profilo.id)
+        self.assertEqual(self._righe(), incrementali)
+
+
+class VolumiYtdTest(TestCase):
+    """volumi_ytd e totali_dashboard letti dai rollup"""
+
+    def setUp(self):
+        self.profilo = _crea_atleta('runner', 1234)
+
+    def _crea(self, *giorni):
+        for i, (giorno, distanza) in enumerate(giorni):
+            _attivita(self.profilo, i + 1, datetime.combine(giorno, datetime.min.time()).replace(hour=8), distanza=distanza)
+
+    def test_stesso_giorno_degli_anni_passati(self):
+        self._crea(
+            (date(2021, 2, 10), 1000.0),
+            (date(2023, 3, 1), 2000.0), (date(2023, 3, 2), 4000.0),  # Il 2 marzo è dopo "oggi"
+            (date(2025, 1, 10), 8000.0),  # Anno corrente: escluso
+        )
+        self.assertEqual(aggregati.volumi_ytd(self.profilo, oggi=date(2025, 3, 1)), {
+            2024: (0, 0), 2023: (2000.0, 100.0), 2022: (0, 0), 2021: (1000.0, 100.0),
+        })
+
+    def test_anno_con_attivita_solo_dopo_oggi_e_bisestile(self):
+        self._crea((date(2022, 11, 5), 3000.0), (date(2023, 2, 28), 5000.0))
+        self.assertEqual(aggregati.volumi_ytd(self.profilo, oggi=date(2024, 2, 29)), {
+            2023: (5000.0, 100.0), 2022: (0, 0),
+        })
+
+    def test_senza_attivita(self):
+        self.assertEqual(aggregati.volumi_ytd(self.profilo, oggi=date(2025, 3, 1)), {})
+
+    def test_totali_dashboard(self):
+        oggi = date(2025, 3, 12)  # Mercoledì
+        self._crea(
+            (date(2024, 12, 1), 1000.0), (date(2025, 2, 20), 2000.0),
+            (date(2025, 3, 10), 3000.0), (date(2025, 3, 12), 4000.0),
+        )
+        totali = aggregati.totali_dashboard(self.profilo, oggi=oggi)
+        self.assertEqual(totali['totale_metri'], 10000.0)
+        self.assertEqual(totali['annuale_metri'], 9000.0)
+        self.assertEqual(totali['dislivello_settimanale'], 200.0)
+        # Km Sforzo = km + D+/100: 7 giorni (10 e 12 marzo) e 28 giorni (anche il 20 febbraio)
+        self.assertAlmostEqual(totali['carico_acuto'], 3 + 1 + 4 + 1)
+        self.assertAlmostEqual(totali['carico_cronico_totale'], 2 + 1 + 3 + 1 + 4 + 1)
+
+
+@override_settings(LOG_BUFFER_ASINCRONO=False)
+class CoachBatchParityTest(TestCase):
+    """analizza_atleti_batch deve dare gli stessi risultati del vecchio calcolo atleta per atleta"""
+
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        adesso = timezone.now().replace(microsecond=0)
+        # Storico lungo e vario, poche attività (niente trend), solo attività vecchie, nessuna attività
+        storie = {'completo': (60, 0), 'poche': (3, 0), 'vecchie': (15, 120), 'vuoto': (0, 0)}
+        self.profili = []
+        strava_id = 1
+        for indice, (nome, (quante, giorni_fa)) in enumerate(storie.items()):
+            profilo = _crea_atleta(nome, 3000 + indice)
+            for i in range(quante):
+                trail = rng.random() < 0.4
+                _attivita(
+                    profilo, strava_id, adesso - timedelta(days=giorni_fa + i * 1.5, hours=indice),
+                    tipo_attivita='TrailRun' if trail else 'Run',
+                    distanza=float(rng.integers(5000, 32000)), durata=int(rng.integers(1800, 12000)),
+                    dislivello=float(rng.integers(0, 1500)) if trail else float(rng.integers(0, 150)),
+                    vo2max_stimato=float(rng.uniform(42, 60)), fc_media=int(rng.integers(130, 165)),
+                    potenza_media=float(rng.uniform(200, 320)) if rng.random() < 0.7 else None,
+                )
+                strava_id += 1
+            self.profili.append(profilo)
+
+    def _vecchio_calcolo(self, profilo, cutoff_date, acwr_ref_date):
+        ultime = Attivita.objects.filter(atleta=profilo).order_by('-data')[:30]
+        p_vals = [act.potenza_media for act in ultime if act.potenza_media and act.potenza_media > 0]
+
+        load_acute = load_chronic_total = 0
+        start_acute = acwr_ref_date - timedelta(days=7)
+        for act in Attivita.objects.filter(atleta=profilo, data__gte=acwr_ref_date - timedelta(days=28), data__lt=acwr_ref_date):
+            load_val = act.distanza / 1000 + act.dislivello / 100
+            load_chronic_total += load_val
+            if act.data >= start_acute:
+                load_acute += load_val
+
+        return {
+            'power': int(sum(p_vals) / len(p_vals)) if p_vals else 0,
+            'trends': calcola_trend_atleta(profilo, cutoff_date=cutoff_date),
+            'load_acute': load_acute,
+            'load_chronic_total': load_chronic_total,
+            'potenziale': stima_potenziale_gara(profilo),
+        }
+
+    def test_settimana_corrente_e_passata(self):
+        oggi = timezone.now()
+        inizio_settimana = (oggi - timedelta(days=oggi.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
+        for week_offset in (0, -3):
+            with self.subTest(week_offset=week_offset):
+                # Stesse date di _get_coach_dashboard_context
+                fine_settimana = inizio_settimana + timedelta(weeks=week_offset + 1)
+                acwr_ref_date = timezone.now() if week_offset == 0 else fine_settimana
+                batch = coach.analizza_atleti_batch([p.id for p in self.profili], fine_settimana, acwr_ref_date)
+                for profilo in self.profili:
+                    atteso = self._vecchio_calcolo(profilo, fine_settimana, acwr_ref_date)
+                    risultato = batch[profilo.id]
+                    self.assertEqual(risultato['power'], atteso['power'], profilo.user.username)
+                    self.assertEqual(risultato['trends'], atteso['trends'], profilo.user.username)
+                    self.assertEqual(risultato['potenziale'], atteso['potenziale'], profilo.user.username)
+                    self.assertAlmostEqual(risultato['load_acute'], atteso['load_acute'], places=6)
+                    self.assertAlmostEqual(risultato['load_chronic_total'], atteso['load_chronic_total'], places=6)
+
+        # Il caso "completo" deve davvero esercitare trend, carico e potenziale
+        completo = batch[self.profili[0].id]
+        self.assertTrue(completo['trends'] and completo['load_chronic_total'] and completo['power'])
+
+
+class InvalidazioneSnapshotTest(TestCase):
+    """Gli snapshot coach vengono cancellati solo quando cambia un campo che la dashboard legge"""
+
+    def setUp(self):
+        self.profilo = _crea_atleta('runner', 1234)
+        self.oggi = timezone.now().date()
+        self.settimana = self.oggi - timedelta(days=self.oggi.weekday() + 14)  # Settimana chiusa di due settimane fa
+        attivita = _attivita(self.profilo, 1, datetime.combine(self.settimana, datetime.min.time()) + timedelta(hours=8))
+        SnapshotCoach.objects.create(team=None, settimana_inizio=self.settimana, dati={})
+        self.attivita = Attivita.objects.get(pk=attivita.pk)  # Ricaricata: from_db fotografa i valori
+
+    def test_campo_non_usato_non_invalida(self):
+        self.attivita.nome = "Nuovo nome"
+        self.attivita.save()
+        self.assertTrue(SnapshotCoach.objects.exists())
+
+    def test_campo_usato_invalida(self):
+        self.attivita.fc_media = 160
+        self.attivita.save()
+        self.assertFalse(SnapshotCoach.objects.exists())
+
+    def test_spostamento_nella_settimana_corrente_invalida_la_vecchia(self):
+        self.attivita.data = timezone.now()
+        self.attivita.save()
+        self.assertFalse(SnapshotCoach.objects.exists())
+
+    def test_cancellazione_invalida(self):
+        self.attivita.delete()
+        self.assertFalse(SnapshotCoach.objects.exists())
+
+
+@override_settings(LOG_BUFFER_ASINCRONO=False)
+class SnapshotCoachTest(TestCase):
+    """Lo snapshot di una settimana chiusa riletto coincide con il contesto calcolato dal vivo"""
+
+    WEEK_OFFSET = -2
+
+    def setUp(self):
+        oggi = timezone.now().replace(hour=12, minute=0, second=0, microsecond=0)
+        fine_settimana = oggi - timedelta(days=oggi.weekday()) + timedelta(weeks=self.WEEK_OFFSET + 1)
+        strava_id = 1
+        for indice in range(4):
+            profilo = _crea_atleta(f"atleta{indice}", 4000 + indice)
+            User.objects.filter(pk=profilo.user_id).update(first_name=f"Nome{indice}")
+            # L'ultimo atleta smette tre settimane prima: finisce tra gli inattivi
+            quante = 3 if indice == 3 else 30
+            for i in range(quante):
+                giorni_fa = i + (25 if indice == 3 else 0)
+                _attivita(
+                    profilo, strava_id, fine_settimana - timedelta(days=giorni_fa + 1, hours=indice),
+                    tipo_attivita='TrailRun' if i % 3 == 0 else 'Run',
+                    distanza=8000.0 + 1000 * ((i * (indice + 1)) % 7) + 8000 * (i < 7 and indice == 1),
+                    potenza_media=250.0 + 10 * indice + i, fc_media=140 + (i % 5) * 2 - (indice if i < 5 else 0),
+                    vo2max_stimato=50.0 + indice - (i < 5) * indice,
+                )
+                strava_id += 1
+
+    def test_andata_e_ritorno(self):
+        vivo = _get_coach_dashboard_context(self.WEEK_OFFSET)
+        self.assertTrue(vivo['top_power'] and vivo['atleti_inattivi'] and vivo['acwr_alerts'])
+
+        _get_coach_context_cached(self.WEEK_OFFSET)
+        self.assertEqual(SnapshotCoach.objects.count(), 1)
+        with mock.patch('atleti.views._get_coach_dashboard_context') as ricalcolo:
+            riletto = _get_coach_context_cached(self.WEEK_OFFSET)
+        ricalcolo.assert_not_called()
+
+        self.assertEqual(snapshot._serializza(riletto), snapshot._serializza(vivo))
+        primo = riletto['top_power'][0]['atleta']
+        self.assertIsInstance(primo, ProfiloAtleta)
+        self.assertEqual(primo.user.username, vivo['top_power'][0]['atleta'].user.username)
+        inattivo = riletto['atleti_inattivi'][0]
+        self.assertIsInstance(inattivo, ProfiloAtleta)
+        self.assertEqual(inattivo.last_act, vivo['atleti_inattivi'][0].last_act)
+
+    def test_template_con_contesto_riletto(self):
+        _get_coach_context_cached(self.WEEK_OFFSET)
+        coach_user = User.objects.create_user('coach', password='x', is_staff=True)
+        self.client.force_login(coach_user)
+        with mock.patch('atleti.views._get_coach_dashboard_context') as ricalcolo:
+            risposta = self.client.get(reverse('dashboard_coach'), {'week': self.WEEK_OFFSET})
+        ricalcolo.assert_not_called()
+        self.assertEqual(risposta.status_code, 200)
+        self.assertContains(risposta, 'Nome3')
+        self.assertEqual(risposta.context['atleti_inattivi'][0].user.first_name, 'Nome3')
+
+
+class RollupLogTest(TestCase):
+    """Rollup giornalieri dei log: aggregazione dei giorni chiusi, lettura combinata e retention"""
+
+    def setUp(self):
+        self.utenti = [User.objects.create(username=f"u{i}") for i in range(2)]
+        self.oggi = timezone.now().replace(hour=12, minute=0, second=0, microsecond=0)
+        for giorni_fa, azione, messaggio, utente in [
+            (3, 'Page View', 'Visita Dashboard', 0),
+            (3, 'Page View', 'Visita Dashboard', 1),
+            (3, 'Login', 'Accesso', 0),
+            (3, 'Token Refresh', 'Tecnico', 0),  # Escluso dalle statistiche
+            (1, 'Page View', 'Visita Profilo', 1),
+            (0, 'Page View', 'Visita Dashboard', 0),
+        ]:
+            LogSistema.objects.create(data=self.oggi - timedelta(days=giorni_fa), azione=azione, messaggio=messaggio, utente=self.utenti[utente])
+
+    def _conteggi(self, giorno, tipo):
+        return dict(StatisticaLogGiornaliera.objects.filter(giorno=giorno, tipo=tipo).values_list('chiave', 'conteggio'))
+
+    def test_aggregazione_giorni_chiusi(self):
+        self.assertEqual(log_rollup.aggiorna_rollup_log(), 3)  # Da 3 giorni fa a ieri, oggi escluso
+        self.assertEqual(log_rollup.aggiorna_rollup_log(), 0)
+
+        giorno = (self.oggi - timedelta(days=3)).date()
+        self.assertEqual(self._conteggi(giorno, 'pagina'), {'Dashboard': 2})
+        self.assertEqual(self._conteggi(giorno, 'azione'), {'Login': 1})
+        self.assertEqual(self._conteggi(giorno, 'utente'), {str(self.utenti[0].id): 2, str(self.utenti[1].id): 1})
+        self.assertEqual(self._conteggi(giorno, 'totale'), {'': 3})
+        self.assertEqual(self._conteggi(giorno, 'univoci'), {'': 2})
+        self.assertEqual(self._conteggi(giorno + timedelta(days=1), 'totale'), {'': 0})
+
+    def test_statistiche_uguali_prima_e_dopo_il_rollup(self):
+        prima = log_rollup.statistiche_aggregate()
+        log_rollup.aggiorna_rollup_log()
+        dopo = log_rollup.statistiche_aggregate()
+        self.assertEqual(dopo['pagine'], {'Dashboard': 3, 'Profilo': 1})
+        for chiave in ('pagine', 'utenti', 'azioni'):
+            self.assertEqual(dopo[chiave], prima[chiave])
+        # Il giorno senza log compare nel grafico solo dai rollup (con 0)
+        self.assertEqual({g: n for g, n in dopo['totali_giornalieri'].items() if n}, prima['totali_giornalieri'])
+
+    def test_retention_solo_sui_giorni_aggregati(self):
+        self.assertEqual(log_rollup.pulisci_log_grezzi(giorni_retention=1), 0)  # Niente ancora aggregato
+        log_rollup.aggrega_giorno((self.oggi - timedelta(days=3)).date())
+        log_rollup.pulisci_log_grezzi(giorni_retention=1)
+        # Cancellati solo i log del giorno aggregato
+        self.assertEqual(set(LogSistema.objects.values_list('data__date', flat=True)), {(self.oggi - timedelta(days=1)).date(), self.oggi.date()})
+
+
+@mock.patch('atleti.esecuzione_task.close_old_connections')
+class EsecuzioneTaskTest(SimpleTestCase):
+    """Gruppi esclusivi: un job pianificato aspetta il gruppo occupato, un doppione dello stesso task viene saltato"""
+
+    def _avvia_bloccante(self, task_id):
+        """Task in esecuzione in un thread finché non si imposta l'evento restituito."""
+        avviato, fine = threading.Event(), threading.Event()
+
+        def lavoro():
+            avviato.set()
+            fine.wait(5)
+
+        thread = threading.Thread(target=esegui_task, args=(task_id, lavoro))
+        thread.start()
+        avviato.wait(5)
+        self.addCleanup(thread.join, 5)
+        self.addCleanup(fine.set)
+        return fine
+
+    def test_attende_il_gruppo_occupato(self, _):
+        fine = self._avvia_bloccante('ricalcolo_vam_notturno')
+        eseguito = []
+        attesa = threading.Thread(target=lambda: eseguito.append(esegui_task('sync_strava_periodico', lambda: None, attesa=5)))
+        attesa.start()
+        time.sleep(0.1)
+        self.assertEqual(eseguito, [])  # Ancora in attesa del gruppo quota_strava
+        fine.set()
+        attesa.join(5)
+        self.assertEqual(eseguito, [True])
+
+    def test_gruppo_ancora_occupato_dopo_l_attesa(self, _):
+        self._avvia_bloccante('ricalcolo_vam_notturno')
+        eseguito = mock.Mock()
+        with self.assertLogs('atleti.esecuzione_task', 'WARNING'):
+            self.assertFalse(esegui_task('ricalcolo_stats_notturno', eseguito, attesa=0.1))
+        eseguito.assert_not_called()
+
+    def test_stesso_task_in_corso_saltato_subito(self, _):
+        self._avvia_bloccante('sync_strava_periodico')
+        inizio = time.monotonic()
+        with self.assertLogs('atleti.esecuzione_task', 'WARNING'):
+            self.assertFalse(esegui_task('sync_strava_periodico', mock.Mock(), attesa=5))
+        self.assertLess(time.monotonic() - inizio, 1)
+
+    def test_task_indipendenti_non_aspettano(self, _):
+        self._avvia_bloccante('ricalcolo_vam_notturno')
+        self.assertTrue(esegui_task('calcola_feedback_allenamenti', lambda: None))
+
+
+class FinestraVO2maxTest(TestCase):
+    """Media mobile del VO2max mantenuta dai segnali, anche nelle cancellazioni a cascata"""
+
+    def setUp(self):
+        self.profilo = _crea_atleta('runner', 1234)
+
+    def _crea(self, valori, tipo='Run'):
+        return [
+            _attivita(self.profilo, i + 1, datetime(2025, 3, 1 + i, 8), vo2max_stimato=v, tipo_attivita=tipo)
+            for i, v in enumerate(valori)
+        ]
+
+    def _medie(self):
+        profilo = ProfiloAtleta.objects.get(pk=self.profilo.pk)
+        return profilo.vo2max_stima_statistica, profilo.vo2max_strada
+
+    def test_aggiornamento_incrementale(self):
+        attivita = self._crea([50.0, 52.0, 54.0, 56.0])
+        self.assertEqual(self._medie(), (53.0, 53.0))
+        self.assertEqual(len(FinestraVO2max.objects.get().tutte), 4)
+
+        attivita[0].tipo_attivita = 'TrailRun'
+        attivita[0].save()
+        self.assertEqual(self._medie(), (53.0, 54.0))
+
+        attivita[3].delete()
+        self.assertEqual(self._medie(), (52.0, None))  # Solo 2 uscite su strada: sotto il minimo
+
+    def test_cancellazione_senza_finestra_non_la_crea(self):
+        Attivita.objects.bulk_create([  # bulk_create: nessun segnale, nessuna finestra
+            Attivita(atleta=self.profilo, strava_activity_id=i, data=datetime(2025, 3, i, 8), distanza=10000.0, durata=3000,
+                     dislivello=100.0, passo_medio='5:00', vo2max_stimato=50.0 + i, tipo_attivita='Run')
+            for i in range(1, 5)
+        ])
+        Attivita.objects.get(strava_activity_id=4).delete()
+        self.assertFalse(FinestraVO2max.objects.exists())
+        self.assertEqual(self._medie(), (52.0, 52.0))
+
+    def test_cancellazione_utente_con_attivita(self):
+        self._crea([50.0, 52.0, 54.0])
+        self.profilo.user.delete()
+        self.assertFalse(ProfiloAtleta.objects.exists())
+        self.assertFalse(FinestraVO2max.objects.exists())
+        self.assertFalse(Attivita.objects.exists())
+
+    def test_cancellazione_utente_senza_finestra(self):
+        self._crea([50.0, 52.0, 54.0])
+        FinestraVO2max.objects.all().delete()
+        self.profilo.user.delete()
+        self.assertFalse(FinestraVO2max.objects.exists())
+
+    def test_istante_in_ora_locale(self):
+        # 07:00 UTC = 08:00 a Roma (ora solare): come la data salvata dal DB con USE_TZ=False
+        self.assertEqual(finestra_vo2max._istante('2025-03-10T07:00:00Z'), '2025-03-10T08:00:00.000000')
+        self.assertEqual(finestra_vo2max._istante(datetime(2025, 3, 10, 8)), '2025-03-10T08:00:00.000000')
+
+
+@mock.patch('atleti.strava_client.time.sleep')
+@override_settings(STRAVA_HTTP_TENTATIVI=3)
+class StravaClientTest(SimpleTestCase):
+    """Ripetizioni dei 5xx nel client, ciascuna con un permesso del rate limiter"""
+
+    def _get(self, *risposte, permesso=True):
+        http = mock.Mock()
+        http.get.side_effect = [_RispostaFinta(codice, {}) for codice in risposte]
+        with mock.patch('atleti.strava_client.sessione', return_value=http), \
+                mock.patch('atleti.rate_limit.acquisisci_permesso', return_value=permesso) as acquisisci:
+            response = strava_client.get('athlete', access_token='tok')
+        return response, http.get.call_count, acquisisci.call_count
+
+    def test_5xx_ripetuto_con_permesso(self, _):
+        response, chiamate, permessi = self._get(503, 502, 200)
+        self.assertEqual((response.status_code, chiamate, permessi), (200, 3, 2))
+
+    def test_senza_permesso_nessuna_ripetizione(self, _):
+        response, chiamate, _ = self._get(503, 200, permesso=False)
+        self.assertEqual((response.status_code, chiamate), (503, 1))
+
+    def test_429_e_4xx_non_ripetuti(self, _):
+        for codice in (429, 404):
+            with self.subTest(codice=codice):
+                self.assertEqual(self._get(codice)[1:], (1, 0))
+
+    def test_tentativi_esauriti(self, _):
+        response, chiamate, permessi = self._get(500, 500, 500, 500)
+        self.assertEqual((response.status_code, chiamate, permessi), (500, 4, 3))
+
+    def test_ripetizione_con_la_priorita_del_chiamante(self, _):
+        http = mock.Mock()
+        http.get.side_effect = [_RispostaFinta(503, {}), _RispostaFinta(200, {})]
+        with mock.patch('atleti.strava_client.sessione', return_value=http), \
+                mock.patch('atleti.rate_limit.acquisisci_permesso', return_value=True) as acquisisci:
+            strava_client.get('athlete/activities', access_token='tok', priorita=rate_limit.INTERATTIVA)
+        acquisisci.assert_called_once_with(rate_limit.INTERATTIVA)
+
+    @override_settings(STRAVA_HTTP_POOL=24)
+    def test_pool_e_retry_dell_adapter(self, _):
+        adapter = strava_client._crea_sessione().get_adapter('https://www.strava.com')
+        self.assertEqual(adapter._pool_maxsize, 24)
+        self.assertEqual((adapter.max_retries.read, adapter.max_retries.status), (0, 0))
+
+
+@override_settings(STRAVA_PREFETCH_WORKERS=4)
+class PrefetchPaginaTest(SimpleTestCase):
+    """Stream e dettagli di una pagina scaricati in parallelo, risultati per ID Strava"""
+
+    def test_download_paralleli(self):
+        # Le 4 richieste devono essere in volo insieme: con un download alla volta la barriera scade
+        barriera = threading.Barrier(4, timeout=5)
+
+        def vam(strava_id, access_token, priorita):
+            barriera.wait()
+            return float(strava_id)
+
+        def dettaglio(strava_id, access_token, priorita):
+            barriera.wait()
+            return {'id': strava_id, 'priorita': priorita} if strava_id != 4 else None  # 4: quota esaurita
+
+        with mock.patch('atleti.utils.calcola_vam_selettiva', side_effect=vam), \
+                mock.patch('atleti.utils._scarica_dettaglio_attivita', side_effect=dettaglio), \
+                mock.patch('atleti.utils.close_old_connections'):
+            risultati = _prefetch_pagina_strava([1, 2], [3, 4], 'tok', rate_limit.INTERATTIVA)
+
+        self.assertEqual(risultati, ({1: 1.0, 2: 2.0}, {3: {'id': 3, 'priorita': 'interattiva'}, 4: None}))
+
+    def test_niente_da_scaricare(self):
+        with mock.patch('atleti.utils.ThreadPoolExecutor') as pool:
+            self.assertEqual(_prefetch_pagina_strava([], [], 'tok', rate_limit.BACKGROUND), ({}, {}))
+        pool.assert_not_called()
+
+
+@override_settings(LOG_BUFFER_ASINCRONO=False)
+class TokenCacheTest(TestCase):
+    """token_valido: token servito dalla cache, un solo rinnovo vicino alla scadenza o dopo un 401"""
+
+    def setUp(self):
+        cache.clear()
+        token_cache._locale.clear()
+        self.app = SocialApp.objects.create(provider='strava', name='Strava', client_id='id', secret='segreto')
+
+    def _atleta(self, scadenza):
+        profilo = _crea_atleta('runner', 1234, scadenza=scadenza)
+        SocialToken.objects.update(app=self.app)
+        return profilo.user_id
+
+    def _strava_token(self, token='nuovo'):
+        risposta = _RispostaFinta(200, {'access_token': token, 'refresh_token': 'refresh2', 'expires_in': 21600})
+        return mock.patch('atleti.utils.strava_client.post', return_value=risposta)
+
+    def test_token_valido_senza_rinnovo_e_poi_dalla_memoria(self):
+        user_id = self._atleta(timedelta(hours=6))
+        with self._strava_token() as post:
+            self.assertEqual(token_cache.token_valido(user_id), 'tok')
+            with self.assertNumQueries(0):
+                self.assertEqual(token_cache.token_valido(user_id), 'tok')
+        post.assert_not_called()
+
+    def test_un_solo_rinnovo_vicino_alla_scadenza(self):
+        user_id = self._atleta(timedelta(minutes=2))
+        with self._strava_token() as post:
+            self.assertEqual(token_cache.token_valido(user_id), 'nuovo')
+            self.assertEqual(token_cache.token_valido(user_id), 'nuovo')
+        post.assert_called_once()
+        self.assertEqual(SocialToken.objects.values_list('token', 'token_secret').get(), ('nuovo', 'refresh2'))
+
+    def test_token_rifiutato_rinnovato_forzatamente(self):
+        user_id = self._atleta(timedelta(hours=6))
+        token_cache.token_valido(user_id)
+        with self._strava_token() as post:
+            self.assertEqual(token_cache.token_valido(user_id, rifiutato='tok'), 'nuovo')
+        post.assert_called_once()
+
+    def test_token_rifiutato_gia_sostituito_da_un_altro_processo(self):
+        user_id = self._atleta(timedelta(hours=6))
+        token_cache.token_valido(user_id)
+        token_cache._locale.clear()
+        cache.clear()
+        SocialToken.objects.update(token='ruotato')
+        with self._strava_token() as post:
+            self.assertEqual(token_cache.token_valido(user_id, rifiutato='tok'), 'ruotato')
+        post.assert_not_called()
+
+
+@override_settings(LOG_BUFFER_ASINCRONO=False)
+@mock.patch('atleti.sync.PER_PAGE', 2)
+@mock.patch('atleti.sync.token_valido', return_value='tok')
+@mock.patch('atleti.sync.completa_dettagli_attivita')
+@mock.patch('atleti.utils._prefetch_pagina_strava', return_value=({}, {}))  # Nessun dettaglio: finiscono in sospeso
+class BackfillRiprendibileTest(TestCase):
+    """Storico completo: il cursore 'before' dello StatoBackfill sopravvive al job e il successivo riprende da lì"""
+
+    STORICO = [_summary_strava(i, f"2025-03-{i:02d}T07:00:00") for i in (10, 9, 8)]  # Dalla più recente
+
+    def setUp(self):
+        self.profilo = _crea_atleta('runner', 1234)
+        self.richieste = []
+        self.permessi = []  # Esiti di acquisisci_permesso, poi sempre concesso
+
+    def _strava(self, url, params=None, **kwargs):
+        self.richieste.append(params)
+        before = params.get('before')
+        pagina = [a for a in self.STORICO if before is None or sync._timestamp(a['start_date']) < before]
+        return _RispostaFinta(200, pagina[:2])
+
+    def _permesso(self, *args, **kwargs):
+        return self.permessi.pop(0) if self.permessi else True
+
+    def _esegui(self):
+        job, _ = sync.accoda_sincronizzazione(self.profilo.user)
+        with mock.patch('atleti.strava_client.get', side_effect=self._strava), \
+                mock.patch('atleti.rate_limit.acquisisci_permesso', side_effect=self._permesso), \
+                mock.patch('atleti.rate_limit.quota_disponibile', return_value=True):
+            sync.esegui_job(job)
+        job.refresh_from_db()
+        return job
+
+    def test_ripresa_dal_cursore_dopo_un_job_interrotto(self, _, completa, *__):
+        completa.side_effect = lambda strava_ids, *args, **kwargs: list(strava_ids)
+        # Primo job: una pagina, poi la quota finisce (pausa) e il job si chiude in errore
+        self.permessi = [True, False]
+        job = self._esegui()
+        self.assertEqual((job.stato, job.pagina), ('In Coda', 2))
+        backfill = StatoBackfill.objects.get(atleta=self.profilo)
+        self.assertEqual(backfill.ts_piu_vecchio, sync._timestamp('2025-03-09T07:00:00'))
+        self.assertEqual(backfill.dettagli_in_sospeso, [10, 9])
+        sync._chiudi(job, 'Errore', "Interrotto")
+
+        # Un job nuovo riparte dal cursore, non dalla pagina 1 senza 'before'
+        self.richieste.clear()
+        job = self._esegui()
+        self.assertEqual(job.stato, 'Completato')
+        self.assertEqual(self.richieste, [
+            {'page': 1, 'per_page': 2, 'before': sync._timestamp('2025-03-09T07:00:00') + 1},
+            {'page': 1, 'per_page': 2, 'before': sync._timestamp('2025-03-08T07:00:00') + 1},
+        ])
+        self.assertEqual(sorted(Attivita.objects.values_list('strava_activity_id', flat=True)), [8, 9, 10])
+
+        backfill.refresh_from_db()
+        self.assertEqual((backfill.stato, backfill.dettagli_in_sospeso), ('Completato', []))
+        self.assertEqual(sorted(completa.call_args.args[0]), [8, 9, 10])
+
+        # Storico completo: la sync successiva è incrementale
+        self.assertIsNotNone(sync.accoda_sincronizzazione(self.profilo.user)[0].after_timestamp)
+
+
+@override_settings(LOG_BUFFER_ASINCRONO=False, STRAVA_PREFETCH_WORKERS=1)
+class DettagliInSospesoTest(TestCase):
+    """Recupero dei dettagli in sospeso a fine storico: si tolgono solo quelli davvero gestiti"""
+
+    def setUp(self):
+        self.profilo = _crea_atleta('runner', 1234)
+        for strava_id in (1, 2, 3):
+            _attivita(self.profilo, strava_id, datetime(2025, 3, strava_id, 7, 0))
+        self.backfill = StatoBackfill.objects.create(atleta=self.profilo, dettagli_in_sospeso=[1, 2, 3])
+        self.job, _ = sync.accoda_sincronizzazione(self.profilo.user)
+
+    def _dettaglio(self, url, **kwargs):
+        strava_id = int(url.rsplit('/', 1)[1])
+        if strava_id == 3:
+            return _RispostaFinta(404, {})
+        return _RispostaFinta(200, _summary_strava(strava_id, '2025-03-01T07:00:00', splits_metric=[{'split': 1}]))
+
+    def test_permesso_negato_a_meta_blocco(self):
+        # Un solo worker: i permessi vengono chiesti in ordine (1 concesso, 2 negato, 3 concesso)
+        with mock.patch('atleti.rate_limit.quota_disponibile', return_value=True), \
+                mock.patch('atleti.rate_limit.acquisisci_permesso', side_effect=[True, False, True]), \
+                mock.patch('atleti.strava_client.get', side_effect=self._dettaglio):
+            completato = sync._recupera_dettagli_in_sospeso(self.job, self.backfill, 'tok')
+
+        self.assertFalse(completato)
+        self.backfill.refresh_from_db()
+        self.job.refresh_from_db()
+        # 1 scaricato, 3 non più su Strava: resta solo il 2, da riprendere dopo la pausa
+        self.assertEqual(self.backfill.dettagli_in_sospeso, [2])
+        self.assertEqual(self.job.stato, 'In Coda')
+        self.assertIsNotNone(self.job.riprova_dopo)
+        self.assertEqual(Attivita.objects.get(strava_activity_id=1).parziali, [{'split': 1}])
+
+
+def _scarpa_strava(strava_id, nome='Hoka Speedgoat 5', distanza=100000.0, primary=False):
+    return {'id': strava_id, 'name': nome, 'distance': distanza, 'primary': primary}
+
+
+@override_settings(LOG_BUFFER_ASINCRONO=False)
+class ImpronteStravaTest(TestCase):
+    """/athlete condizionale (ETag) e scarpe scritte solo quando la lista cambia"""
+
+    def setUp(self):
+        self.profilo = _crea_atleta('runner', 1234)
+
+    def _scarica(self, **kwargs):
+        with mock.patch('atleti.strava_client.get', return_value=_RispostaFinta(304)) as get:
+            impronte_strava.scarica_atleta(self.profilo, 'tok', **kwargs)
+        return get.call_args.kwargs['headers']
+
+    def test_if_none_match_solo_con_etag_registrato(self):
+        self.assertIsNone(self._scarica())
+        impronte_strava.registra_etag(self.profilo, _RispostaFinta(200, {}, headers={'ETag': 'W/"abc"'}))
+        self.assertEqual(self._scarica(), {'If-None-Match': 'W/"abc"'})
+        self.assertIsNone(self._scarica(condizionale=False))
+
+    def test_scarpe_scritte_solo_se_cambiano(self):
+        scarpe = [_scarpa_strava('g1', primary=True), _scarpa_strava('g2', nome='Nike Pegasus 40')]
+        self.assertEqual(impronte_strava.sincronizza_scarpe(self.profilo, scarpe), 2)
+        with self.assertNumQueries(1):  # Solo la lettura dell'impronta
+            self.assertEqual(impronte_strava.sincronizza_scarpe(self.profilo, scarpe), 0)
+
+        # Una scarpa cambia distanza, l'altra sparisce da Strava: dismessa
+        self.assertEqual(impronte_strava.sincronizza_scarpe(self.profilo, [_scarpa_strava('g1', distanza=150000.0, primary=True)]), 1)
+        self.assertEqual(
+            dict(Scarpa.objects.values_list('strava_id', 'retired')), {'g1': False, 'g2': True},
+        )
+        self.assertEqual(Scarpa.objects.get(strava_id='g1').distanza, 150000.0)
+        self.assertEqual(impronte_strava.sincronizza_scarpe(self.profilo, [_scarpa_strava('g1', distanza=150000.0, primary=True)], forza=True), 0)
+
+
+@override_settings(LOG_BUFFER_ASINCRONO=False)
+@mock.patch('atleti.views.token_valido', return_value='tok')
+@mock.patch('atleti.rate_limit.acquisisci_permesso', return_value=True)
+class SincronizzaStravaVistaTest(TestCase):
+    """Bottone Sincronizza: su 304 profilo e scarpe restano invariati, la sync attività viene comunque accodata"""
+
+    def setUp(self):
+        self.profilo = _crea_atleta('runner', 1234)
+        ProfiloAtleta.objects.filter(pk=self.profilo.pk).update(peso=70.0, fc_riposo=50)
+        self.client.force_login(self.profilo.user)
+        impronte_strava.registra_etag(self.profilo, _RispostaFinta(200, {}, headers={'ETag': '"v1"'}))
+        impronte_strava.sincronizza_scarpe(self.profilo, [_scarpa_strava('g1')])
+
+    def _sincronizza(self, risposta):
+        with mock.patch('atleti.strava_client.get', return_value=risposta) as get:
+            self.client.get(reverse('strava_sync'))
+        return get.call_args.kwargs['headers']
+
+    def test_304_non_tocca_profilo_e_scarpe(self, *_):
+        with mock.patch('atleti.views.sincronizza_scarpe') as scarpe, mock.patch.object(ProfiloAtleta, 'save') as salva:
+            headers = self._sincronizza(_RispostaFinta(304))
+        self.assertEqual(headers, {'If-None-Match': '"v1"'})
+        scarpe.assert_not_called()
+        salva.assert_not_called()
+        self.assertFalse(Scarpa.objects.get().retired)
+        self.assertTrue(JobSincronizzazione.objects.filter(utente=self.profilo.user).exists())
+
+    def test_200_aggiorna_e_registra_il_nuovo_etag(self, *_):
+        dati = {'weight': 68.0, 'firstname': 'Mario', 'lastname': 'Rossi', 'shoes': [_scarpa_strava('g2', nome='Nike Pegasus 40')]}
+        self._sincronizza(_RispostaFinta(200, dati, headers={'ETag': '"v2"'}))
+        self.assertEqual(ImprontaDatiStrava.objects.get(atleta=self.profilo).etag, '"v2"')
+        self.assertEqual(ProfiloAtleta.objects.get(pk=self.profilo.pk).peso, 68.0)
+        self.assertEqual(dict(Scarpa.objects.values_list('strava_id', 'retired')), {'g1': True, 'g2': False})
+
+
+class ExportCsvTest(TestCase):
+    """Export attività: CSV in streaming e variante gzip con lo stesso contenuto"""
+
+    def setUp(self):
+        self.profilo = _crea_atleta('runner', 1234)
+        for giorno, distanza in ((1, 10000.0), (3, 21097.0), (2, 5000.0)):
+            _attivita(self.profilo, giorno, datetime(2025, 3, giorno, 7, 0), distanza=distanza, durata=3600, fc_media=150)
+        _attivita(_crea_atleta('altro', 5678), 99, datetime(2025, 3, 4, 7, 0))
+        self.client.force_login(self.profilo.user)
+
+    def _scarica(self, **params):
+        risposta = self.client.get(reverse('export_csv'), params)
+        self.assertIsInstance(risposta, StreamingHttpResponse)
+        return risposta, b''.join(risposta.streaming_content)
+
+    def test_csv_in_streaming(self):
+        risposta, contenuto = self._scarica()
+        self.assertEqual(risposta['Content-Type'], 'text/csv')
+        self.assertEqual(risposta['Content-Disposition'], 'attachment; filename="attivita_barilla_monitor.csv"')
+        righe = list(csv.reader(io.StringIO(contenuto.decode('utf-8'))))
+        self.assertEqual(righe[0][:3], ['Data', 'Tipo', 'Distanza (km)'])
+        # Solo le attività dell'atleta, dalla più recente
+        self.assertEqual([r[:3] for r in righe[1:]], [
+            ['03/03/2025', 'Run', '21.1'], ['02/03/2025', 'Run', '5.0'], ['01/03/2025', 'Run', '10.0'],
+        ])
+        self.assertEqual(righe[1][3], '60.0')
+
+    def test_gzip_dello_stesso_csv(self):
+        _, csv_semplice = self._scarica()
+        risposta, compresso = self._scarica(formato='gz')
+        self.assertEqual(risposta['Content-Type'], 'application/gzip')
+        self.assertEqual(risposta['Content-Disposition'], 'attachment; filename="attivita_barilla_monitor.csv.gz"')
+        self.assertEqual(gzip.decompress(compresso), csv_semplice)
+
+    def test_gzip_a_piu_blocchi(self):
+        righe = [f"riga {i},{i * 3}\r\n" for i in range(500)]
+        pezzi = list(_comprimi_gzip(iter(righe), blocco=100))
+        self.assertGreater(len(pezzi), 1)
+        self.assertEqual(gzip.decompress(b''.join(pezzi)).decode('utf-8'), ''.join(righe))
+
+
+@override_settings(LOG_BUFFER_ASINCRONO=False)
+class RiepilogoAttivitaTest(TestCase):
+    """Le liste basate su riepilogo() non leggono parziali, zone cardiache e analisi AI"""
+
+    def setUp(self):
+        self.profilo = _crea_atleta('runner', 1234)
+        self.profilo.user.is_staff = True
+        self.profilo.user.save()
+        pesanti = {'parziali': [{'split': i} for i in range(40)], 'zone_cardiache': {'z2': 1800}, 'analisi_tecnica_ai': 'Analisi ' * 500}
+        for giorno in range(1, 8):
+            _attivita(self.profilo, giorno, datetime(2025, 3, giorno, 7, 0), nome=f"Gara {giorno}", workout_type=1, fc_media=150, **pesanti)
+        self.client.force_login(self.profilo.user)
+
+    def test_liste_senza_colonne_pesanti(self):
+        # Dashboard (tabella ultime attività) e pagina gare
+        for nome_url, atteso in (('home', 'https://www.strava.com/activities/7'), ('gare_atleta', 'Gara 7')):
+            with self.subTest(vista=nome_url), CaptureQueriesContext(connection) as query:
+                risposta = self.client.get(reverse(nome_url))
+            self.assertContains(risposta, atteso)
+            lette = [q['sql'] for q in query.captured_queries if any(campo in q['sql'] for campo in ('parziali', 'zone_cardiache', 'analisi_tecnica_ai'))]
+            self.assertEqual(lette, [])
+
+
+@override_settings(LOG_BUFFER_ASINCRONO=True, LOG_BUFFER_BATCH=3, LOG_BUFFER_INTERVALLO=0.1)
+class LogBufferTest(TransactionTestCase):
+    """Log asincroni: il thread scrive a blocchi e chiudi_log_buffer non perde i record in coda"""
+
+    def setUp(self):
+        # Stato del modulo condiviso dal processo: thread e flag di stop vanno ripristinati
+        def ripristina():
+            log_buffer._stop.clear()
+            log_buffer._thread = None
+        self.addCleanup(ripristina)
+
+    def test_chiusura_scrive_tutti_i_log(self):
+        user = User.objects.create(username='runner')
+        for i in range(10):
+            log_buffer.registra_log(azione='Test Buffer', messaggio=f"Log {i}", utente=user)
+        thread = log_buffer._thread
+        self.assertTrue(thread.is_alive())
+
+        log_buffer.chiudi_log_buffer(timeout=5)
+        self.assertFalse(thread.is_alive())
+        log = LogSistema.objects.filter(azione='Test Buffer')
+        self.assertEqual(sorted(log.values_list('messaggio', flat=True)), sorted(f"Log {i}" for i in range(10)))
+        self.assertEqual(set(log.values_list('utente_id', flat=True)), {user.id})
+
+        # Dopo la chiusura i log vengono scritti in linea
+        log_buffer.registra_log(azione='Test Buffer', messaggio="Dopo la chiusura")
+        self.assertTrue(LogSistema.objects.filter(messaggio="Dopo la chiusura").exists())
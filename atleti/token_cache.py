@@ -0,0 +1,98 @@
+"""
+Cache degli access token Strava per utente.
+token_valido restituisce il token senza toccare il DB finché è lontano dalla scadenza: prima la memoria del
+processo, poi la cache di Django condivisa. Vicino alla scadenza il rinnovo è single-flight: un lock per
+utente nel processo e, tra processi, il lock sulla riga del SocialToken (select_for_update), così worker
+concorrenti non rinnovano due volte lo stesso refresh token (Strava lo ruota): chi aspetta il lock rilegge
+il token già rinnovato. Il DB viene scritto solo quando il token cambia davvero (refresh_strava_token).
+"""
+import threading
+import time
+from datetime import datetime
+
+from allauth.socialaccount.models import SocialToken
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from .utils import refresh_strava_token
+
+_locale = {}  # user_id -> (token, scadenza epoch)
+_lock_utenti = {}
+_lock = threading.Lock()
+
+
+def _chiave(user_id):
+    return f"strava_token:{user_id}"
+
+
+def _epoch(expires_at):
+    if expires_at is None:
+        return 0
+    if isinstance(expires_at, datetime) and timezone.is_naive(expires_at):
+        return time.mktime(expires_at.timetuple())
+    return expires_at.timestamp()
+
+
+def _lock_utente(user_id):
+    with _lock:
+        return _lock_utenti.setdefault(user_id, threading.Lock())
+
+
+def _memorizza(user_id, token, scadenza):
+    _locale[user_id] = (token, scadenza)
+    ttl = int(scadenza - time.time())
+    if ttl > 0:
+        cache.set(_chiave(user_id), (token, scadenza), ttl)
+
+
+def _in_cache(user_id, margine, rifiutato):
+    """Token memorizzato ancora valido per almeno `margine` secondi (e diverso da quello rifiutato da Strava)."""
+    # La cache condivisa si legge solo se la memoria del processo non basta
+    for leggi in (lambda: _locale.get(user_id), lambda: cache.get(_chiave(user_id))):
+        valore = leggi()
+        if valore and valore[0] != rifiutato and valore[1] > time.time() + margine:
+            _locale[user_id] = valore
+            return valore[0]
+    return None
+
+
+def _rinnova(user_id, buffer_minutes, rifiutato):
+    with transaction.atomic():
+        # Lock sulla sola riga del token: un altro processo che sta rinnovando ci fa aspettare il suo commit
+        token_obj = SocialToken.objects.select_for_update(of=('self',)).select_related('app', 'account__user').filter(
+            account__user_id=user_id, account__provider='strava'
+        ).first()
+        if not token_obj:
+            invalida_token(user_id)
+            return None
+        # Un altro processo ha già ruotato il token rifiutato: basta quello nuovo
+        force = rifiutato is not None and token_obj.token == rifiutato
+        token = refresh_strava_token(token_obj, buffer_minutes=buffer_minutes, force=force)
+    if token:
+        _memorizza(user_id, token, _epoch(token_obj.expires_at))
+    return token
+
+
+def token_valido(user_id, buffer_minutes=10, rifiutato=None):
+    """
+    Access token Strava valido per almeno buffer_minutes, o None (token assente o rinnovo fallito).
+    rifiutato: token appena respinto da Strava con 401; si rinnova solo se nessuno l'ha già sostituito.
+    """
+    margine = buffer_minutes * 60
+    token = _in_cache(user_id, margine, rifiutato)
+    if token:
+        return token
+
+    with _lock_utente(user_id):
+        # Nel frattempo un altro thread può averlo rinnovato
+        token = _in_cache(user_id, margine, rifiutato)
+        if token:
+            return token
+        return _rinnova(user_id, buffer_minutes, rifiutato)
+
+
+def invalida_token(user_id):
+    """Da chiamare quando il token viene rimosso o revocato."""
+    _locale.pop(user_id, None)
+    cache.delete(_chiave(user_id))
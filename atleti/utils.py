@@ -1,13 +1,22 @@
 from google import genai
 import json
 import re
-import requests
 import os
-from .models import Attivita, ProfiloAtleta, LogSistema
+from concurrent.futures import ThreadPoolExecutor
+from .models import Attivita, ProfiloAtleta
+from .log_buffer import registra_log
 from django.utils import timezone
 from datetime import timedelta
+from django.conf import settings
+from django.db import close_old_connections, transaction
 from django.db.models import Sum, Max, Q, Avg
 from allauth.socialaccount.models import SocialApp
+from . import rate_limit, strava_client
+from .streams import ottieni_stream
+from .vectorized import calcola_vam_vettoriale, calcola_vo2max_vettoriale
+from .aggregati import aggiorna_aggregati
+from .snapshot import invalida_snapshot_coach
+from .finestra_vo2max import aggiorna_finestra_vo2max, finestra_atleta, media as media_vo2max
 
 
 def formatta_passo(velocita_ms):
@@ -31,11 +40,11 @@ def refresh_strava_token(token_obj, buffer_minutes=10, force=False):
         return token_obj.token
 
     if not token_obj.token_secret:
-        LogSistema.objects.create(livello='ERROR', azione='Token Refresh', utente=token_obj.account.user, messaggio="Refresh Token mancante. Necessario nuovo login.")
+        registra_log(livello='ERROR', azione='Token Refresh', utente=token_obj.account.user, messaggio="Refresh Token mancante. Necessario nuovo login.")
         return None
 
     msg = "Token scaduto. Tento rinnovo..." if not force else "Refresh Forzato (Recovery 401)..."
-    LogSistema.objects.create(livello='INFO', azione='Token Refresh', utente=token_obj.account.user, messaggio=msg)
+    registra_log(livello='INFO', azione='Token Refresh', utente=token_obj.account.user, messaggio=msg)
     
     try:
         # Recuperiamo le credenziali dell'app
@@ -49,7 +58,7 @@ def refresh_strava_token(token_obj, buffer_minutes=10, force=False):
                 token_obj.save()
         
         if not app:
-            LogSistema.objects.create(livello='ERROR', azione='Token Refresh', utente=token_obj.account.user, messaggio="App Strava non trovata. Impossibile rinnovare il token.")
+            registra_log(livello='ERROR', azione='Token Refresh', utente=token_obj.account.user, messaggio="App Strava non trovata. Impossibile rinnovare il token.")
             return None
         
         data = {
@@ -59,7 +68,7 @@ def refresh_strava_token(token_obj, buffer_minutes=10, force=False):
             'refresh_token': token_obj.token_secret, 
         }
         
-        response = requests.post('https://www.strava.com/oauth/token', data=data, timeout=10)
+        response = strava_client.post(strava_client.URL_TOKEN, data=data, timeout=10)
         
         if response.status_code == 200:
             new_data = response.json()
@@ -70,93 +79,81 @@ def refresh_strava_token(token_obj, buffer_minutes=10, force=False):
             
             # Logghiamo eventuali info sugli scope per debug
             scopes = new_data.get('scope', 'N/A')
-            LogSistema.objects.create(livello='INFO', azione='Token Refresh', utente=token_obj.account.user, messaggio=f"Token Strava rinnovato. Scopes: {scopes}")
+            registra_log(livello='INFO', azione='Token Refresh', utente=token_obj.account.user, messaggio=f"Token Strava rinnovato. Scopes: {scopes}")
             return token_obj.token
         else:
-            LogSistema.objects.create(livello='ERROR', azione='Token Refresh', utente=token_obj.account.user, messaggio=f"ERRORE Refresh: {response.text}")
+            registra_log(livello='ERROR', azione='Token Refresh', utente=token_obj.account.user, messaggio=f"ERRORE Refresh: {response.text}")
             return None
     except Exception as e:
-        LogSistema.objects.create(livello='ERROR', azione='Token Refresh', utente=token_obj.account.user, messaggio=f"Eccezione: {e}")
+        registra_log(livello='ERROR', azione='Token Refresh', utente=token_obj.account.user, messaggio=f"Eccezione: {e}")
         return None
 
-def calcola_vam_selettiva(activity_id, access_token):
+def calcola_vam_selettiva(activity_id, access_token, priorita=rate_limit.BACKGROUND):
     """
-    Scarica gli stream dell'attività da Strava e calcola la VAM
-    solo sui tratti con pendenza > 7%.
+    Calcola la VAM solo sui tratti con pendenza > 7%.
+    Gli stream vengono letti dall'archivio locale e scaricati da Strava solo se mancanti.
     """
-    url = f"https://www.strava.com/api/v3/activities/{activity_id}/streams"
-    params = {
-        'keys': 'grade_smooth,altitude,time',
-        'key_by_type': 'true'
-    }
-    headers = {'Authorization': f'Bearer {access_token}'}
-    
+    stream = ottieni_stream(activity_id, access_token, priorita)
+    if stream is None:
+        return None
+
+    if 'grade_smooth' not in stream or 'altitude' not in stream or 'time' not in stream:
+        return None
+
     try:
-        response = requests.get(url, headers=headers, params=params, timeout=15)
-        
-        if response.status_code == 429:
-            LogSistema.objects.create(livello='WARNING', azione='Calcolo VAM', messaggio=f"Rate Limit Strava raggiunto (ID: {activity_id})")
-            return None
-            
-        if response.status_code != 200:
-            LogSistema.objects.create(livello='ERROR', azione='Calcolo VAM', messaggio=f"Errore streams ({response.status_code}) per ID {activity_id}")
-            return None
+        vam, _ = calcola_vam_vettoriale(stream['grade_smooth'], stream['altitude'], stream['time'])
+        return vam
+    except Exception as e:
+        registra_log(livello='ERROR', azione='Calcolo VAM', messaggio=f"Eccezione ID {activity_id}: {e}")
+        return None
+
+def calcola_vam_da_stream(grades, altitudes, times):
+    """
+    VAM selettiva (m/h) dagli stream pendenza/altitudine/tempo, senza chiamate di rete.
+    Conta solo i segmenti con pendenza > 7% durati almeno 10 minuti.
+    Versione scalare di riferimento: in produzione si usa calcola_vam_vettoriale (atleti/vectorized.py).
+    """
+    total_gain = 0
+    total_time = 0
+    
+    # Variabili per il segmento corrente
+    current_gain = 0
+    current_time = 0
+    
+    # Iteriamo sui punti. Assumiamo che le liste siano allineate.
+    # Partiamo da 1 perché serve il delta rispetto al precedente.
+    for i in range(1, len(grades)):
+        # Filtro: Pendenza > 7% (Mastra-Logic: Solo salite vere)
+        if grades[i] > 7.0:
+            delta_h = altitudes[i] - altitudes[i-1]
+            delta_t = times[i] - times[i-1]
             
-        data = response.json()
-        
-        if 'grade_smooth' not in data or 'altitude' not in data or 'time' not in data:
-            return None
+            # Sommiamo solo se c'è guadagno positivo e tempo positivo
+            if delta_h > 0 and delta_t > 0:
+                current_gain += delta_h
+                current_time += delta_t
+        else:
+            # Il segmento si è interrotto (pendenza scesa sotto il 7%)
+            # Commit del segmento SOLO se è durato più di 10 minuti (600s)
+            # Questo evita che "strappi" brevi falsino la VAM media su lunghe distanze.
+            if current_time >= 600:
+                total_gain += current_gain
+                total_time += current_time
             
-        grades = data['grade_smooth']['data']
-        altitudes = data['altitude']['data']
-        times = data['time']['data']
-        
-        total_gain = 0
-        total_time = 0
-        
-        # Variabili per il segmento corrente
-        current_gain = 0
-        current_time = 0
-        
-        # Iteriamo sui punti. Assumiamo che le liste siano allineate.
-        # Partiamo da 1 perché serve il delta rispetto al precedente.
-        for i in range(1, len(grades)):
-            # Filtro: Pendenza > 7% (Mastra-Logic: Solo salite vere)
-            if grades[i] > 7.0:
-                delta_h = altitudes[i] - altitudes[i-1]
-                delta_t = times[i] - times[i-1]
-                
-                # Sommiamo solo se c'è guadagno positivo e tempo positivo
-                if delta_h > 0 and delta_t > 0:
-                    current_gain += delta_h
-                    current_time += delta_t
-            else:
-                # Il segmento si è interrotto (pendenza scesa sotto il 7%)
-                # Commit del segmento SOLO se è durato più di 10 minuti (600s)
-                # Questo evita che "strappi" brevi falsino la VAM media su lunghe distanze.
-                if current_time >= 600:
-                    total_gain += current_gain
-                    total_time += current_time
+            # Reset del segmento corrente
+            current_gain = 0
+            current_time = 0
+    
+    # Controllo finale se l'attività finisce durante una salita valida
+    if current_time >= 600:
+        total_gain += current_gain
+        total_time += current_time
                 
-                # Reset del segmento corrente
-                current_gain = 0
-                current_time = 0
-        
-        # Controllo finale se l'attività finisce durante una salita valida
-        if current_time >= 600:
-            total_gain += current_gain
-            total_time += current_time
-                    
-        if total_time > 0:
-            # VAM = (Metri / Secondi) * 3600 -> Metri/Ora
-            vam = (total_gain / total_time) * 3600
-            return round(vam, 1)
-            
-        return 0
-        
-    except Exception as e:
-        LogSistema.objects.create(livello='ERROR', azione='Calcolo VAM', messaggio=f"Eccezione ID {activity_id}: {e}")
-        return None
+    if total_time > 0:
+        # VAM = (Metri / Secondi) * 3600 -> Metri/Ora
+        vam = (total_gain / total_time) * 3600
+        return round(vam, 1)
+    return 0
 
 def calcola_vo2max_effettivo(attivita, profilo):
     """
@@ -364,41 +361,48 @@ def calcola_metrica_vo2max(attivita, profilo):
         print(f"Errore calcolo matematico: {e}", flush=True)
         return None
 
-def stima_vo2max_atleta(profilo):
+def ricalcola_vo2max_atleta(profilo):
     """
-    Analizza lo storico delle attività per calcolare un VO2max consolidato (Media Mobile).
-    Scarta gli outlier e stabilizza il dato.
+    Ricalcola il VO2max di tutte le attività dell'atleta in blocco (versione vettoriale di
+    calcola_metrica_vo2max, senza log per riga) e salva solo le righe cambiate con bulk_update.
+    Restituisce (attività aggiornate, di cui rimosse perché ora escluse).
     """
-    # 1. Stima Statistica (Trail + Strada) - Ultime 60 attività valide (Stagionale)
-    sessioni_all = Attivita.objects.filter(
-        atleta=profilo, 
-        vo2max_stimato__isnull=False
-    ).order_by('-data')[:60]
-
-    media_vo2_all = None
-    if sessioni_all and len(sessioni_all) >= 3:
-        valori_all = [s.vo2max_stimato for s in sessioni_all]
-        media_vo2_all = sum(valori_all) / len(valori_all)
-
-    # 2. VO2max Solo Strada - Ultime 60 attività SOLO 'Run'
-    sessioni_strada = Attivita.objects.filter(
-        atleta=profilo,
-        tipo_attivita='Run',
-        vo2max_stimato__isnull=False
-    ).order_by('-data')[:60]
-
-    if sessioni_strada and len(sessioni_strada) >= 3:
-        valori_strada = [s.vo2max_stimato for s in sessioni_strada]
-        media_vo2_strada = sum(valori_strada) / len(valori_strada)
-        profilo.vo2max_strada = round(media_vo2_strada, 1)
-    else:
-        profilo.vo2max_strada = None
+    righe = list(
+        Attivita.objects.filter(atleta=profilo, distanza__gt=0, durata__gt=0)
+        .values_list('id', 'data', 'vo2max_stimato', 'distanza', 'durata', 'fc_media', 'dislivello', 'tipo_attivita', 'gap_passo', 'fc_max_sessione')
+    )
+    if not righe:
+        return 0, 0
+
+    ids, date_attivita, vecchi, distanza, durata, fc_media, dislivello, tipi, gap_passo, fc_max_sessione = zip(*righe)
+    nuovi = calcola_vo2max_vettoriale(
+        distanza, durata, fc_media, dislivello,
+        is_trail=[t == 'TrailRun' for t in tipi],
+        gap_passo=gap_passo,
+        fc_max_sessione=fc_max_sessione,
+        hr_max=profilo.fc_massima_teorica,
+        hr_rest=profilo.fc_riposo,
+        indice_itra=profilo.indice_itra,
+        vo2max_statistico=profilo.vo2max_stima_statistica,
+    )
 
-    if media_vo2_all:
-        profilo.vo2max_stima_statistica = round(media_vo2_all, 1)
-    else:
-        profilo.vo2max_stima_statistica = None
+    cambiate = [(i, d, nuovo) for i, d, vecchio, nuovo in zip(ids, date_attivita, vecchi, nuovi) if vecchio != nuovo]
+    if cambiate:
+        Attivita.objects.bulk_update([Attivita(pk=i, vo2max_stimato=nuovo) for i, _, nuovo in cambiate], ['vo2max_stimato'], batch_size=500)
+        # bulk_update non invia segnali: i trend degli snapshot coach dipendono dal VO2max
+        invalida_snapshot_coach(*[d for _, d, _ in cambiate])
+        tipo_per_id = dict(zip(ids, tipi))
+        aggiorna_finestra_vo2max(profilo.id, [(i, d, nuovo, tipo_per_id[i]) for i, d, nuovo in cambiate])
+    return len(cambiate), sum(1 for _, _, nuovo in cambiate if nuovo is None)
 
+def stima_vo2max_atleta(profilo):
+    """
+    Aggiorna sul profilo il VO2max consolidato (media mobile delle ultime 60 attività valide, tutte e solo strada).
+    Le medie vengono dalla FinestraVO2max, mantenuta a ogni modifica delle attività: nessuna rilettura dello storico.
+    """
+    finestra = finestra_atleta(profilo.id)
+    profilo.vo2max_stima_statistica = media_vo2max(finestra.tutte)
+    profilo.vo2max_strada = media_vo2max(finestra.strada)
     profilo.save()
     
     print(f"DEBUG: VO2max Aggiornato -> Statistica: {profilo.vo2max_stima_statistica}, Strada: {profilo.vo2max_strada}", flush=True)
@@ -410,12 +414,17 @@ def calcola_trend_atleta(profilo, cutoff_date=None):
     Restituisce un dizionario con le variazioni per ogni metrica.
     """
     # Prendiamo le ultime 20 attività per avere un campione significativo
-    qs = Attivita.objects.filter(atleta=profilo)
+    qs = Attivita.objects.riepilogo().filter(atleta=profilo)
     if cutoff_date:
         qs = qs.filter(data__lt=cutoff_date)
     qs = qs.order_by('-data')[:20]
-    activities = list(qs)
-    
+    return calcola_trend_da_attivita(list(qs))
+
+def calcola_trend_da_attivita(activities):
+    """
+    Trend su una lista di attività già caricata (dalla più recente), senza query.
+    Usata anche dal calcolo batch della dashboard coach.
+    """
     if len(activities) < 5:
         return {} # Dati insufficienti per un trend
 
@@ -509,11 +518,13 @@ def stima_potenziale_gara(profilo):
     if not qs.exists():
         return "Non Classificato"
         
-    totale_km = qs.aggregate(Sum('distanza'))['distanza__sum'] or 0
-    avg_weekly_km = (totale_km / 1000) / (45/7)
-    
-    lungo_max = qs.aggregate(Max('distanza'))['distanza__max'] or 0
-    lungo_max_km = lungo_max / 1000
+    agg = qs.aggregate(Sum('distanza'), Max('distanza'))
+    return classifica_potenziale_gara(agg['distanza__sum'] or 0, agg['distanza__max'] or 0)
+
+def classifica_potenziale_gara(totale_metri, lungo_max_metri):
+    """Classificazione del potenziale gara dai totali degli ultimi 45 giorni (metri)."""
+    avg_weekly_km = (totale_metri / 1000) / (45/7)
+    lungo_max_km = lungo_max_metri / 1000
     
     # Logica di Classificazione (Volume + Lungo)
     if avg_weekly_km >= 60 and lungo_max_km >= 28:
@@ -595,7 +606,7 @@ def analizza_performance_atleta(profilo):
         start_date = current_week_start - timedelta(weeks=i)
         end_date = start_date + timedelta(days=7)
         
-        qs = Attivita.objects.filter(atleta=profilo, data__gte=start_date, data__lt=end_date)
+        qs = Attivita.objects.riepilogo().filter(atleta=profilo, data__gte=start_date, data__lt=end_date)
         
         if qs.exists():
             dist = qs.aggregate(Sum('distanza'))['distanza__sum'] / 1000
@@ -610,7 +621,7 @@ def analizza_performance_atleta(profilo):
             weeks_summary.append(f"- Settimana -{i}: Nessuna attività.")
 
     # 2. Dettaglio Ultime 5 Sessioni
-    attivita = Attivita.objects.filter(atleta=profilo).order_by('-data')[:5]
+    attivita = Attivita.objects.riepilogo().filter(atleta=profilo).order_by('-data')[:5]
     storico_testo = ""
     for act in attivita:
         tipo = "Trail 🏔️" if act.tipo_attivita == "TrailRun" else "Strada 🛣️"
@@ -651,17 +662,8 @@ def analizza_performance_atleta(profilo):
         print(f"DEBUG ERRORE FINALE: {e}")
         return "⚠️ Servizio AI momentaneamente non disponibile. Riprova tra un minuto."
 
-def processa_attivita_strava(act, profilo, access_token, force_detail_update=False):
-    """
-    Logica centralizzata per salvare/aggiornare un'attività Strava nel DB.
-    Restituisce (Attivita, created).
-    """
-    # 0. Filtro Privacy: Ignoriamo attività private SE l'utente non ha abilitato l'import
-    if act.get('private') and not profilo.importa_attivita_private:
-        # Logica di sicurezza: Se l'utente non vuole importare le private, le scartiamo silenziosamente.
-        # Questo previene l'importazione indesiderata se il token ha permessi ampi (activity:read_all).
-        return None, False
-
+def _campi_attivita_strava(act, profilo):
+    """Campi del modello Attivita ricavati dal summary Strava (senza chiamate API)."""
     # 1. Tipo Attività
     strava_sport_type = act.get('sport_type') or act.get('type')
     if strava_sport_type in ['TrailRun', 'Hike']:
@@ -674,26 +676,76 @@ def processa_attivita_strava(act, profilo, access_token, force_detail_update=Fal
     if not watts and profilo.peso:
         watts = stima_potenza_watt(act['distance'], act['moving_time'], act.get('total_elevation_gain', 0), profilo.peso)
 
-    # 3. Salvataggio
+    return {
+        'atleta': profilo,
+        'nome': act.get('name'),
+        'workout_type': act.get('workout_type'),
+        'data': act['start_date'],
+        'distanza': act['distance'],
+        'durata': act['moving_time'],
+        'dislivello': act.get('total_elevation_gain', 0),
+        'fc_media': act.get('average_heartrate'),
+        'fc_max_sessione': act.get('max_heartrate'),
+        'passo_medio': formatta_passo(act.get('average_speed', 0)),
+        'cadenza_media': act.get('average_cadence'),
+        'sforzo_relativo': act.get('suffer_score'),
+        'potenza_media': watts,
+        'gap_passo': act.get('average_grade_adjusted_speed'),
+        'tipo_attivita': tipo_finale,
+    }
+
+def _scarica_dettaglio_attivita(activity_id, access_token, priorita=rate_limit.BACKGROUND):
+    """
+    Scarica il dettaglio attività (dispositivo, parziali). Restituisce il JSON, {} se l'attività
+    non esiste più su Strava (404) o None se non è stato possibile scaricarlo (quota, errori).
+    """
+    if not rate_limit.acquisisci_permesso(priorita):
+        return None
+    try:
+        url_detail = f"https://www.strava.com/api/v3/activities/{activity_id}"
+        # Timeout breve per non bloccare il sync
+        resp_detail = strava_client.get(url_detail, access_token=access_token, timeout=5, priorita=priorita)
+        rate_limit.registra_risposta(resp_detail)
+        if resp_detail.status_code == 200:
+            return resp_detail.json()
+        if resp_detail.status_code == 404:
+            return {}
+    except Exception as e:
+        print(f"Warning: Impossibile recuperare dispositivo per {activity_id}: {e}", flush=True)
+    return None
+
+def _applica_dettaglio(attivita, detail_data):
+    """Copia dal dettaglio Strava i campi assenti nel summary. Restituisce True se ha modificato qualcosa."""
+    modificata = False
+    # Device Name
+    device_name = detail_data.get('device_name')
+    if device_name:
+        attivita.dispositivo = device_name
+        modificata = True
+
+    # Splits (Parziali)
+    splits = detail_data.get('splits_metric')
+    if splits:
+        attivita.parziali = splits
+        modificata = True
+    return modificata
+
+def processa_attivita_strava(act, profilo, access_token, force_detail_update=False, priorita=rate_limit.BACKGROUND):
+    """
+    Logica centralizzata per salvare/aggiornare un'attività Strava nel DB.
+    Restituisce (Attivita, created).
+    priorita: priorità delle chiamate extra (stream e dettaglio) sul rate limiter Strava.
+    """
+    # 0. Filtro Privacy: Ignoriamo attività private SE l'utente non ha abilitato l'import
+    if act.get('private') and not profilo.importa_attivita_private:
+        # Logica di sicurezza: Se l'utente non vuole importare le private, le scartiamo silenziosamente.
+        # Questo previene l'importazione indesiderata se il token ha permessi ampi (activity:read_all).
+        return None, False
+
+    # 1-3. Campi dal summary e salvataggio
     nuova_attivita, created = Attivita.objects.update_or_create(
         strava_activity_id=act['id'],
-        defaults={
-            'atleta': profilo,
-            'nome': act.get('name'),
-            'workout_type': act.get('workout_type'),
-            'data': act['start_date'],
-            'distanza': act['distance'],
-            'durata': act['moving_time'],
-            'dislivello': act.get('total_elevation_gain', 0),
-            'fc_media': act.get('average_heartrate'),
-            'fc_max_sessione': act.get('max_heartrate'),
-            'passo_medio': formatta_passo(act.get('average_speed', 0)),
-            'cadenza_media': act.get('average_cadence'),
-            'sforzo_relativo': act.get('suffer_score'),
-            'potenza_media': watts,
-            'gap_passo': act.get('average_grade_adjusted_speed'),
-            'tipo_attivita': tipo_finale,
-        }
+        defaults=_campi_attivita_strava(act, profilo)
     )
     
     # 4. Calcolo VO2max
@@ -705,7 +757,7 @@ def processa_attivita_strava(act, profilo, access_token, force_detail_update=Fal
         if created or nuova_attivita.vam_selettiva is None:
             # Piccola pausa per rate limit se stiamo processando tante attività
             # Ma qui siamo in una funzione singola, la gestione del rate limit massivo va fuori
-            vam_sel = calcola_vam_selettiva(act['id'], access_token)
+            vam_sel = calcola_vam_selettiva(act['id'], access_token, priorita=priorita)
             if vam_sel and vam_sel > 0:
                 nuova_attivita.vam_selettiva = vam_sel
 
@@ -713,35 +765,18 @@ def processa_attivita_strava(act, profilo, access_token, force_detail_update=Fal
     # Il campo 'device_name' è presente solo nel dettaglio attività, non nel summary.
     # Scarichiamo se è nuova OPPURE se forzato (es. Full Sync) e mancano i dati
     should_fetch_detail = created or (force_detail_update and not nuova_attivita.parziali)
-    if should_fetch_detail and access_token:
-        try:
-            url_detail = f"https://www.strava.com/api/v3/activities/{act['id']}"
-            # Timeout breve per non bloccare il sync
-            resp_detail = requests.get(url_detail, headers={'Authorization': f'Bearer {access_token}'}, timeout=5)
-            if resp_detail.status_code == 200:
-                detail_data = resp_detail.json()
-                
-                update_fields = []
-                
-                # Device Name
-                device_name = detail_data.get('device_name')
-                if device_name:
-                    nuova_attivita.dispositivo = device_name
-                    update_fields.append('dispositivo')
-                
-                # Splits (Parziali)
-                splits = detail_data.get('splits_metric')
-                if splits:
-                    nuova_attivita.parziali = splits
-                    update_fields.append('parziali')
-                
-                if update_fields:
-                    nuova_attivita.save(update_fields=update_fields)
-        except Exception as e:
-            print(f"Warning: Impossibile recuperare dispositivo per {act['id']}: {e}", flush=True)
+    detail_data = None
+    if 'splits_metric' in act:
+        # Il payload è già il dettaglio (es. evento webhook): nessuna chiamata aggiuntiva
+        detail_data = act
+    elif should_fetch_detail and access_token:
+        detail_data = _scarica_dettaglio_attivita(act['id'], access_token, priorita)
+
+    if detail_data:
+        _applica_dettaglio(nuova_attivita, detail_data)
 
     if created:
-        LogSistema.objects.create(livello='INFO', azione='Import Attività', utente=profilo.user, messaggio=f"Nuova attività: {nuova_attivita.nome} ({nuova_attivita.tipo_attivita})")
+        registra_log(livello='INFO', azione='Import Attività', utente=profilo.user, messaggio=f"Nuova attività: {nuova_attivita.nome} ({nuova_attivita.tipo_attivita})")
     else:
         # Logghiamo solo se aggiorniamo qualcosa di importante o per debug, qui evito per non intasare se non richiesto
         pass
@@ -749,6 +784,143 @@ def processa_attivita_strava(act, profilo, access_token, force_detail_update=Fal
     nuova_attivita.save()
     return nuova_attivita, created
 
+# Campi aggiornati in caso di conflitto su strava_activity_id (ri-sync di attività già presenti).
+# dispositivo e parziali restano fuori: li aggiorna solo il dettaglio (vedi importa_pagina_attivita).
+CAMPI_UPSERT_ATTIVITA = [
+    'atleta', 'nome', 'workout_type', 'data', 'distanza', 'durata', 'dislivello', 'fc_media', 'fc_max_sessione',
+    'passo_medio', 'cadenza_media', 'sforzo_relativo', 'potenza_media', 'gap_passo', 'tipo_attivita',
+    'vo2max_stimato', 'vam_selettiva',
+]
+
+def _in_thread(func, *args):
+    """Esegue func in un thread del pool chiudendo poi la sua connessione DB (gli stream passano dall'archivio)."""
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+def _prefetch_pagina_strava(da_vam, da_dettaglio, access_token, priorita):
+    """
+    Scarica in parallelo (STRAVA_PREFETCH_WORKERS richieste in volo) la VAM selettiva dagli stream e i dettagli
+    delle attività di una pagina. Ogni richiesta prenota il proprio permesso sul rate limiter condiviso:
+    il tempo totale dipende dalla quota, non dalla latenza delle singole chiamate.
+    Restituisce ({strava_id: vam}, {strava_id: dettaglio JSON}); chi non è stato scaricato manca.
+    """
+    if not da_vam and not da_dettaglio:
+        return {}, {}
+    with ThreadPoolExecutor(max_workers=settings.STRAVA_PREFETCH_WORKERS, thread_name_prefix='strava-prefetch') as pool:
+        futures_vam = {sid: pool.submit(_in_thread, calcola_vam_selettiva, sid, access_token, priorita) for sid in da_vam}
+        futures_dettaglio = {sid: pool.submit(_in_thread, _scarica_dettaglio_attivita, sid, access_token, priorita) for sid in da_dettaglio}
+        vam = {sid: f.result() for sid, f in futures_vam.items()}
+        dettagli = {sid: f.result() for sid, f in futures_dettaglio.items()}
+    return vam, dettagli
+
+def importa_pagina_attivita(activities, profilo, access_token, force_detail_update=False, priorita=rate_limit.BACKGROUND, dettagli_mancanti=None):
+    """
+    Versione batch di processa_attivita_strava per una pagina di summary Strava.
+    Calcola in memoria i campi derivati e scrive con un solo bulk_create(update_conflicts=True),
+    più un bulk_update per i dettagli delle attività già presenti e un bulk_create dei log:
+    il costo in query scala con le pagine, non con le righe. Dettagli e stream mancanti vengono
+    scaricati in parallelo prima della scrittura (_prefetch_pagina_strava).
+    dettagli_mancanti: lista opzionale a cui aggiungere gli ID il cui dettaglio non è stato scaricato (es. quota).
+    Restituisce la lista degli ID Strava delle attività nuove.
+    """
+    # Filtro tipo e privacy (stessa logica di processa_attivita_strava)
+    validi = {}
+    for act in activities:
+        if act.get('type') not in ['Run', 'TrailRun', 'Hike']:
+            continue
+        if act.get('private') and not profilo.importa_attivita_private:
+            continue
+        validi[act['id']] = act
+    if not validi:
+        return []
+
+    # Un'unica query per sapere cosa abbiamo già
+    esistenti = {
+        row['strava_activity_id']: row
+        for row in Attivita.objects.filter(strava_activity_id__in=list(validi)).values('strava_activity_id', 'vam_selettiva', 'parziali', 'data')
+    }
+
+    oggetti = []
+    nuove = []
+    da_vam = []
+    da_dettaglio = []
+    for strava_id, act in validi.items():
+        attivita = Attivita(strava_activity_id=strava_id, **_campi_attivita_strava(act, profilo))
+        esistente = esistenti.get(strava_id)
+        created = esistente is None
+
+        attivita.vo2max_stimato = calcola_metrica_vo2max(attivita, profilo)
+
+        # VAM Selettiva: conserviamo quella già calcolata, la scarichiamo solo se manca
+        attivita.vam_selettiva = esistente['vam_selettiva'] if esistente else None
+        if attivita.tipo_attivita == 'TrailRun' and attivita.dislivello > 150 and attivita.vam_selettiva is None:
+            da_vam.append(strava_id)
+
+        # Dettaglio (dispositivo e parziali): nuove, oppure forzato e mancano i dati
+        if access_token and (created or (force_detail_update and not esistente['parziali'])):
+            da_dettaglio.append(strava_id)
+
+        if created:
+            nuove.append(attivita)
+        oggetti.append(attivita)
+
+    # Stream e dettagli della pagina scaricati in parallelo, poi applicati in memoria
+    vam_scaricate, dettagli = _prefetch_pagina_strava(da_vam, da_dettaglio, access_token, priorita)
+    if dettagli_mancanti is not None:
+        dettagli_mancanti.extend(sid for sid in da_dettaglio if dettagli.get(sid) is None)
+    dettagli_esistenti = []
+    for attivita in oggetti:
+        strava_id = attivita.strava_activity_id
+        vam_sel = vam_scaricate.get(strava_id)
+        if vam_sel and vam_sel > 0:
+            attivita.vam_selettiva = vam_sel
+        detail_data = dettagli.get(strava_id)
+        if detail_data and _applica_dettaglio(attivita, detail_data) and strava_id in esistenti:
+            dettagli_esistenti.append(attivita)
+
+    with transaction.atomic():
+        Attivita.objects.bulk_create(
+            oggetti,
+            update_conflicts=True,
+            unique_fields=['strava_activity_id'],
+            update_fields=CAMPI_UPSERT_ATTIVITA,
+        )
+        if dettagli_esistenti:
+            # Le istanze non hanno la PK: aggiorniamo per strava_activity_id
+            pk_map = dict(Attivita.objects.filter(strava_activity_id__in=[a.strava_activity_id for a in dettagli_esistenti]).values_list('strava_activity_id', 'id'))
+            for attivita in dettagli_esistenti:
+                attivita.pk = pk_map.get(attivita.strava_activity_id)
+            Attivita.objects.bulk_update([a for a in dettagli_esistenti if a.pk], ['dispositivo', 'parziali'])
+
+        # bulk_create non invia segnali: aggiorniamo noi i rollup dei periodi toccati (date nuove e vecchie)
+        # e invalidiamo gli snapshot coach delle settimane chiuse coinvolte
+        aggiorna_aggregati(profilo.id, [a.data for a in oggetti] + [e['data'] for e in esistenti.values()])
+        invalida_snapshot_coach(*[a.data for a in oggetti])
+        aggiorna_finestra_vo2max(profilo.id, [(a.pk, a.data, a.vo2max_stimato, a.tipo_attivita) for a in oggetti])
+
+        for a in nuove:
+            registra_log(livello='INFO', azione='Import Attività', utente=profilo.user, messaggio=f"Nuova attività: {a.nome} ({a.tipo_attivita})")
+
+    return [a.strava_activity_id for a in nuove]
+
+def completa_dettagli_attivita(strava_ids, access_token, priorita=rate_limit.BACKGROUND):
+    """
+    Scarica (in parallelo) e salva dispositivo e parziali di attività già importate senza dettaglio.
+    Restituisce gli ID gestiti (dettaglio scaricato o attività non più su Strava): gli altri vanno ritentati.
+    """
+    _, dettagli = _prefetch_pagina_strava([], list(strava_ids), access_token, priorita)
+    gestiti = [sid for sid, d in dettagli.items() if d is not None]
+    dettagli = {sid: d for sid, d in dettagli.items() if d}
+    if dettagli:
+        aggiornate = []
+        for attivita in Attivita.objects.filter(strava_activity_id__in=list(dettagli)).only('id', 'strava_activity_id'):
+            if _applica_dettaglio(attivita, dettagli[attivita.strava_activity_id]):
+                aggiornate.append(attivita)
+        Attivita.objects.bulk_update(aggiornate, ['dispositivo', 'parziali'])
+    return gestiti
+
 def fix_strava_duplicates():
     """
     Rileva e rimuove configurazioni Strava duplicate che causano errori 500.
@@ -939,7 +1111,7 @@ def analizza_gare_atleta(profilo):
     client = genai.Client(api_key=api_key)
     
     # Recuperiamo le gare in ordine cronologico
-    gare = Attivita.objects.filter(atleta=profilo, workout_type=1).order_by('data')
+    gare = Attivita.objects.riepilogo().filter(atleta=profilo, workout_type=1).order_by('data')
     
     if not gare.exists():
         return "Non hai ancora registrato gare. Tagga le tue attività come 'Gara' su Strava per ricevere un'analisi."
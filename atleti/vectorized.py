@@ -0,0 +1,138 @@
+"""
+Implementazioni vettoriali (NumPy) dei calcoli su stream e attività.
+Le versioni scalari di riferimento restano in utils.py: i test di parità in tests.py le confrontano.
+"""
+import numpy as np
+
+SOGLIA_PENDENZA_VAM = 7.0  # % (Mastra-Logic: Solo salite vere)
+DURATA_MINIMA_SALITA = 600  # s: gli strappi brevi non contano
+
+
+def segmenti_salita(grades, altitudes, times, soglia_pendenza=SOGLIA_PENDENZA_VAM, durata_minima=DURATA_MINIMA_SALITA):
+    """
+    Individua le salite valide con maschere e run-length, senza loop sui campioni.
+    Stessa logica di calcola_vam_da_stream: un segmento è una sequenza di punti con pendenza > soglia,
+    somma solo i delta con guadagno e tempo positivi ed è valido se dura almeno durata_minima secondi.
+    Restituisce una lista di dict (indici e tempi di inizio/fine, dislivello, durata, vam).
+    """
+    grades = np.asarray(grades, dtype=np.float64)
+    altitudes = np.asarray(altitudes, dtype=np.float64)
+    times = np.asarray(times, dtype=np.float64)
+
+    n = min(len(grades), len(altitudes), len(times))
+    if n < 2:
+        return []
+    grades, altitudes, times = grades[:n], altitudes[:n], times[:n]
+
+    # Il delta i-esimo va dal punto i al punto i+1 e appartiene alla salita se la pendenza del punto i+1 supera la soglia
+    delta_h = np.diff(altitudes)
+    delta_t = np.diff(times)
+    in_salita = grades[1:] > soglia_pendenza
+    utile = in_salita & (delta_h > 0) & (delta_t > 0)
+
+    # Run-length: fronti di salita/discesa della maschera
+    fronti = np.flatnonzero(np.diff(np.concatenate(([0], in_salita.view(np.int8), [0]))))
+    inizi, fini = fronti[0::2], fronti[1::2]  # fini esclusivi
+    if len(inizi) == 0:
+        return []
+
+    guadagni = np.add.reduceat(np.where(utile, delta_h, 0.0), inizi)
+    durate = np.add.reduceat(np.where(utile, delta_t, 0.0), inizi)
+
+    validi = durate >= durata_minima
+    return [
+        {
+            'inizio_idx': int(i),
+            'fine_idx': int(f),
+            'inizio_s': float(times[i]),
+            'fine_s': float(times[f]),
+            'dislivello': float(g),
+            'durata': float(d),
+            'vam': round(g / d * 3600, 1),
+        }
+        for i, f, g, d in zip(inizi[validi], fini[validi], guadagni[validi], durate[validi])
+    ]
+
+
+def calcola_vam_vettoriale(grades, altitudes, times):
+    """
+    VAM selettiva (m/h) e dettaglio delle salite. Restituisce (vam, segmenti).
+    vam è 0 se non ci sono salite valide, come nella versione scalare.
+    """
+    segmenti = segmenti_salita(grades, altitudes, times)
+    # Somma sequenziale (come la versione scalare) per avere lo stesso arrotondamento
+    total_gain = sum(s['dislivello'] for s in segmenti)
+    total_time = sum(s['durata'] for s in segmenti)
+    if total_time > 0:
+        return round(total_gain / total_time * 3600, 1), segmenti
+    return 0, segmenti
+
+
+def _colonna(valori, vuoto=np.nan):
+    """Lista con eventuali None -> array float64 (None e 0 diventano `vuoto`, come i test di verità Python)."""
+    return np.array([v if v else vuoto for v in valori], dtype=np.float64)
+
+
+def calcola_vo2max_vettoriale(distanza, durata, fc_media, dislivello, is_trail, gap_passo, fc_max_sessione,
+                              hr_max, hr_rest, indice_itra=0, vo2max_statistico=None):
+    """
+    VO2max di un blocco di attività dello stesso atleta, con le stesse regole di calcola_metrica_vo2max
+    (filtro passo lento, trail/strada, Karvonen, penalità efficienza, tetto ITRA, auto-detect ripetute).
+    Le operazioni sono nello stesso ordine della versione scalare, quindi i risultati coincidono.
+    Restituisce una lista di float arrotondati a 2 decimali o None (attività esclusa).
+    """
+    n = len(distanza)
+    if n == 0 or not hr_max or not hr_rest or hr_max - hr_rest <= 0:
+        return [None] * n
+
+    distanza = np.asarray(distanza, dtype=np.float64)
+    durata = np.asarray(durata, dtype=np.float64)
+    dislivello = np.asarray(dislivello, dtype=np.float64)
+    is_trail = np.asarray(is_trail, dtype=bool)
+    fc_media = _colonna(fc_media)
+    gap_passo = _colonna(gap_passo)
+    fc_max_sessione = _colonna(fc_max_sessione)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Filtro passo lento (> 9:30 min/km)
+        con_passo = (distanza > 0) & (durata > 0)
+        passo_sec_km = durata / (distanza / 1000)
+        valida = ~(con_passo & (passo_sec_km > 570))
+        valida &= ~np.isnan(fc_media)
+
+        minuti = durata / 60
+        # Trail: 100m D+ = 500m piani. Strada: GAP se disponibile, altrimenti velocità media
+        velocita_eq = (distanza + 5 * dislivello) / minuti
+        velocita_m_min = np.where(np.isnan(gap_passo), distanza / minuti, gap_passo * 60)
+        vo2_attivita = np.where(is_trail, 0.2 * velocita_eq + 3.5, 0.2 * velocita_m_min + 3.5)
+        # In Python una divisione per zero fa scartare l'attività
+        valida &= durata != 0
+
+        # Karvonen: sforzo minimo 60% della riserva e durata > 20 min
+        hrr_value = hr_max - hr_rest
+        percent_hrr = (fc_media - hr_rest) / hrr_value
+        valida &= ~((percent_hrr < 0.60) | (durata < 1200))
+        vo2_performance = ((vo2_attivita - 3.5) / percent_hrr) + 3.5
+
+        # Penalità efficienza 5% per passo più lento di 5:15 min/km (solo strada)
+        vo2_performance = np.where(~is_trail & (velocita_m_min < 190.5), vo2_performance * 0.95, vo2_performance)
+
+        # Tetto ITRA
+        if indice_itra and indice_itra > 0:
+            if indice_itra < 500:
+                vo2_performance = np.minimum(vo2_performance, 54.0)
+            elif indice_itra < 600:
+                vo2_performance = np.minimum(vo2_performance, 60.0)
+
+        # Auto-detect ripetute: picco FC alto, forte variabilità e risultato crollato rispetto alla media storica
+        if vo2max_statistico:
+            ha_picco = ~np.isnan(fc_max_sessione)
+            ripetute = (
+                ha_picco
+                & (vo2_performance < vo2max_statistico * 0.88)
+                & (fc_max_sessione - fc_media > 25)
+                & (fc_max_sessione > hr_max * 0.85)
+            )
+            valida &= ~ripetute
+
+    return [round(float(v), 2) if ok else None for v, ok in zip(vo2_performance, valida)]
@@ -1,12 +1,21 @@
-import requests
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponse, JsonResponse, FileResponse, Http404
+from django.http import HttpResponse, JsonResponse, FileResponse, Http404, StreamingHttpResponse
 from django.contrib.auth.decorators import login_required
 from allauth.socialaccount.models import SocialToken ,SocialAccount
 from django.core.cache import cache
 from .models import Attivita, ProfiloAtleta, LogSistema, Scarpa
+from .log_buffer import registra_log
+from . import rate_limit, strava_client
+from .sync import accoda_sincronizzazione, stato_sincronizzazione
+from .aggregati import totali_dashboard, volumi_ytd
+from .coach import analizza_atleti_batch
+from .snapshot import leggi_snapshot_coach, salva_snapshot_coach
+from .log_rollup import log_utente, statistiche_aggregate
+from .scheduler_trigger import notifica_task_manuale
+from .token_cache import invalida_token, token_valido
+from .impronte_strava import applica_modifiche, registra_etag, scarica_atleta, sincronizza_scarpe
 import math
-from .utils import analizza_performance_atleta, calcola_metrica_vo2max, stima_vo2max_atleta, stima_potenza_watt, calcola_trend_atleta, formatta_passo, stima_potenziale_gara, analizza_squadra_coach, calcola_vam_selettiva, refresh_strava_token, processa_attivita_strava, fix_strava_duplicates, normalizza_scarpa, BRAND_LOGOS, analizza_gare_atleta, calcola_vo2max_effettivo, calcola_efficienza, normalizza_dispositivo, genera_commenti_podio_ai, get_atleti_con_statistiche_settimanali, analizza_classifica_settimanale, analizza_confronto_ai
+from .utils import analizza_performance_atleta, calcola_metrica_vo2max, ricalcola_vo2max_atleta, stima_vo2max_atleta, stima_potenza_watt, calcola_trend_atleta, formatta_passo, stima_potenziale_gara, analizza_squadra_coach, calcola_vam_selettiva, processa_attivita_strava, fix_strava_duplicates, normalizza_scarpa, BRAND_LOGOS, analizza_gare_atleta, calcola_vo2max_effettivo, calcola_efficienza, normalizza_dispositivo, genera_commenti_podio_ai, get_atleti_con_statistiche_settimanali, analizza_classifica_settimanale, analizza_confronto_ai
 import time
 from django.db.models import Sum, Max, Q, OuterRef, Subquery, Avg, Count
 from django.db.models.functions import TruncDate
@@ -15,8 +24,9 @@ from datetime import timedelta, timezone as dt_timezone
 import json
 from django.contrib.auth.models import User
 import csv
+import zlib
 from django_apscheduler.models import DjangoJobExecution, DjangoJob
-from .models import TaskSettings
+from .models import TaskSettings, EventoStrava
 from .models import Allenamento, Partecipazione, CommentoAllenamento, Notifica, Team, RichiestaAdesioneTeam
 from .forms import AllenamentoForm, CommentoForm, TeamForm, InvitoTeamForm, RegistrazioneUtenteForm
 from django.core.management import call_command
@@ -32,6 +42,7 @@ from django.urls import reverse
 from django.utils.dateparse import parse_datetime, parse_duration
 from django.views.decorators.csrf import csrf_exempt
 from zoneinfo import ZoneInfo
+from django.conf import settings
 
 def _get_active_team(request):
     """Helper per recuperare il team attivo dalla sessione"""
@@ -55,25 +66,20 @@ def _get_dashboard_context(user):
         # Recuperiamo il profilo
     profilo, _ = ProfiloAtleta.objects.get_or_create(user=user)
         
-        # 1. Calcolo KM Totali (da metri a km)
-    metri = Attivita.objects.filter(atleta=profilo).aggregate(Sum('distanza'))['distanza__sum'] or 0
-    totale_km = round(metri / 1000, 1)
+        # 1. Totali precalcolati (rollup AggregatoAtleta): una sola query per volume totale, anno, settimana e carico ACWR
+    today = timezone.now()
+    totali = totali_dashboard(profilo, today.date())
+    totale_km = round(totali['totale_metri'] / 1000, 1)
         
-    # 1b. Calcolo Dislivello Totale
-    dislivello_totale = Attivita.objects.filter(atleta=profilo).aggregate(Sum('dislivello'))['dislivello__sum'] or 0
+    # 1b. Dislivello Totale
+    dislivello_totale = totali['dislivello_totale']
     
-    # 1c. Calcolo Dislivello Settimanale (Lun-Dom)
-    today = timezone.now()
-    start_week = today - timedelta(days=today.weekday())
-    start_week = start_week.replace(hour=0, minute=0, second=0, microsecond=0)
-    dislivello_settimanale = Attivita.objects.filter(atleta=profilo, data__gte=start_week).aggregate(Sum('dislivello'))['dislivello__sum'] or 0
+    # 1c. Dislivello Settimanale (Lun-Dom)
+    dislivello_settimanale = totali['dislivello_settimanale']
 
-    # 1d. Calcolo Volume Annuale (Anno Corrente)
-    start_year = today.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
-    qs_anno = Attivita.objects.filter(atleta=profilo, data__gte=start_year)
-    annuale_metri = qs_anno.aggregate(Sum('distanza'))['distanza__sum'] or 0
-    annuale_km = round(annuale_metri / 1000, 1)
-    dislivello_annuale = qs_anno.aggregate(Sum('dislivello'))['dislivello__sum'] or 0
+    # 1d. Volume Annuale (Anno Corrente)
+    annuale_km = round(totali['annuale_metri'] / 1000, 1)
+    dislivello_annuale = totali['dislivello_annuale']
     
     # Calcolo medie settimanali anno corrente
     current_week = today.isocalendar()[1]
@@ -83,44 +89,21 @@ def _get_dashboard_context(user):
     # --- STORICO YTD (Year To Date) ---
     # Calcola i volumi degli anni passati fino allo stesso giorno di oggi
     storico_ytd = []
-    first_act = Attivita.objects.filter(atleta=profilo).order_by('data').first()
-    if first_act:
-        first_year = first_act.data.year
-        current_year = today.year
-        
-        for year in range(current_year - 1, first_year - 1, -1):
-            try:
-                # Data inizio anno Y
-                start_y = today.replace(year=year, month=1, day=1, hour=0, minute=0, second=0)
-                # Data fine periodo Y (stesso giorno di oggi)
-                try:
-                    end_y = today.replace(year=year, hour=23, minute=59, second=59)
-                except ValueError:
-                    # Gestione bisestile: se oggi è 29 Feb e l'anno target non lo è, usiamo 28 Feb
-                    end_y = today.replace(year=year, month=2, day=28, hour=23, minute=59, second=59)
-                
-                qs_ytd = Attivita.objects.filter(atleta=profilo, data__gte=start_y, data__lte=end_y)
-                agg = qs_ytd.aggregate(Sum('distanza'), Sum('dislivello'))
-                
-                dist_sum = agg['distanza__sum'] or 0
-                elev_sum = agg['dislivello__sum'] or 0
-                dist_km = round(dist_sum / 1000, 1)
-                
-                storico_ytd.append({
-                    'anno': year,
-                    'km': dist_km,
-                    'dplus': int(elev_sum),
-                    'avg_km': round(dist_km / max(1, current_week), 1),
-                    'avg_dplus': int(elev_sum / max(1, current_week))
-                })
-            except Exception:
-                continue
+    for year, (dist_sum, elev_sum) in volumi_ytd(profilo, today.date()).items():
+        dist_km = round(dist_sum / 1000, 1)
+        storico_ytd.append({
+            'anno': year,
+            'km': dist_km,
+            'dplus': int(elev_sum),
+            'avg_km': round(dist_km / max(1, current_week), 1),
+            'avg_dplus': int(elev_sum / max(1, current_week))
+        })
 
         # 2. Recupero le ultime 30 attività per la tabella
-    attivita_list = Attivita.objects.filter(atleta=profilo).order_by('-data')[:30]
+    attivita_list = Attivita.objects.riepilogo().filter(atleta=profilo).order_by('-data')[:30]
         
         # 3. Dati per i grafici Dashboard (Ultime 30 attività)
-    qs_charts = Attivita.objects.filter(atleta=profilo).order_by('-data')[:30]
+    qs_charts = Attivita.objects.riepilogo().filter(atleta=profilo).order_by('-data')[:30]
     chart_data = list(reversed(qs_charts))
         
         # Calcolo VAM Media (usiamo chart_data che è già una lista caricata)
@@ -279,7 +262,7 @@ def _get_dashboard_context(user):
     warning_privacy_fc = None
     if strava_connected:
         # Controlliamo le ultime 5 corse
-        last_runs = Attivita.objects.filter(atleta=profilo, tipo_attivita__in=['Run', 'TrailRun']).order_by('-data')[:5]
+        last_runs = Attivita.objects.riepilogo().filter(atleta=profilo, tipo_attivita__in=['Run', 'TrailRun']).order_by('-data')[:5]
         if last_runs.exists():
             missing_fc = sum(1 for r in last_runs if not r.fc_media or r.fc_media == 0)
             # Se più della metà non ha FC, mostriamo l'avviso
@@ -295,25 +278,10 @@ def _get_dashboard_context(user):
     allarmi = []
     
     # 1. Allarme ACWR (Acute:Chronic Workload Ratio)
-    # Calcoliamo il carico basato sui "Km Sforzo" (1km + 100m D+)
-    today_acwr = timezone.now()
-    start_acute = today_acwr - timedelta(days=7)
-    start_chronic = today_acwr - timedelta(days=28)
-    
-    qs_chronic = Attivita.objects.filter(atleta=profilo, data__gte=start_chronic, data__lte=today_acwr)
-    
-    load_acute = 0
-    load_chronic_total = 0
-    
-    for act in qs_chronic:
-        km_flat = act.distanza / 1000
-        km_vert = act.dislivello / 100
-        load_val = km_flat + km_vert # Km Sforzo
-        
-        load_chronic_total += load_val
-        if act.data >= start_acute:
-            load_acute += load_val
-            
+    # Calcoliamo il carico basato sui "Km Sforzo" (1km + 100m D+), dai rollup giornalieri:
+    # acuto = ultimi 7 giorni, cronico = ultimi 28 giorni (oggi compreso)
+    load_acute = totali['carico_acuto']
+    load_chronic_total = totali['carico_cronico_totale']
     avg_chronic = load_chronic_total / 4
     
     # Analizziamo solo se c'è un volume minimo (>10 Km Sforzo/settimana di media)
@@ -404,8 +372,7 @@ def home(request):
         if not request.user.is_authenticated:
             return JsonResponse({'status': 'Login richiesto', 'progress': 0}, status=401)
             
-        status = cache.get(f"sync_progress_{request.user.id}", {'status': 'In attesa...', 'progress': 0})
-        return JsonResponse(status)
+        return JsonResponse(stato_sincronizzazione(request.user))
     
     # Gestione Default Team al login se non settato
     if request.user.is_authenticated and 'active_team_id' not in request.session:
@@ -414,7 +381,7 @@ def home(request):
             
     try:
         if request.user.is_authenticated:
-            LogSistema.objects.create(livello='INFO', azione='Page View', utente=request.user, messaggio="Visita Dashboard")
+            registra_log(livello='INFO', azione='Page View', utente=request.user, messaggio="Visita Dashboard")
             context = _get_dashboard_context(request.user)
             context.update(_get_navbar_context(request))
             if context.get('warning_token'):
@@ -441,7 +408,7 @@ def login_standard(request):
         if form.is_valid():
             user = form.get_user()
             login(request, user)
-            LogSistema.objects.create(livello='INFO', azione='Login', utente=user, messaggio="Login standard effettuato.")
+            registra_log(livello='INFO', azione='Login', utente=user, messaggio="Login standard effettuato.")
             return redirect('home')
         else:
             messages.error(request, "Username o password non validi.")
@@ -461,7 +428,7 @@ def registrazione(request):
             # Login automatico dopo la registrazione
             login(request, user, backend='django.contrib.auth.backends.ModelBackend')
             
-            LogSistema.objects.create(livello='INFO', azione='Registrazione', utente=user, messaggio="Nuovo utente registrato (No Strava).")
+            registra_log(livello='INFO', azione='Registrazione', utente=user, messaggio="Nuovo utente registrato (No Strava).")
             messages.success(request, f"Benvenuto {user.first_name}! Registrazione completata.")
             return redirect('home')
     else:
@@ -486,7 +453,7 @@ def registrazione(request):
 def dashboard_atleta(request, username):
     """Visualizza la dashboard di un altro atleta se permesso"""
     if request.user.is_authenticated:
-        LogSistema.objects.create(livello='INFO', azione='Page View', utente=request.user, messaggio=f"Visita Dashboard di {username}")
+        registra_log(livello='INFO', azione='Page View', utente=request.user, messaggio=f"Visita Dashboard di {username}")
 
     target_user = get_object_or_404(User, username=username)
     profilo = get_object_or_404(ProfiloAtleta, user=target_user)
@@ -518,7 +485,7 @@ def analisi_gemini(request):
         profilo = request.user.profiloatleta
 
     if is_api:
-        LogSistema.objects.create(livello='INFO', azione='Analisi AI', utente=request.user, messaggio=f"Richiesta analisi personale per {profilo.user.username}")
+        registra_log(livello='INFO', azione='Analisi AI', utente=request.user, messaggio=f"Richiesta analisi personale per {profilo.user.username}")
 
     commento_ai = analizza_performance_atleta(profilo)
     profilo.ultima_analisi_ai = commento_ai
@@ -532,7 +499,7 @@ def analisi_gemini(request):
 
 def calcola_vo2max(request):
     if request.method == 'POST':
-        LogSistema.objects.create(livello='INFO', azione='Analisi AI', utente=request.user, messaggio="Richiesta analisi performance avviata.")
+        registra_log(livello='INFO', azione='Analisi AI', utente=request.user, messaggio="Richiesta analisi performance avviata.")
         profilo = request.user.profiloatleta
         hr_rest = request.POST.get('hr_rest')
         
@@ -547,19 +514,19 @@ def calcola_vo2max(request):
                 if analisi_testo:
                     profilo.ultima_analisi_ai = analisi_testo
                     profilo.save()
-                    LogSistema.objects.create(livello='INFO', azione='Analisi AI', utente=request.user, messaggio="Analisi completata e salvata.")
+                    registra_log(livello='INFO', azione='Analisi AI', utente=request.user, messaggio="Analisi completata e salvata.")
                 else:
-                    LogSistema.objects.create(livello='WARNING', azione='Analisi AI', utente=request.user, messaggio="Gemini ha restituito risposta vuota.")
+                    registra_log(livello='WARNING', azione='Analisi AI', utente=request.user, messaggio="Gemini ha restituito risposta vuota.")
             except Exception as e:
-                LogSistema.objects.create(livello='ERROR', azione='Analisi AI', utente=request.user, messaggio=f"Errore: {e}")
+                registra_log(livello='ERROR', azione='Analisi AI', utente=request.user, messaggio=f"Errore: {e}")
         else:
-            LogSistema.objects.create(livello='WARNING', azione='Analisi AI', utente=request.user, messaggio="HR Rest mancante nel form.")
+            registra_log(livello='WARNING', azione='Analisi AI', utente=request.user, messaggio="HR Rest mancante nel form.")
             
     return redirect('home')
 
 def impostazioni(request):
     if request.method == 'GET' and request.user.is_authenticated:
-        LogSistema.objects.create(livello='INFO', azione='Page View', utente=request.user, messaggio="Visita Impostazioni")
+        registra_log(livello='INFO', azione='Page View', utente=request.user, messaggio="Visita Impostazioni")
 
     profilo, _ = ProfiloAtleta.objects.get_or_create(user=request.user)
     strava_connected = SocialAccount.objects.filter(user=request.user, provider='strava').exists()
@@ -568,8 +535,9 @@ def impostazioni(request):
         # Gestione Disconnessione Strava (per aggiornare permessi o cambiare account)
         if 'disconnect_strava' in request.POST:
             SocialToken.objects.filter(account__user=request.user, account__provider='strava').delete()
+            invalida_token(request.user.id)
             SocialAccount.objects.filter(user=request.user, provider='strava').delete()
-            LogSistema.objects.create(livello='WARNING', azione='Disconnessione', utente=request.user, messaggio="Account Strava scollegato.")
+            registra_log(livello='WARNING', azione='Disconnessione', utente=request.user, messaggio="Account Strava scollegato.")
             messages.success(request, "Account Strava scollegato. Ricollegalo per aggiornare i permessi.")
             return redirect('impostazioni')
 
@@ -642,28 +610,32 @@ def aggiorna_dati_profilo(request):
         messages.error(request, "Nessun account Strava collegato.")
         return redirect('impostazioni')
 
-    token_obj = SocialToken.objects.filter(account=social_acc).first()
-    if not token_obj:
+    # Token dalla cache (rinnovato se in scadenza)
+    access_token = token_valido(request.user.id)
+    if not access_token and not SocialToken.objects.filter(account=social_acc).exists():
         messages.error(request, "Token Strava non trovato.")
         return redirect('impostazioni')
-
-    # Refresh Token per essere sicuri
-    access_token = refresh_strava_token(token_obj)
     if not access_token:
         messages.error(request, "Token scaduto. Ricollega Strava.")
         return redirect('impostazioni')
     
     # Chiamata API Diretta
-    headers = {'Authorization': f'Bearer {access_token}'}
+    if not rate_limit.acquisisci_permesso(rate_limit.INTERATTIVA):
+        messages.warning(request, f"Limite richieste Strava raggiunto. Riprova tra {rate_limit.secondi_al_reset() // 60 + 1} minuti.")
+        return redirect('impostazioni')
+
     try:
-        res = requests.get("https://www.strava.com/api/v3/athlete", headers=headers, timeout=10)
+        # Aggiornamento forzato dall'utente: niente ETag
+        res = scarica_atleta(profilo, access_token, condizionale=False)
+        rate_limit.registra_risposta(res)
         if res.status_code == 200:
             data = res.json()
+            campi_profilo = {}
             
             # Aggiornamento Peso
             weight = data.get('weight')
             if weight is not None:
-                profilo.peso = weight
+                campi_profilo['peso'] = weight
                 messages.success(request, f"Peso aggiornato da Strava: {weight} kg")
             else:
                 messages.warning(request, "Peso non disponibile su Strava. Verifica di aver concesso i permessi 'profile:read_all'.")
@@ -671,13 +643,16 @@ def aggiorna_dati_profilo(request):
             # Aggiornamento Immagine
             img = data.get('profile')
             if img:
-                profilo.immagine_profilo = img
+                campi_profilo['immagine_profilo'] = img
             
-            profilo.save()
+            cambiati = applica_modifiche(profilo, **campi_profilo)
+            if cambiati:
+                profilo.save(update_fields=cambiati)
             
             # Aggiorniamo anche i dati locali di allauth per il futuro
-            social_acc.extra_data = data
-            social_acc.save()
+            if social_acc.extra_data != data:
+                social_acc.extra_data = data
+                social_acc.save(update_fields=['extra_data'])
         else:
             messages.error(request, f"Errore API Strava: {res.status_code}")
     except Exception as e:
@@ -717,89 +692,77 @@ def hide_home_notice(request):
 
 @login_required
 def sincronizza_strava(request):
-    LogSistema.objects.create(livello='INFO', azione='Sync Manuale', utente=request.user, messaggio="Avvio sincronizzazione...")
+    """
+    Bottone "Sincronizza": aggiorna subito profilo e scarpe, poi accoda il download delle attività
+    (accoda_sincronizzazione). Il job gira nello scheduler e, se lo storico non è completo, riprende dallo StatoBackfill.
+    """
+    registra_log(livello='INFO', azione='Sync Manuale', utente=request.user, messaggio="Avvio sincronizzazione...")
     only_shoes = request.GET.get('only_shoes') == 'true'
     force_full = request.GET.get('force_full') == 'true'
-    cache_key = f"sync_progress_{request.user.id}"
-    cache.set(cache_key, {'status': 'Connessione a Strava...', 'progress': 5}, timeout=300)
-    
+
     social_acc = SocialAccount.objects.filter(user=request.user, provider='strava').first()
     if not social_acc:
-        LogSistema.objects.create(livello='WARNING', azione='Sync Manuale', utente=request.user, messaggio="SocialAccount non trovato.")
+        registra_log(livello='WARNING', azione='Sync Manuale', utente=request.user, messaggio="SocialAccount non trovato.")
         messages.error(request, "Nessun account Strava collegato. Vai nelle impostazioni.")
         return redirect('home')
 
-    token_obj = SocialToken.objects.filter(account=social_acc).first()
-    if not token_obj:
-        LogSistema.objects.create(livello='WARNING', azione='Sync Manuale', utente=request.user, messaggio="SocialToken non trovato.")
+    # 1. Token dalla cache (rinnovato se in scadenza, vedi token_cache.py)
+    access_token = token_valido(request.user.id)
+    if not access_token and not SocialToken.objects.filter(account=social_acc).exists():
+        registra_log(livello='WARNING', azione='Sync Manuale', utente=request.user, messaggio="SocialToken non trovato.")
         messages.error(request, "Token Strava mancante o scaduto. Prova a scollegare e ricollegare l'account.")
         return redirect('home')
-
-    
-    # 1. Refresh Token (Nuova logica centralizzata)
-    access_token = refresh_strava_token(token_obj)
     if not access_token:
-        LogSistema.objects.create(livello='ERROR', azione='Sync Manuale', utente=request.user, messaggio="Refresh token fallito.")
+        registra_log(livello='ERROR', azione='Sync Manuale', utente=request.user, messaggio="Refresh token fallito.")
         messages.error(request, "Il token Strava è scaduto e non può essere rinnovato. Per favore scollega e ricollega l'account nelle Impostazioni.")
         return redirect('impostazioni')
         
-    headers = {'Authorization': f'Bearer {access_token}'}
+    # Quota Strava esaurita: inutile partire, l'utente riprova alla prossima finestra
+    if not rate_limit.acquisisci_permesso(rate_limit.INTERATTIVA):
+        registra_log(livello='WARNING', azione='Sync Manuale', utente=request.user, messaggio="Rate Limit Strava: sync rimandata.")
+        messages.warning(request, f"Limite richieste Strava raggiunto. Riprova tra {rate_limit.secondi_al_reset() // 60 + 1} minuti.")
+        return redirect('home')
+
+    # Aggiorniamo il profilo atleta
+    profilo, _ = ProfiloAtleta.objects.get_or_create(user=request.user)
 
-    cache.set(cache_key, {'status': 'Aggiornamento profilo...', 'progress': 10}, timeout=300)
     # --- 2. DATI PROFILO (PESO E NOMI) ---
-    athlete_res = requests.get("https://www.strava.com/api/v3/athlete", headers=headers)
+    # Richiesta condizionale (ETag): se Strava risponde 304 profilo e scarpe non sono cambiati
+    athlete_res = scarica_atleta(profilo, access_token)
+    rate_limit.registra_risposta(athlete_res)
     
     if athlete_res.status_code == 401:
-        LogSistema.objects.create(livello='WARNING', azione='Sync Manuale', utente=request.user, messaggio="Token scaduto durante fetch profilo.")
+        registra_log(livello='WARNING', azione='Sync Manuale', utente=request.user, messaggio="Token scaduto durante fetch profilo.")
         return redirect('/accounts/strava/login/')
 
-    # Aggiorniamo il profilo atleta
-    profilo, _ = ProfiloAtleta.objects.get_or_create(user=request.user)
-
+    # 304: profilo e scarpe invariati dall'ultimo /athlete elaborato, niente da scrivere
     if athlete_res.status_code == 200:
         athlete_data = athlete_res.json()
-        # DEBUG: Verifichiamo se Strava ci manda le scarpe
-        print(f"DEBUG STRAVA: Trovate {len(athlete_data.get('shoes', []))} scarpe nel profilo.", flush=True)
-
+        campi_profilo = {}
         # Aggiorniamo il peso SOLO se Strava ce lo fornisce (evita sovrascrittura con 70kg)
         strava_weight = athlete_data.get('weight')
         if strava_weight is not None and not profilo.peso_manuale:
-            profilo.peso = strava_weight
-            print(f"DEBUG STRAVA: Peso aggiornato a {strava_weight}kg", flush=True)
+            campi_profilo['peso'] = strava_weight
         elif strava_weight is None:
-            print("DEBUG STRAVA: Peso non presente nella risposta API (verificare permessi 'profile:read_all')", flush=True)
+            registra_log(livello='WARNING', azione='Sync Manuale', utente=request.user, messaggio="Peso non presente nella risposta Strava (verificare il permesso 'profile:read_all').")
         
         # Aggiorniamo immagine profilo dall'API (più recente)
         strava_img = athlete_data.get('profile')
         if strava_img:
-            profilo.immagine_profilo = strava_img
+            campi_profilo['immagine_profilo'] = strava_img
+
+        # Scriviamo solo i campi cambiati
+        cambiati = applica_modifiche(profilo, **campi_profilo)
+        if cambiati:
+            profilo.save(update_fields=cambiati)
             
-        request.user.first_name = athlete_data.get('firstname', '')
-        request.user.last_name = athlete_data.get('lastname', '')
-        request.user.save()
-        
-        # --- SYNC SCARPE ---
-        shoes = athlete_data.get('shoes', [])
-        strava_shoe_ids = []
-        for s in shoes:
-            strava_shoe_ids.append(s['id'])
-            brand, model = normalizza_scarpa(s['name'])
-            Scarpa.objects.update_or_create(
-                strava_id=s['id'],
-                defaults={
-                    'atleta': profilo,
-                    'nome': s['name'],
-                    'distanza': s['distance'],
-                    'primary': s['primary'],
-                    'brand': brand,
-                    'modello_normalizzato': model,
-                    'retired': False # Se è nella lista, è attiva
-                }
-            )
+        cambiati = applica_modifiche(request.user, first_name=athlete_data.get('firstname', ''), last_name=athlete_data.get('lastname', ''))
+        if cambiati:
+            request.user.save(update_fields=cambiati)
         
-        # Le scarpe che abbiamo nel DB ma non sono più nella lista di Strava sono considerate "Dismesse"
-        Scarpa.objects.filter(atleta=profilo).exclude(strava_id__in=strava_shoe_ids).update(retired=True)
-    profilo.save()
+        # --- SYNC SCARPE --- (un solo upsert delle scarpe cambiate)
+        sincronizza_scarpe(profilo, athlete_data.get('shoes', []))
+        registra_etag(profilo, athlete_res)
 
     # Se richiesto solo aggiornamento scarpe, ci fermiamo qui (Sync Rapido)
     if only_shoes:
@@ -808,110 +771,15 @@ def sincronizza_strava(request):
 
     # --- CHECK BLOCCANTE: Se mancano Peso o FC Riposo, STOP ---
     if not profilo.peso or not profilo.fc_riposo:
-        LogSistema.objects.create(livello='WARNING', azione='Sync Manuale', utente=request.user, messaggio="Dati profilo (Peso/FC) mancanti.")
+        registra_log(livello='WARNING', azione='Sync Manuale', utente=request.user, messaggio="Dati profilo (Peso/FC) mancanti.")
         return redirect('impostazioni')
 
-    # --- 4. SCARICAMENTO ATTIVITÀ (FULL SYNC + CHECKPOINT) ---
-    # Cerchiamo l'ultima attività salvata per usare il parametro 'after' (Checkpoint)
-    last_activity = Attivita.objects.filter(atleta=profilo).order_by('-data').first()
-    timestamp_checkpoint = None
-    
-    # FIX: Usiamo il checkpoint solo se abbiamo completato con successo almeno una sync in passato (e non è richiesto force_full).
-    # Se data_ultima_sincronizzazione è None, significa che la prima sync è fallita o è parziale,
-    # quindi forziamo un riscaricamento completo (senza 'after') per recuperare lo storico mancante.
-    if last_activity and profilo.data_ultima_sincronizzazione and not force_full:
-        # Aggiungiamo 1 secondo per non riscaricare l'ultima attività
-        timestamp_checkpoint = int(last_activity.data.timestamp()) + 1
-    else:
-        LogSistema.objects.create(livello='INFO', azione='Sync Manuale', utente=request.user, messaggio="Avvio download completo (storico/recovery).")
-
-    url_activities = "https://www.strava.com/api/v3/athlete/activities"
-    
-    page = 1
-    per_page = 100 # Ottimizzazione: scarichiamo blocchi più grandi (max supportato ~200)
-    
-    while True:
-        params = {'page': page, 'per_page': per_page}
-        cache.set(cache_key, {'status': f'Scaricamento attività (Pagina {page})...', 'progress': min(15 + (page * 10), 80)}, timeout=300)
-        if timestamp_checkpoint:
-            params['after'] = timestamp_checkpoint
-            
-        response = requests.get(url_activities, headers=headers, params=params)
-        
-
-        if response.status_code == 401:
-            # TENTATIVO DI RECOVERY: Il token potrebbe essere revocato o scaduto nonostante il DB dica il contrario.
-            # Tentiamo un refresh forzato e riproviamo.
-            new_token = refresh_strava_token(token_obj, force=True)
-            if new_token:
-                access_token = new_token # Aggiorniamo anche la variabile locale per le chiamate successive (es. VAM)
-                headers = {'Authorization': f'Bearer {new_token}'}
-                response = requests.get(url_activities, headers=headers, params=params)
-            
-            if response.status_code == 401:
-                # Logghiamo il corpo della risposta per capire il motivo (es. Scope mancanti)
-                err_msg = f"Token rifiutato dopo refresh. Strava dice: {response.text[:150]}"
-                LogSistema.objects.create(livello='WARNING', azione='Sync Manuale', utente=request.user, messaggio=err_msg)
-                return redirect('/accounts/strava/login/')
-
-        if response.status_code == 429:
-            LogSistema.objects.create(livello='WARNING', azione='Sync Manuale', utente=request.user, messaggio="Rate Limit Strava raggiunto.")
-            break
-
-        if response.status_code != 200:
-            LogSistema.objects.create(livello='ERROR', azione='Sync Manuale', utente=request.user, messaggio=f"Errore API: {response.text}")
-            break
-            
-        activities = response.json()
-        if not activities:
-            break
-            
-
-        for act in activities:
-            # Aggiunto supporto per Hike (Trekking) trattato come Trail
-            if act['type'] in ['Run', 'TrailRun', 'Hike']:
-                # Usiamo la nuova utility centralizzata
-                processa_attivita_strava(act, profilo, access_token, force_detail_update=force_full)
-        
-        # Se la pagina è incompleta, significa che abbiamo finito
-        if len(activities) < per_page:
-            break
-            
-        page += 1
-
-    cache.set(cache_key, {'status': 'Analisi fisiologica e statistiche...', 'progress': 90}, timeout=300)
-    # --- 8. AUTO-CALCOLO FC MAX REALE ---
-    # Modifica: cattura la fc max degli ultimi 5 mesi (approx 150 giorni)
-    five_months_ago = timezone.now() - timedelta(days=150)
-    
-    # Cerchiamo l'attività con la FC più alta nel periodo per estrarre anche la data
-    best_activity = Attivita.objects.filter(
-        atleta=profilo, 
-        data__gte=five_months_ago,
-        fc_max_sessione__gt=160  # Filtriamo valori non fisiologici/bassi
-    ).order_by('-fc_max_sessione').first()
-    
-    if best_activity:
-        max_fc_reale = best_activity.fc_max_sessione
-        data_record = best_activity.data.strftime('%d/%m/%Y')
-        data_obj = best_activity.data.date()
-        
-        # Aggiorniamo il profilo al "Season Best" (ultimi 5 mesi).
-        # FIX: Se l'utente ha impostato la FC manualmente, NON sovrascriviamo.
-        if not profilo.fc_max_manuale:
-            profilo.fc_massima_teorica = max_fc_reale
-            profilo.fc_max = max_fc_reale
-            profilo.data_fc_max = data_obj
-            profilo.save()
-        else:
-            pass
-
-    # --- 9. CALCOLO VO2MAX CONSOLIDATO (MEDIA MOBILE) ---
-    profilo.data_ultima_sincronizzazione = timezone.now()
-    stima_vo2max_atleta(profilo)
-
-    cache.set(cache_key, {'status': 'Completato!', 'progress': 100}, timeout=300)
-    LogSistema.objects.create(livello='INFO', azione='Sync Manuale', utente=request.user, messaggio="Sincronizzazione completata con successo.")
+    # --- 4. SCARICAMENTO ATTIVITÀ (IN CODA) ---
+    # Il download paginato gira nello scheduler (atleti/sync.py): la richiesta web ritorna subito
+    # e la barra di avanzamento legge lo stato del job dal DB.
+    job, created = accoda_sincronizzazione(request.user, completo=force_full)
+    if not created:
+        registra_log(livello='INFO', azione='Sync Manuale', utente=request.user, messaggio=f"Sincronizzazione già in corso (job {job.id}).")
     return redirect('home')
 
 @login_required
@@ -919,27 +787,16 @@ def ricalcola_statistiche(request):
     """Ricalcola manualmente le statistiche (VO2max, ecc) per l'utente corrente"""
     profilo, _ = ProfiloAtleta.objects.get_or_create(user=request.user)
     
-    # 1. Ricalcola VO2max per ogni singola attività
-    attivita = Attivita.objects.filter(atleta=profilo)
-    count = 0
-    cleaned_count = 0
-    for act in attivita:
-        if act.distanza > 0 and act.durata > 0:
-            nuovo_vo2 = calcola_metrica_vo2max(act, profilo)
-            # Aggiorniamo anche se è None (per rimuovere valori vecchi non più validi per passo lento)
-            if act.vo2max_stimato != nuovo_vo2:
-                if nuovo_vo2 is None:
-                    cleaned_count += 1
-                act.vo2max_stimato = nuovo_vo2
-                act.save()
-                count += 1
+    # 1. Ricalcola VO2max per ogni singola attività (in blocco, salva solo le righe cambiate)
+    # Aggiorniamo anche se è None (per rimuovere valori vecchi non più validi per passo lento)
+    count, cleaned_count = ricalcola_vo2max_atleta(profilo)
 
     # 2. Aggiorna i campi aggregati del profilo
     profilo.data_ultimo_ricalcolo_statistiche = timezone.now()
     stima_vo2max_atleta(profilo)
     profilo.save()
     
-    LogSistema.objects.create(livello='INFO', azione='Ricalcolo Stats', utente=request.user, messaggio=f"Ricalcolate {count} attività.")
+    registra_log(livello='INFO', azione='Ricalcolo Stats', utente=request.user, messaggio=f"Ricalcolate {count} attività.")
     messages.success(request, f"Statistiche aggiornate: {count} ricalcolate (di cui {cleaned_count} rimosse per passo lento).")
     return redirect('home')
 
@@ -948,12 +805,12 @@ def grafici_atleta(request):
         messages.error(request, "Non hai i permessi per visualizzare i Grafici.")
         return redirect('home')
         
-    LogSistema.objects.create(livello='INFO', azione='Page View', utente=request.user, messaggio="Visita Grafici")
+    registra_log(livello='INFO', azione='Page View', utente=request.user, messaggio="Visita Grafici")
     profilo, _ = ProfiloAtleta.objects.get_or_create(user=request.user)
     
     # Recuperiamo le ultime 50 attività
     # Ordiniamo per data decrescente per prendere le ultime, poi invertiamo per l'ordine cronologico nel grafico
-    qs = Attivita.objects.filter(atleta=profilo).order_by('-data')[:50]
+    qs = Attivita.objects.riepilogo().filter(atleta=profilo).order_by('-data')[:50]
     attivita_list = list(reversed(qs))
     
     labels = []
@@ -1011,43 +868,71 @@ def elimina_attivita_anomale(request):
     """Cancella dal DB le attività con distanza > 200km (es. errori GPS o import errati)"""
     if request.user.is_authenticated:
         count, _ = Attivita.objects.filter(atleta__user=request.user, distanza__gt=200000).delete()
-        LogSistema.objects.create(livello='INFO', azione='Pulizia DB', utente=request.user, messaggio=f"Cancellate {count} attività anomale (>200km).")
+        registra_log(livello='INFO', azione='Pulizia DB', utente=request.user, messaggio=f"Cancellate {count} attività anomale (>200km).")
     return redirect('home')
 
+class _EcoCSV:
+    """Pseudo-buffer per csv.writer: write() restituisce la riga invece di accumularla"""
+    def write(self, value):
+        return value
+
+def _righe_export_attivita(profilo):
+    """Righe del CSV attività, lette a blocchi con cursore lato server (solo le colonne esportate)"""
+    writer = csv.writer(_EcoCSV())
+    # Intestazione colonne
+    yield writer.writerow(['Data', 'Tipo', 'Distanza (km)', 'Durata (min)', 'Passo (min/km)', 'FC Media', 'FC Max', 'Dislivello (m)', 'Potenza (W)', 'VO2max Stimato'])
+
+    righe = Attivita.objects.filter(atleta=profilo).order_by('-data').values_list(
+        'data', 'tipo_attivita', 'distanza', 'durata', 'passo_medio', 'fc_media', 'fc_max_sessione', 'dislivello', 'potenza_media', 'vo2max_stimato'
+    ).iterator(chunk_size=2000)
+    for data, tipo, distanza, durata, passo, fc_media, fc_max, dislivello, potenza, vo2max in righe:
+        yield writer.writerow([
+            data.strftime("%d/%m/%Y"),
+            tipo,
+            round(distanza / 1000, 2),
+            round(durata / 60, 2),
+            passo,
+            fc_media,
+            fc_max,
+            dislivello,
+            potenza,
+            vo2max
+        ])
+
+def _comprimi_gzip(righe, blocco=64 * 1024):
+    """Comprime in gzip al volo, inviando un pezzo ogni ~64KB di CSV"""
+    compressore = zlib.compressobj(wbits=31)  # 31 = formato gzip
+    buffer = []
+    dimensione = 0
+    for riga in righe:
+        buffer.append(riga)
+        dimensione += len(riga)
+        if dimensione >= blocco:
+            yield compressore.compress(''.join(buffer).encode('utf-8'))
+            buffer, dimensione = [], 0
+    yield compressore.compress(''.join(buffer).encode('utf-8')) + compressore.flush()
+
 def export_csv(request):
-    """Esporta le attività dell'atleta in formato CSV"""
+    """Esporta le attività dell'atleta in formato CSV (?formato=gz per il file compresso)"""
     if not request.user.is_authenticated:
         return redirect('home')
         
     profilo, _ = ProfiloAtleta.objects.get_or_create(user=request.user)
-    
-    response = HttpResponse(
+
+    # Risposta in streaming: memoria costante e primi byte subito, anche con migliaia di attività
+    righe = _righe_export_attivita(profilo)
+    if request.GET.get('formato') == 'gz':
+        return StreamingHttpResponse(
+            _comprimi_gzip(righe),
+            content_type='application/gzip',
+            headers={'Content-Disposition': 'attachment; filename="attivita_barilla_monitor.csv.gz"'},
+        )
+    return StreamingHttpResponse(
+        righe,
         content_type='text/csv',
         headers={'Content-Disposition': 'attachment; filename="attivita_barilla_monitor.csv"'},
     )
 
-    writer = csv.writer(response)
-    # Intestazione colonne
-    writer.writerow(['Data', 'Tipo', 'Distanza (km)', 'Durata (min)', 'Passo (min/km)', 'FC Media', 'FC Max', 'Dislivello (m)', 'Potenza (W)', 'VO2max Stimato'])
-
-    attivita_list = Attivita.objects.filter(atleta=profilo).order_by('-data')
-
-    for act in attivita_list:
-        writer.writerow([
-            act.data.strftime("%d/%m/%Y"),
-            act.tipo_attivita,
-            round(act.distanza / 1000, 2),
-            round(act.durata / 60, 2),
-            act.passo_medio,
-            act.fc_media,
-            act.fc_max_sessione,
-            act.dislivello,
-            act.potenza_media,
-            act.vo2max_stimato
-        ])
-
-    return response
-
 def export_profile_csv(request):
     """Esporta i dati aggregati del profilo in CSV (Dashboard Stats)"""
     if not request.user.is_authenticated:
@@ -1099,7 +984,7 @@ def riepilogo_atleti(request):
         messages.error(request, "Non hai i permessi per visualizzare il Riepilogo Atleti.")
         return redirect('home')
     
-    LogSistema.objects.create(livello='INFO', azione='Page View', utente=request.user, messaggio="Visita Riepilogo Atleti")
+    registra_log(livello='INFO', azione='Page View', utente=request.user, messaggio="Visita Riepilogo Atleti")
     
     # 1. Recupero Dati e Podio (Logica spostata in utils)
     atleti, active_atleti, podio = get_atleti_con_statistiche_settimanali()
@@ -1181,7 +1066,7 @@ def gare_atleta(request):
         messages.error(request, "Non hai i permessi per visualizzare le Gare.")
         return redirect('home')
     
-    LogSistema.objects.create(livello='INFO', azione='Page View', utente=request.user, messaggio="Visita Gare")
+    registra_log(livello='INFO', azione='Page View', utente=request.user, messaggio="Visita Gare")
     profilo = request.user.profiloatleta
     
     # Gestione salvataggio piazzamento
@@ -1205,7 +1090,7 @@ def gare_atleta(request):
         return redirect('gare_atleta')
 
     # Strava workout_type: 1 = Race (Gara)
-    gare = Attivita.objects.filter(atleta=profilo, workout_type=1).order_by('-data')
+    gare = Attivita.objects.riepilogo().filter(atleta=profilo, workout_type=1).order_by('-data')
     
     # Calcolo Statistiche
     stats = {
@@ -1278,7 +1163,7 @@ def analisi_gare_ai(request):
 def guida_utente(request):
     """Pagina di documentazione per gli utenti"""
     if request.user.is_authenticated:
-        LogSistema.objects.create(livello='INFO', azione='Page View', utente=request.user, messaggio="Visita Guida Utente")
+        registra_log(livello='INFO', azione='Page View', utente=request.user, messaggio="Visita Guida Utente")
     return render(request, 'atleti/guida.html')
 
 def _get_coach_dashboard_context(week_offset, active_team=None):
@@ -1293,7 +1178,7 @@ def _get_coach_dashboard_context(week_offset, active_team=None):
 
     # Base QuerySets (Escludiamo Mastra e chi ha la privacy attiva)
     base_qs = ProfiloAtleta.objects.exclude(user__username='mastra').exclude(escludi_statistiche_coach=True)
-    activity_base_qs = Attivita.objects.exclude(atleta__user__username='mastra').exclude(atleta__escludi_statistiche_coach=True)
+    activity_base_qs = Attivita.objects.riepilogo().exclude(atleta__user__username='mastra').exclude(atleta__escludi_statistiche_coach=True)
 
     # FILTRO TEAM
     if active_team:
@@ -1356,15 +1241,21 @@ def _get_coach_dashboard_context(week_offset, active_team=None):
     top_utmb = base_qs.filter(indice_utmb__gt=0).select_related('user').order_by('-indice_utmb')[:5]
     
     # Definiamo all_atleti qui, prima di usarlo nei cicli successivi
-    all_atleti = base_qs.select_related('user').all()
+    all_atleti = list(base_qs.select_related('user'))
+
+    # FIX: Per la settimana corrente (offset 0), calcoliamo ACWR su finestra mobile reale (fino a oggi)
+    # per evitare falsi allarmi "Detraining" a inizio settimana.
+    # Per lo storico, manteniamo il calcolo a fine settimana.
+    acwr_ref_date = timezone.now() if week_offset == 0 else target_week_end
+
+    # Potenza, trend, ACWR e potenziale di tutta la squadra in poche query (niente query per atleta)
+    analisi = analizza_atleti_batch([a.id for a in all_atleti], cutoff_date=target_week_end, acwr_ref_date=acwr_ref_date)
 
     # 9. Top Power (W)
     atleti_power = []
     for a in all_atleti:
-        # Calcoliamo la potenza media recente (ultime 30 attività)
-        qs_p = Attivita.objects.filter(atleta=a).order_by('-data')[:30]
-        p_vals = [act.potenza_media for act in qs_p if act.potenza_media and act.potenza_media > 0]
-        avg_p = int(sum(p_vals) / len(p_vals)) if p_vals else 0
+        # Potenza media recente (ultime 30 attività)
+        avg_p = analisi[a.id]['power']
         if avg_p > 0:
             atleti_power.append({'atleta': a, 'power': avg_p})
     
@@ -1374,7 +1265,7 @@ def _get_coach_dashboard_context(week_offset, active_team=None):
     atleti_trends = []
     
     for a in all_atleti:
-        trends = calcola_trend_atleta(a, cutoff_date=target_week_end)
+        trends = analisi[a.id]['trends']
         if trends:
             atleti_trends.append({'atleta': a, 'trends': trends})
     
@@ -1389,31 +1280,11 @@ def _get_coach_dashboard_context(week_offset, active_team=None):
     # 7. Allarmi ACWR (Acute:Chronic Workload Ratio) - Sostituisce VO2max drop
     # Calcoliamo il carico basato sui "Km Sforzo" (1km + 100m D+)
     acwr_alerts = []
-    
-    # FIX: Per la settimana corrente (offset 0), calcoliamo ACWR su finestra mobile reale (fino a oggi)
-    # per evitare falsi allarmi "Detraining" a inizio settimana.
-    # Per lo storico, manteniamo il calcolo a fine settimana.
-    acwr_ref_date = timezone.now() if week_offset == 0 else target_week_end
 
     for a in all_atleti:
-        # Definiamo finestre temporali
-        start_acute = acwr_ref_date - timedelta(days=7)
-        start_chronic = acwr_ref_date - timedelta(days=28)
-        
-        # Recuperiamo attività degli ultimi 28gg
-        qs_chronic = Attivita.objects.filter(atleta=a, data__gte=start_chronic, data__lt=acwr_ref_date)
-        
-        load_acute = 0
-        load_chronic_total = 0
-        
-        for act in qs_chronic:
-            km_flat = act.distanza / 1000
-            km_vert = act.dislivello / 100
-            load_val = km_flat + km_vert # Km Sforzo
-            
-            load_chronic_total += load_val
-            if act.data >= start_acute:
-                load_acute += load_val
+        # Carico acuto (7gg) e cronico (28gg) già calcolati nel batch
+        load_acute = analisi[a.id]['load_acute']
+        load_chronic_total = analisi[a.id]['load_chronic_total']
         
         avg_chronic = load_chronic_total / 4
         
@@ -1439,13 +1310,13 @@ def _get_coach_dashboard_context(week_offset, active_team=None):
         'Non Classificato': [],
     }
     for a in all_atleti:
-        potenziale = stima_potenziale_gara(a)
+        potenziale = analisi[a.id]['potenziale']
         if potenziale in readiness_buckets:
             readiness_buckets[potenziale].append(a)
             
     # Calcolo percentuali
     readiness = {}
-    total_count = all_atleti.count()
+    total_count = len(all_atleti)
     
     for category, athletes in readiness_buckets.items():
         count = len(athletes)
@@ -1457,8 +1328,8 @@ def _get_coach_dashboard_context(week_offset, active_team=None):
 
     # Calcolo percentuale inattivi
     perc_inattivi = 0
-    if all_atleti.count() > 0:
-        perc_inattivi = round((atleti_inattivi.count() / all_atleti.count()) * 100, 1)
+    if all_atleti:
+        perc_inattivi = round((atleti_inattivi.count() / len(all_atleti)) * 100, 1)
 
     return {
         'vo2_labels': json.dumps(list(vo2_ranges.keys())),
@@ -1482,9 +1353,25 @@ def _get_coach_dashboard_context(week_offset, active_team=None):
         'week_label': f"Dal {target_week_start.strftime('%d/%m')} al {target_week_end.strftime('%d/%m')}",
         'prev_offset': week_offset - 1,
         'next_offset': week_offset + 1,
-        'total_athletes': all_atleti.count()
+        'total_athletes': len(all_atleti)
     }
 
+def _get_coach_context_cached(week_offset, active_team=None):
+    """
+    Contesto coach con snapshot per le settimane chiuse (offset negativi): una settimana passata
+    si calcola una volta e si rilegge finché non cambiano le sue attività o i membri del team.
+    """
+    if week_offset >= 0:
+        return _get_coach_dashboard_context(week_offset, active_team)
+
+    today = timezone.now().date()
+    settimana_inizio = today - timedelta(days=today.weekday()) + timedelta(weeks=week_offset)
+    context = leggi_snapshot_coach(active_team, settimana_inizio)
+    if context is None:
+        context = _get_coach_dashboard_context(week_offset, active_team)
+        salva_snapshot_coach(active_team, settimana_inizio, context)
+    return context
+
 def dashboard_coach(request):
     """Dashboard generale per il coach: stato squadra, trend e inattività"""
     if not (request.user.is_staff or request.user.has_perm('atleti.access_coach_dashboard')):
@@ -1499,9 +1386,9 @@ def dashboard_coach(request):
     
     if week_offset > 0: week_offset = 0
 
-    LogSistema.objects.create(livello='INFO', azione='Page View', utente=request.user, messaggio="Visita Dashboard Coach")
+    registra_log(livello='INFO', azione='Page View', utente=request.user, messaggio="Visita Dashboard Coach")
     active_team = _get_active_team(request)
-    context = _get_coach_dashboard_context(week_offset, active_team)
+    context = _get_coach_context_cached(week_offset, active_team)
     context.update(_get_navbar_context(request))
     return render(request, 'atleti/dashboard_coach.html', context)
 
@@ -1516,7 +1403,7 @@ def analisi_coach_gemini(request):
         week_offset = 0
         
     active_team = _get_active_team(request)
-    context = _get_coach_dashboard_context(week_offset, active_team)
+    context = _get_coach_context_cached(week_offset, active_team)
     analisi_testo = analizza_squadra_coach(context)
     
     return JsonResponse({'analisi': analisi_testo})
@@ -1526,7 +1413,7 @@ def scheduler_logs(request):
     if not request.user.is_staff:
         return redirect('home')
     
-    LogSistema.objects.create(livello='INFO', azione='Page View', utente=request.user, messaggio="Visita Log Scheduler")
+    registra_log(livello='INFO', azione='Page View', utente=request.user, messaggio="Visita Log Scheduler")
     logs = DjangoJobExecution.objects.exclude(job__id='system_heartbeat').order_by('-run_time')[:50]
     jobs = DjangoJob.objects.exclude(id='system_heartbeat').order_by('next_run_time')
     
@@ -1564,12 +1451,14 @@ def run_task_manually(request, task_id):
     setting, created = TaskSettings.objects.get_or_create(task_id=task_id)
     setting.manual_trigger = True
     setting.save()
+    # Sveglia subito lo scheduler (LISTEN/NOTIFY); il polling dell'heartbeat resta come fallback
+    notifica_task_manuale(task_id)
     
     # DEBUG: Conferma salvataggio su log applicativo
     print(f"WEB: Richiesta manuale per '{task_id}' salvata. Flag manual_trigger=True.", flush=True)
-    LogSistema.objects.create(livello='INFO', azione='Task Manuale', utente=request.user, messaggio=f"Richiesto avvio manuale di {task_id}")
+    registra_log(livello='INFO', azione='Task Manuale', utente=request.user, messaggio=f"Richiesto avvio manuale di {task_id}")
     
-    messages.success(request, f"Richiesta inviata per '{task_id}'. Lo scheduler lo eseguirà entro 10 secondi.")
+    messages.success(request, f"Richiesta inviata per '{task_id}'. Lo scheduler lo avvierà a breve.")
     return redirect('scheduler_logs')
 
 def scheduler_logs_update(request):
@@ -1659,7 +1548,7 @@ def confronto_attivita(request):
         try:
             profilo = ProfiloAtleta.objects.get(user_id=user_id)
             # Prendiamo tutte le attività (rimosso limite)
-            attivita = Attivita.objects.filter(atleta=profilo).order_by('-data')[:60]
+            attivita = Attivita.objects.riepilogo().filter(atleta=profilo).order_by('-data')[:60]
             data = []
             for a in attivita:
                 label = f"{a.data.strftime('%d/%m/%Y')} - {a.nome or 'Attività'} ({round(a.distanza/1000, 1)}km, {a.dislivello}m D+)"
@@ -1816,7 +1705,7 @@ def attrezzatura_scarpe(request):
         messages.error(request, "Non hai i permessi per visualizzare l'Attrezzatura.")
         return redirect('home')
         
-    LogSistema.objects.create(livello='INFO', azione='Page View', utente=request.user, messaggio="Visita Attrezzatura")
+    registra_log(livello='INFO', azione='Page View', utente=request.user, messaggio="Visita Attrezzatura")
     
     # FIX MANUALE: Rinormalizzazione DB su richiesta (per applicare le nuove regex ai dati vecchi)
     if request.GET.get('fix_names'):
@@ -1910,7 +1799,7 @@ def statistiche_dispositivi(request):
         messages.error(request, "Non hai i permessi per visualizzare i Dispositivi.")
         return redirect('home')
         
-    LogSistema.objects.create(livello='INFO', azione='Page View', utente=request.user, messaggio="Visita Statistiche Dispositivi")
+    registra_log(livello='INFO', azione='Page View', utente=request.user, messaggio="Visita Statistiche Dispositivi")
     
     from django.db.models import Count
     
@@ -1965,50 +1854,41 @@ def statistiche_log(request):
         messages.error(request, "Accesso negato.")
         return redirect('home')
 
-    LogSistema.objects.create(livello='INFO', azione='Page View', utente=request.user, messaggio="Visita Statistiche Log")
+    registra_log(livello='INFO', azione='Page View', utente=request.user, messaggio="Visita Statistiche Log")
 
     # 1. Filtro base: Escludiamo task tecnici/automatici
-    # Escludiamo 'Token Refresh', 'Import Attività' (generato da sync), 'Calcolo VAM'
-    logs_qs = LogSistema.objects.exclude(azione__in=['Token Refresh', 'Import Attività', 'Calcolo VAM', 'System', 'Token Refresh'])
+    # Escludiamo 'Token Refresh', 'Import Attività' (generato da sync), 'Calcolo VAM', 'Download Stream'
+    logs_qs = log_utente()
+
+    # Storico dai rollup giornalieri (job notturno) + giorno corrente dai log grezzi
+    stats = statistiche_aggregate(giorni_grafico=14)
     
     # 2. Pagine più visitate (Azione = 'Page View')
-    # Estraiamo il nome della pagina dal messaggio "Visita [NomePagina]"
-    page_logs = logs_qs.filter(azione='Page View').values('messaggio')
-    page_counts = {}
-    for log in page_logs:
-        page = log['messaggio'].replace('Visita ', '')
-        page_counts[page] = page_counts.get(page, 0) + 1
-    
-    # Sort and top 10
-    sorted_pages = sorted(page_counts.items(), key=lambda x: x[1], reverse=True)[:10]
+    sorted_pages = sorted(stats['pagine'].items(), key=lambda x: x[1], reverse=True)[:10]
     page_stats = [{'page': k, 'count': v} for k, v in sorted_pages]
 
     # 3. Utenti più attivi (Top 10)
-    user_stats_qs = logs_qs.exclude(utente__isnull=True).values('utente__username', 'utente__first_name', 'utente__last_name').annotate(count=Count('id')).order_by('-count')[:10]
+    top_users = sorted(stats['utenti'].items(), key=lambda x: x[1], reverse=True)[:10]
+    users_map = User.objects.in_bulk([int(uid) for uid, _ in top_users])
     
     user_stats = []
-    for u in user_stats_qs:
-        display_name = f"{u['utente__first_name']} {u['utente__last_name']}" if u['utente__first_name'] else u['utente__username']
-        user_stats.append({'user': display_name, 'count': u['count']})
+    for uid, count in top_users:
+        u = users_map.get(int(uid))
+        if not u:
+            continue
+        display_name = f"{u.first_name} {u.last_name}" if u.first_name else u.username
+        user_stats.append({'user': display_name, 'count': count})
 
     # 4. Distribuzione Azioni (Che cosa fanno gli utenti?)
     # Escludiamo Page View per vedere le azioni "attive" (Sync, Analisi, ecc)
-    action_stats_qs = logs_qs.exclude(azione='Page View').values('azione').annotate(count=Count('id')).order_by('-count')
-    
-    action_stats = [{'azione': item['azione'], 'count': item['count']} for item in action_stats_qs]
+    action_stats = [{'azione': k, 'count': v} for k, v in sorted(stats['azioni'].items(), key=lambda x: x[1], reverse=True)]
 
     # 5. Attività nel tempo (Ultimi 14 giorni)
     start_date = timezone.now().date() - timedelta(days=14)
     
-    # Totale attività (Log totali)
-    daily_stats_qs = logs_qs.filter(data__date__gte=start_date).annotate(day=TruncDate('data')).values('day').annotate(count=Count('id')).order_by('day')
-    
-    # Accessi univoci (Utenti distinti per giorno)
-    daily_unique_qs = logs_qs.exclude(utente__isnull=True).filter(data__date__gte=start_date).annotate(day=TruncDate('data')).values('day').annotate(unique_count=Count('utente', distinct=True)).order_by('day')
-    
-    # Allineamento date (per coprire giorni vuoti e sincronizzare i due dataset)
-    stats_dict = {item['day']: item['count'] for item in daily_stats_qs}
-    unique_dict = {item['day']: item['unique_count'] for item in daily_unique_qs}
+    # Totale attività (Log totali) e accessi univoci (Utenti distinti per giorno)
+    stats_dict = stats['totali_giornalieri']
+    unique_dict = stats['univoci_giornalieri']
     
     daily_labels = []
     daily_data = []
@@ -2235,15 +2115,9 @@ def crea_allenamento(request):
                     if allenamento.indirizzo:
                         query = f"{allenamento.indirizzo}, {allenamento.luogo}"
                         
-                    headers = {'User-Agent': 'BarillaMonitor/1.0'}
-                    url = "https://nominatim.openstreetmap.org/search"
-                    params = {'format': 'json', 'q': query, 'limit': 1}
-                    res = requests.get(url, headers=headers, params=params, timeout=5)
-                    if res.status_code == 200:
-                        data = res.json()
-                        if data:
-                            allenamento.latitudine = float(data[0]['lat'])
-                            allenamento.longitudine = float(data[0]['lon'])
+                    coordinate = strava_client.geocodifica(query)
+                    if coordinate:
+                        allenamento.latitudine, allenamento.longitudine = coordinate
                 except Exception as e:
                     print(f"Errore Geocoding Server-Side: {e}")
             # ------------------------
@@ -2453,14 +2327,9 @@ def modifica_allenamento(request, pk):
                     if obj.indirizzo:
                         query = f"{obj.indirizzo}, {obj.luogo}"
                         
-                    headers = {'User-Agent': 'BarillaMonitor/1.0'}
-                    url = "https://nominatim.openstreetmap.org/search"
-                    params = {'format': 'json', 'q': query, 'limit': 1}
-                    res = requests.get(url, headers=headers, params=params, timeout=5)
-                    if res.status_code == 200 and res.json():
-                        data = res.json()[0]
-                        obj.latitudine = float(data['lat'])
-                        obj.longitudine = float(data['lon'])
+                    coordinate = strava_client.geocodifica(query)
+                    if coordinate:
+                        obj.latitudine, obj.longitudine = coordinate
                 except Exception:
                     pass
 
@@ -3185,7 +3054,7 @@ def api_coach_dashboard(request):
     else:
         active_team = _get_active_team(request) # Fallback sessione
 
-    context = _get_coach_dashboard_context(week_offset, active_team)
+    context = _get_coach_context_cached(week_offset, active_team)
     
     # Helper per serializzare liste di atleti/oggetti complessi
     def serialize_athlete_list(obj_list, value_key=None):
@@ -3356,3 +3225,55 @@ def api_team_list(request):
         } for i in invites]
     }
     return JsonResponse(data)
+
+@csrf_exempt
+def strava_webhook(request):
+    """
+    Endpoint per le Push Subscription di Strava.
+    GET: validazione della sottoscrizione (hub.challenge).
+    POST: ricezione evento. Lo salviamo in coda e rispondiamo subito (Strava richiede risposta entro 2 secondi);
+    l'elaborazione avviene nel task 'elabora_eventi_strava'. Il payload non è firmato: cancellazioni e revoche
+    vengono verificate con Strava prima di applicarle.
+    """
+    if request.method == 'GET':
+        verify_token = settings.STRAVA_WEBHOOK_VERIFY_TOKEN
+        if (
+            request.GET.get('hub.mode') == 'subscribe'
+            and verify_token
+            and request.GET.get('hub.verify_token') == verify_token
+        ):
+            return JsonResponse({'hub.challenge': request.GET.get('hub.challenge')})
+        return JsonResponse({'error': 'Verifica fallita'}, status=403)
+
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Metodo non consentito'}, status=405)
+
+    try:
+        evento = json.loads(request.body)
+        object_type = evento['object_type']
+        aspect_type = evento['aspect_type']
+        object_id = int(evento['object_id'])
+        owner_id = int(evento['owner_id'])
+        event_time = int(evento['event_time'])
+        subscription_id = int(evento.get('subscription_id') or 0)
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Payload non valido'}, status=400)
+
+    # Accettiamo solo eventi della nostra sottoscrizione: senza ID configurato non possiamo riconoscerli
+    if not settings.STRAVA_WEBHOOK_SUBSCRIPTION_ID:
+        return JsonResponse({'error': 'Sottoscrizione non configurata'}, status=403)
+    if subscription_id != int(settings.STRAVA_WEBHOOK_SUBSCRIPTION_ID):
+        return JsonResponse({'error': 'Sottoscrizione sconosciuta'}, status=403)
+
+    if object_type not in ('activity', 'athlete') or aspect_type not in ('create', 'update', 'delete'):
+        return JsonResponse({'status': 'ignorato'})
+
+    updates = evento.get('updates') or {}
+    EventoStrava.objects.get_or_create(
+        object_type=object_type,
+        object_id=object_id,
+        aspect_type=aspect_type,
+        event_time=event_time,
+        defaults={'owner_id': owner_id, 'updates': updates if isinstance(updates, dict) else {}},
+    )
+    return JsonResponse({'status': 'ok'})
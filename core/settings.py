@@ -173,6 +173,53 @@ SOCIALACCOUNT_LOGIN_ON_GET = True
 APSCHEDULER_DATETIME_FORMAT = "N j, Y, f:s a"
 APSCHEDULER_RUN_NOW_TIMEOUT = 25  # Secondi
 
+# Sync Strava parallelo (task_sync_strava)
+STRAVA_SYNC_WORKERS = int(os.environ.get('STRAVA_SYNC_WORKERS', '4'))  # Atleti sincronizzati in parallelo
+STRAVA_PREFETCH_WORKERS = int(os.environ.get('STRAVA_PREFETCH_WORKERS', '4'))  # Dettagli/stream di una pagina scaricati in parallelo
+SYNC_QUEUE_WORKERS = int(os.environ.get('SYNC_QUEUE_WORKERS', '2'))  # Job di sync manuale eseguiti in parallelo dallo scheduler
+
+# Cache condivisa tra web e scheduler (blocco rate limit, lock di rinnovo token, commenti AI del podio): la LocMemCache
+# di default è per processo. DatabaseCache (tabella creata dalla migrazione 0056); con REDIS_URL si usa Redis (pacchetto 'redis').
+if os.environ.get('REDIS_URL'):
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': os.environ['REDIS_URL']}}
+else:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'atleti_cache'}}
+
+# Rate limit Strava condiviso (atleti/rate_limit.py). I limiti reali arrivano dagli header delle risposte.
+STRAVA_LIMITE_15MIN = int(os.environ.get('STRAVA_LIMITE_15MIN', '100'))
+STRAVA_LIMITE_GIORNALIERO = int(os.environ.get('STRAVA_LIMITE_GIORNALIERO', '1000'))
+STRAVA_RISERVA_INTERATTIVA = float(os.environ.get('STRAVA_RISERVA_INTERATTIVA', '0.2'))  # Quota lasciata alle sync manuali
+
+# Client HTTP Strava/Nominatim condiviso (atleti/strava_client.py)
+# Connessioni keep-alive per host: almeno i thread che scaricano insieme (sync e coda, ognuno col suo prefetch, più webhook e web)
+STRAVA_HTTP_POOL = int(os.environ.get('STRAVA_HTTP_POOL', (STRAVA_SYNC_WORKERS + SYNC_QUEUE_WORKERS) * STRAVA_PREFETCH_WORKERS + 4))
+STRAVA_HTTP_TENTATIVI = int(os.environ.get('STRAVA_HTTP_TENTATIVI', '3'))  # Ripetizioni su errori 5xx (con permesso del rate limiter) e di connessione
+STRAVA_HTTP_TIMEOUT_CONNESSIONE = float(os.environ.get('STRAVA_HTTP_TIMEOUT_CONNESSIONE', '5'))
+STRAVA_HTTP_TIMEOUT_LETTURA = float(os.environ.get('STRAVA_HTTP_TIMEOUT_LETTURA', '30'))
+
+# Webhook Strava (Push Subscription). Se la sottoscrizione è attiva il polling diventa solo riconciliazione.
+STRAVA_WEBHOOK_VERIFY_TOKEN = os.environ.get('STRAVA_WEBHOOK_VERIFY_TOKEN', '')
+STRAVA_WEBHOOK_SUBSCRIPTION_ID = os.environ.get('STRAVA_WEBHOOK_SUBSCRIPTION_ID', '')  # Obbligatorio: senza, il webhook rifiuta gli eventi
+
+# Snapshot dashboard coach delle settimane chiuse (atleti/snapshot.py). Oltre questa età si ricalcolano
+# comunque, perché distribuzione VO2max e ranking ITRA/UTMB dipendono dai valori attuali dei profili.
+SNAPSHOT_COACH_ORE = int(os.environ.get('SNAPSHOT_COACH_ORE', '24'))
+
+# Scrittura asincrona dei LogSistema (atleti/log_buffer.py)
+LOG_BUFFER_ASINCRONO = os.environ.get('LOG_BUFFER_ASINCRONO', 'True') == 'True'
+LOG_BUFFER_BATCH = int(os.environ.get('LOG_BUFFER_BATCH', '200'))  # Righe per bulk_create
+LOG_BUFFER_INTERVALLO = float(os.environ.get('LOG_BUFFER_INTERVALLO', '2'))  # Secondi massimi prima del flush
+LOG_BUFFER_MAX = int(os.environ.get('LOG_BUFFER_MAX', '10000'))  # Oltre, si scrive in linea
+LOG_RETENTION_GIORNI = int(os.environ.get('LOG_RETENTION_GIORNI', '90'))  # Log grezzi conservati dopo l'aggregazione (0 = per sempre)
+LOG_PARTIZIONI_AVANTI = int(os.environ.get('LOG_PARTIZIONI_AVANTI', '3'))  # Partizioni mensili create in anticipo (PostgreSQL)
+LOG_ARCHIVIA_PARTIZIONI = os.environ.get('LOG_ARCHIVIA_PARTIZIONI', 'False') == 'True'  # Partizioni scadute rinominate *_archivio invece di DROP
+
+# Scheduler: con LISTEN/NOTIFY attivo l'heartbeat che cerca i task manuali è solo un fallback lento
+SCHEDULER_POLL_FALLBACK = int(os.environ.get('SCHEDULER_POLL_FALLBACK', '60'))  # Secondi (10 senza PostgreSQL)
+SCHEDULER_WORKERS = int(os.environ.get('SCHEDULER_WORKERS', '10'))  # Job pianificati eseguiti in parallelo
+SCHEDULER_WORKERS_MANUALI = int(os.environ.get('SCHEDULER_WORKERS_MANUALI', '4'))  # Task avviati a mano in parallelo
+SCHEDULER_ATTESA_GRUPPI = int(os.environ.get('SCHEDULER_ATTESA_GRUPPI', '7200'))  # Secondi di attesa di un job pianificato se il suo gruppo esclusivo è occupato
+
 # certificato
 CSRF_TRUSTED_ORIGINS = os.getenv('CSRF_TRUSTED_ORIGINS', 'http://localhost:8000').split(',')
 
@@ -231,4 +278,7 @@ LOGGING = {
     },
 }
 MEDIA_URL = '/media/'
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
\ No newline at end of file
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Archivio locale degli stream Strava (.npz compressi, vedi atleti/streams.py)
+STREAMS_ROOT = os.environ.get('STREAMS_ROOT', os.path.join(MEDIA_ROOT, 'streams'))
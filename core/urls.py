@@ -67,6 +67,7 @@ urlpatterns = [
     path('api/coach/dashboard/', views.api_coach_dashboard, name='api_coach_dashboard'),
     path('api/athletes/summary/', views.api_athletes_summary, name='api_athletes_summary'),
     path('api/teams/', views.api_team_list, name='api_team_list'),
+    path('api/strava/webhook/', views.strava_webhook, name='strava_webhook'),
     path('guida/', views.guida_utente, name='guida_utente'),
     path('confronto/', views.confronto_attivita, name='confronto_attivita'),
     path('confronto/analisi-ai/', views.analisi_confronto_ai_view, name='analisi_confronto_ai'),